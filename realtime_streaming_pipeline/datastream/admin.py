@@ -1,3 +1,13 @@
 from django.contrib import admin
+from .models import AlertRule, ShardCheckpoint
 
-# Register your models here.
+@admin.register(AlertRule)
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'data_type', 'alert', 'severity', 'priority', 'enabled')
+    list_filter = ('data_type', 'severity', 'enabled')
+    search_fields = ('name', 'alert')
+
+@admin.register(ShardCheckpoint)
+class ShardCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('stream_name', 'shard_id', 'sequence_number', 'finished', 'updated_at')
+    list_filter = ('stream_name', 'finished')
@@ -0,0 +1,293 @@
+"""
+KPL-compatible record aggregation.
+
+An aggregated Kinesis record is laid out exactly like the ones written by the
+Kinesis Producer Library, so KCL consumers can read it too:
+
+    magic (4 bytes) | AggregatedRecord protobuf | MD5 of the protobuf (16 bytes)
+
+    message AggregatedRecord {
+        repeated string partition_key_table = 1;
+        repeated string explicit_hash_key_table = 2;
+        repeated Record records = 3;
+    }
+    message Record {
+        required uint64 partition_key_index = 1;
+        optional uint64 explicit_hash_key_index = 2;
+        required bytes data = 3;
+        repeated Tag tags = 4;
+    }
+
+The protobuf wire format is encoded by hand so no extra dependency is needed
+on the producer or in the Lambda package.
+"""
+import base64
+import bisect
+import hashlib
+from .partitioning import hash_key_for
+
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+DIGEST_SIZE = 16
+
+# KPL's AggregationMaxSize default; the hard Kinesis limit is 1 MB per record
+DEFAULT_MAX_AGGREGATE_BYTES = 51200
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _length_delimited(field_number, payload):
+    return _varint((field_number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _field_size(payload_len):
+    # One-byte key for field numbers 1-15, length prefix, payload
+    return 1 + len(_varint(payload_len)) + payload_len
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf):
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field_number, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        yield field_number, value
+
+
+class RecordAggregator:
+    """
+    Packs user records into a single KPL aggregated record.
+
+    ``add()`` returns False when the record does not fit in the current
+    aggregate; call ``build()`` to emit it and start a new one.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_AGGREGATE_BYTES):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        self._partition_keys = {}
+        self._hash_keys = {}
+        self._records = []
+        self._size = len(KPL_MAGIC) + DIGEST_SIZE
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def partition_key(self):
+        return next(iter(self._partition_keys), None)
+
+    @property
+    def explicit_hash_key(self):
+        return next(iter(self._hash_keys), None)
+
+    def add(self, partition_key, data, explicit_hash_key=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        added = 0
+        pk_index = self._partition_keys.get(partition_key)
+        if pk_index is None:
+            pk_index = len(self._partition_keys)
+            added += _field_size(len(partition_key.encode('utf-8')))
+
+        ehk_index = None
+        if explicit_hash_key is not None:
+            ehk_index = self._hash_keys.get(explicit_hash_key)
+            if ehk_index is None:
+                ehk_index = len(self._hash_keys)
+                added += _field_size(len(explicit_hash_key.encode('utf-8')))
+
+        message = b'\x08' + _varint(pk_index)
+        if ehk_index is not None:
+            message += b'\x10' + _varint(ehk_index)
+        message += _length_delimited(3, data)
+        added += _field_size(len(message))
+
+        # A record that is too big on its own still goes out as a
+        # single-record aggregate
+        if self._records and self._size + added > self.max_size:
+            return False
+
+        self._partition_keys.setdefault(partition_key, pk_index)
+        if ehk_index is not None:
+            self._hash_keys.setdefault(explicit_hash_key, ehk_index)
+        self._records.append(message)
+        self._size += added
+        return True
+
+    def build(self):
+        """
+        Return the aggregated bytes and reset the aggregator
+        """
+        body = bytearray()
+        for key in self._partition_keys:
+            body += _length_delimited(1, key.encode('utf-8'))
+        for key in self._hash_keys:
+            body += _length_delimited(2, key.encode('utf-8'))
+        for message in self._records:
+            body += _length_delimited(3, message)
+        body = bytes(body)
+        self.clear()
+        return KPL_MAGIC + body + hashlib.md5(body).digest()
+
+
+def aggregate(records, max_size=DEFAULT_MAX_AGGREGATE_BYTES, shard_starts=None):
+    """
+    Pack ``(partition_key, data, explicit_hash_key)`` tuples into PutRecords
+    entries.
+
+    With ``shard_starts`` (the sorted starting hash keys of the open
+    shards) records are grouped by the shard their own key maps to, so
+    records with different keys share an aggregate. As in the KPL, every
+    aggregate is sent with the ExplicitHashKey of its first record, which
+    pins it to that shard. Without a shard map records are only grouped
+    with others of the same key. Input order is kept within each shard,
+    so per-key order is preserved. Returns a list of
+    ``(entry, member_indexes)`` where ``entry`` is a PutRecords entry and
+    ``member_indexes`` lists the input positions packed into it.
+    """
+    groups = {}
+    for index, (partition_key, data, explicit_hash_key) in enumerate(records):
+        hash_key = int(explicit_hash_key) if explicit_hash_key is not None else hash_key_for(partition_key)
+        if shard_starts:
+            group = max(bisect.bisect_right(shard_starts, hash_key) - 1, 0)
+        else:
+            group = hash_key
+        groups.setdefault(group, []).append((index, partition_key, data, explicit_hash_key, hash_key))
+
+    entries = []
+    aggregator = RecordAggregator(max_size)
+    for members in groups.values():
+        entry = None
+        indexes = []
+        for index, partition_key, data, explicit_hash_key, hash_key in members:
+            if entry is not None and not aggregator.add(partition_key, data, explicit_hash_key):
+                entries.append((dict(entry, Data=aggregator.build()), indexes))
+                entry = None
+                indexes = []
+            if entry is None:
+                entry = {'PartitionKey': partition_key, 'ExplicitHashKey': str(hash_key)}
+                aggregator.add(partition_key, data, explicit_hash_key)
+            indexes.append(index)
+        entries.append((dict(entry, Data=aggregator.build()), indexes))
+    return entries
+
+
+def is_aggregated(data):
+    return (len(data) > len(KPL_MAGIC) + DIGEST_SIZE and data[:len(KPL_MAGIC)] == KPL_MAGIC
+            and hashlib.md5(data[len(KPL_MAGIC):-DIGEST_SIZE]).digest() == data[-DIGEST_SIZE:])
+
+
+def deaggregate(data, partition_key=None, explicit_hash_key=None):
+    """
+    Split one Kinesis record payload into its user records.
+
+    Returns a list of ``(partition_key, explicit_hash_key, data)``. Payloads
+    that are not KPL aggregates come back as a single entry unchanged.
+    """
+    if not is_aggregated(data):
+        return [(partition_key, explicit_hash_key, data)]
+
+    partition_keys = []
+    hash_keys = []
+    user_records = []
+    for field_number, value in _iter_fields(data[len(KPL_MAGIC):-DIGEST_SIZE]):
+        if field_number == 1:
+            partition_keys.append(bytes(value).decode('utf-8'))
+        elif field_number == 2:
+            hash_keys.append(bytes(value).decode('utf-8'))
+        elif field_number == 3:
+            pk_index = ehk_index = None
+            payload = b''
+            for inner_number, inner_value in _iter_fields(value):
+                if inner_number == 1:
+                    pk_index = inner_value
+                elif inner_number == 2:
+                    ehk_index = inner_value
+                elif inner_number == 3:
+                    payload = bytes(inner_value)
+            user_records.append((
+                partition_keys[pk_index],
+                hash_keys[ehk_index] if ehk_index is not None else explicit_hash_key,
+                payload
+            ))
+    return user_records
+
+
+def deaggregate_records(records):
+    """
+    Expand Lambda Kinesis event records into user records.
+
+    Yields dicts with ``sequenceNumber``, ``subSequenceNumber`` (None for
+    records that were not aggregated), ``partitionKey``, ``explicitHashKey``
+    and the decoded ``data`` bytes.
+    """
+    for record in records:
+        kinesis = record['kinesis']
+        yield from _user_records(
+            kinesis['sequenceNumber'], base64.b64decode(kinesis['data']),
+            kinesis.get('partitionKey'), kinesis.get('explicitHashKey')
+        )
+
+
+def deaggregate_stream_records(records):
+    """
+    Same as ``deaggregate_records`` for records returned by GetRecords
+    """
+    for record in records:
+        yield from _user_records(
+            record['SequenceNumber'], record['Data'],
+            record.get('PartitionKey'), record.get('ExplicitHashKey')
+        )
+
+
+def _user_records(sequence_number, data, partition_key, explicit_hash_key):
+    user_records = deaggregate(data, partition_key, explicit_hash_key)
+    aggregated = not (len(user_records) == 1 and user_records[0][2] is data)
+    for sub_sequence, (partition_key, explicit_hash_key, payload) in enumerate(user_records):
+        yield {
+            'sequenceNumber': sequence_number,
+            'subSequenceNumber': sub_sequence if aggregated else None,
+            'partitionKey': partition_key,
+            'explicitHashKey': explicit_hash_key,
+            'data': payload,
+        }
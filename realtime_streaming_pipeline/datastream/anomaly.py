@@ -0,0 +1,259 @@
+"""
+Online anomaly detection against per-key baselines.
+
+Every (data_type, key, field) series keeps its own running statistics, where
+key is the record's sensor_id, else metric_name, else partition_key. A value
+is scored against the baseline *before* it is folded in, and flagged when
+its z-score is beyond ``threshold`` once the series has ``min_samples``
+points. Methods:
+
+    welford   exact running mean/variance (Welford's algorithm)
+    ewma      exponentially weighted mean/variance, follows drift
+    seasonal  one EWMA per slot of a repeating period (e.g. hour of day)
+
+State is a few floats per series (``season_buckets`` of them for seasonal)
+held in an LRU map of at most ``max_keys`` series, so memory is bounded
+and the least recently seen series are evicted first. Scoring and updating
+are O(1) per value.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from .windows import event_time
+
+DEFAULT_FIELDS = ('value', 'temperature', 'humidity', 'pressure')
+
+
+class Welford:
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def copy(self):
+        clone = Welford()
+        clone.count, clone.mean, clone.m2 = self.count, self.mean, self.m2
+        return clone
+
+    def update(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+
+class EWMA:
+    __slots__ = ('count', 'mean', 'var', 'alpha')
+
+    def __init__(self, alpha):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.alpha = alpha
+
+    def std(self):
+        return math.sqrt(self.var)
+
+    def copy(self):
+        clone = EWMA(self.alpha)
+        clone.count, clone.mean, clone.var = self.count, self.mean, self.var
+        return clone
+
+    def update(self, x):
+        self.count += 1
+        if self.count == 1:
+            self.mean = x
+            return
+        delta = x - self.mean
+        increment = self.alpha * delta
+        self.mean += increment
+        self.var = (1 - self.alpha) * (self.var + delta * increment)
+
+
+class Seasonal:
+    """
+    One EWMA per slot of a ``period``-second cycle
+    """
+    __slots__ = ('slots', 'period', 'current')
+
+    def __init__(self, alpha, period, buckets):
+        self.slots = [EWMA(alpha) for _ in range(buckets)]
+        self.period = period
+        self.current = self.slots[0]
+
+    def copy(self):
+        clone = Seasonal.__new__(Seasonal)
+        clone.slots = [slot.copy() for slot in self.slots]
+        clone.period = self.period
+        clone.current = clone.slots[self.slots.index(self.current)]
+        return clone
+
+    def at(self, t):
+        self.current = self.slots[int((t % self.period) / self.period * len(self.slots))]
+        return self.current
+
+
+class AnomalyDetector:
+    """
+    Per-series baselines in a bounded LRU map; see the module docstring
+    """
+    def __init__(self, method='ewma', threshold=3.0, min_samples=30, alpha=0.05,
+                 season_seconds=86400, season_buckets=24, max_keys=100000, fields=DEFAULT_FIELDS):
+        if method not in ('welford', 'ewma', 'seasonal'):
+            raise ValueError(f'Unknown anomaly detection method {method!r}')
+        self.method = method
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.season_seconds = season_seconds
+        self.season_buckets = season_buckets
+        self.max_keys = max_keys
+        self.fields = fields
+        self.evicted = 0
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._series)
+
+    def _new_state(self):
+        if self.method == 'welford':
+            return Welford()
+        if self.method == 'ewma':
+            return EWMA(self.alpha)
+        return Seasonal(self.alpha, self.season_seconds, self.season_buckets)
+
+    def _state(self, key):
+        state = self._series.get(key)
+        if state is None:
+            state = self._series[key] = self._new_state()
+            if len(self._series) > self.max_keys:
+                self._series.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._series.move_to_end(key)
+        return state
+
+    @staticmethod
+    def series_key(data):
+        return (
+            data.get('data_type') or '',
+            data.get('sensor_id') or data.get('metric_name') or data.get('partition_key') or '',
+        )
+
+    def snapshot(self, data_list):
+        """
+        Copy of every series ``data_list`` can update, for ``restore``
+        """
+        keys = set()
+        for data in data_list:
+            if isinstance(data, dict):
+                base = self.series_key(data)
+                keys.update(base + (field,) for field in self.fields if field in data)
+        with self._lock:
+            return {
+                key: state.copy() if state is not None else None
+                for key, state in ((key, self._series.get(key)) for key in keys)
+            }
+
+    def restore(self, snapshot):
+        """
+        Put the series back as they were at ``snapshot``. Series evicted
+        since then to make room are not brought back.
+        """
+        with self._lock:
+            for key, state in snapshot.items():
+                if state is None:
+                    self._series.pop(key, None)
+                else:
+                    self._series[key] = state
+
+    def check(self, data):
+        """
+        Score and learn every numeric field of ``data``; returns the anomalies
+        """
+        values = [(field, data.get(field)) for field in self.fields]
+        values = [(field, float(v)) for field, v in values
+                  if type(v) in (int, float) and math.isfinite(v)]
+        if not values:
+            return []
+
+        base = self.series_key(data)
+        t = event_time(data, time.time()) if self.method == 'seasonal' else None
+        anomalies = []
+        with self._lock:
+            for field, x in values:
+                state = self._state(base + (field,))
+                if t is not None:
+                    state = state.at(t)
+                if state.count >= self.min_samples:
+                    std = state.std()
+                    deviation = x - state.mean
+                    if std > 0 and abs(deviation) > self.threshold * std:
+                        anomalies.append({
+                            'field': field,
+                            'value': x,
+                            'z_score': round(deviation / std, 2),
+                            'baseline': round(state.mean, 4),
+                            'method': self.method,
+                        })
+                state.update(x)
+        return anomalies
+
+    def apply(self, data):
+        """
+        ``check`` and record the result on ``data`` ('anomalies', plus an
+        ANOMALY_DETECTED entry in 'alerts')
+        """
+        anomalies = self.check(data)
+        if anomalies:
+            data['anomalies'] = anomalies
+            alerts = data.get('alerts')
+            # A fresh list: the payload's own 'alerts' may be anything
+            data['alerts'] = (list(alerts) if isinstance(alerts, list) else []) + ['ANOMALY_DETECTED']
+            data.setdefault('alert', 'ANOMALY_DETECTED')
+        return data
+
+
+def get_detector_from_env():
+    """
+    AnomalyDetector from ANOMALY_DETECTION (welford | ewma | seasonal | off)
+    and ANOMALY_* tuning variables; None when off
+    """
+    method = os.environ.get('ANOMALY_DETECTION', 'ewma')
+    if method == 'off':
+        return None
+    return AnomalyDetector(
+        method=method,
+        threshold=float(os.environ.get('ANOMALY_Z_THRESHOLD', 3.0)),
+        min_samples=int(os.environ.get('ANOMALY_MIN_SAMPLES', 30)),
+        alpha=float(os.environ.get('ANOMALY_EWMA_ALPHA', 0.05)),
+        season_seconds=int(os.environ.get('ANOMALY_SEASON_SECONDS', 86400)),
+        season_buckets=int(os.environ.get('ANOMALY_SEASON_BUCKETS', 24)),
+        max_keys=int(os.environ.get('ANOMALY_MAX_KEYS', 100000)),
+    )
+
+
+_UNSET = object()
+_detector = _UNSET
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    """
+    Process-wide detector (None when disabled); its baselines live as
+    long as the process, i.e. across invocations of a warm Lambda
+    """
+    global _detector
+    if _detector is _UNSET:
+        with _detector_lock:
+            if _detector is _UNSET:
+                _detector = get_detector_from_env()
+    return _detector
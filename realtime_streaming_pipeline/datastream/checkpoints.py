@@ -0,0 +1,23 @@
+# datastream/checkpoints.py
+from .models import ShardCheckpoint
+
+
+class DatabaseCheckpointStore:
+    """
+    Durable checkpoints for StreamConsumer in the ShardCheckpoint table
+    """
+    def __init__(self, stream_name):
+        self.stream_name = stream_name
+
+    def load(self):
+        return {
+            checkpoint.shard_id: (checkpoint.sequence_number, checkpoint.finished)
+            for checkpoint in ShardCheckpoint.objects.filter(stream_name=self.stream_name)
+        }
+
+    def save(self, shard_id, sequence_number, finished=False):
+        ShardCheckpoint.objects.update_or_create(
+            stream_name=self.stream_name,
+            shard_id=shard_id,
+            defaults={'sequence_number': sequence_number, 'finished': finished},
+        )
@@ -0,0 +1,145 @@
+# datastream/clients.py
+import os
+import threading
+
+DEFAULT_REGION = os.environ.get('AWS_REGION') or 'ap-south-1'
+
+# Shared by every client: sized for a threaded worker, keep-alive on, and
+# timeouts short enough that a stuck connection does not hold a request.
+# Turned into a botocore Config when the first client is built, so that
+# importing this module does not import boto3.
+CLIENT_CONFIG = dict(
+    max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 50)),
+    connect_timeout=float(os.environ.get('AWS_CONNECT_TIMEOUT', 2)),
+    read_timeout=float(os.environ.get('AWS_READ_TIMEOUT', 10)),
+    tcp_keepalive=True,
+    retries={'max_attempts': 3, 'mode': 'standard'},
+)
+
+# 'aws' or 'local' (stand-in, see datastream/local_kinesis.py).
+# Development mode defaults to the local backend.
+KINESIS_BACKEND = os.environ.get('KINESIS_BACKEND') or (
+    'local' if os.environ.get('AWS_DEVELOPMENT_MODE', 'True') == 'True' else 'aws'
+)
+LOCAL_KINESIS_SHARDS = int(os.environ.get('LOCAL_KINESIS_SHARDS', 2))
+LOCAL_KINESIS_ENFORCE_LIMITS = os.environ.get('LOCAL_KINESIS_ENFORCE_LIMITS', 'True') == 'True'
+# SQLite file the local stream lives in, shared by the web server and
+# consume_stream; ':memory:' keeps it inside one process
+LOCAL_KINESIS_PATH = os.environ.get('LOCAL_KINESIS_PATH') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'local_kinesis.sqlite3'
+)
+
+
+class ClientRegistry:
+    """
+    Process-wide cache of boto3 clients and resources.
+
+    Clients are created once per process and shared across threads (boto3
+    clients are thread-safe). Resources are not, so they are cached per
+    thread. Everything is dropped after a fork so gunicorn workers never
+    share sockets with the master. boto3 is imported on first use.
+    """
+
+    def __init__(self, config=CLIENT_CONFIG, region_name=DEFAULT_REGION):
+        self.config = config
+        self.region_name = region_name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._pid = os.getpid()
+        self._session = None
+        self._clients = {}
+        self._local = threading.local()
+
+    def after_fork(self):
+        # The lock may have been held by another thread at fork time
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _get_session(self):
+        # boto3.Session() itself is not thread-safe; build it under the lock
+        if self._pid != os.getpid():
+            self.reset()
+        if self._session is None:
+            import boto3
+            from botocore.config import Config
+            if isinstance(self.config, dict):
+                self.config = Config(**self.config)
+            self._session = boto3.session.Session()
+        return self._session
+
+    def client(self, service_name, region_name=None):
+        key = (service_name, region_name or self.region_name)
+        client = self._clients.get(key)
+        if client is not None and self._pid == os.getpid():
+            return client
+        with self._lock:
+            session = self._get_session()
+            client = self._clients.get(key)
+            if client is None:
+                client = session.client(service_name, region_name=key[1], config=self.config)
+                self._clients[key] = client
+            return client
+
+    def resource(self, service_name, region_name=None):
+        key = (service_name, region_name or self.region_name)
+        if self._pid != os.getpid():
+            with self._lock:
+                self._get_session()
+        resources = self._local.__dict__.setdefault('resources', {})
+        resource = resources.get(key)
+        if resource is None:
+            with self._lock:
+                session = self._get_session()
+                resource = session.resource(service_name, region_name=key[1], config=self.config)
+            resources[key] = resource
+        return resource
+
+
+registry = ClientRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.after_fork)
+
+
+_local_kinesis = None
+_local_kinesis_lock = threading.Lock()
+
+
+def get_local_kinesis():
+    global _local_kinesis
+    if _local_kinesis is None:
+        with _local_kinesis_lock:
+            if _local_kinesis is None:
+                from .local_kinesis import LocalKinesis, SQLiteKinesis
+                if LOCAL_KINESIS_PATH == ':memory:':
+                    _local_kinesis = LocalKinesis(
+                        shard_count=LOCAL_KINESIS_SHARDS,
+                        enforce_limits=LOCAL_KINESIS_ENFORCE_LIMITS,
+                    )
+                else:
+                    _local_kinesis = SQLiteKinesis(
+                        LOCAL_KINESIS_PATH,
+                        shard_count=LOCAL_KINESIS_SHARDS,
+                        enforce_limits=LOCAL_KINESIS_ENFORCE_LIMITS,
+                    )
+    return _local_kinesis
+
+
+def get_kinesis_client():
+    if KINESIS_BACKEND == 'local':
+        return get_local_kinesis()
+    return registry.client('kinesis')
+
+
+def get_lambda_client():
+    return registry.client('lambda')
+
+
+def get_s3_client():
+    return registry.client('s3')
+
+
+def get_dynamodb_resource(region_name=None):
+    return registry.resource('dynamodb', region_name)
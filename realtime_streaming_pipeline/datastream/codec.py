@@ -0,0 +1,170 @@
+"""
+Versioned binary envelope for stream record payloads.
+
+Every encoded record starts with one header byte::
+
+    1010 cc ff
+    |    |  +- format:      0 = compact JSON, 1 = MessagePack
+    |    +---- compression: 0 = none, 1 = zlib with the v1 preset dictionary,
+    |                       2 = zstd
+    +--------- envelope version 1 (0xA)
+
+0xA0-0xAF are UTF-8 continuation bytes, so they can never start a legacy
+``json.dumps`` payload; ``decode()`` accepts both. The zlib preset
+dictionary holds the keys and values every pipeline event repeats, which is
+what lets records of a few hundred bytes compress at all. Never edit
+ZLIB_DICTIONARY_V1 in place: records in flight depend on it, so a new
+dictionary needs a new compression id.
+
+msgpack and zstandard are optional; without them the encoder falls back to
+JSON/zlib and the decoder raises if it meets a record that needs them.
+"""
+import os
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+ENVELOPE_VERSION = 0xA0
+VERSION_MASK = 0xF0
+
+FORMAT_JSON = 0
+FORMAT_MSGPACK = 1
+FORMATS = {'json': FORMAT_JSON, 'msgpack': FORMAT_MSGPACK}
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSIONS = {'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB, 'zstd': COMPRESSION_ZSTD}
+
+# Keys and values shared by the events built in the views and seed_data.
+# zlib favours matches near the end of the dictionary, so the most common
+# strings come last.
+ZLIB_DICTIONARY_V1 = (
+    b'"custom_field_1":"value_","custom_field_2":"inactive","custom_data":{"score":'
+    b'"category":"tags":["tag1","tag2","tag3"]"event_type":"file_upload","user_login",'
+    b'"data_processed","alert_triggered","details":"Event occurred at "severity":"low",'
+    b'"medium","high""file_name":"file_size":"file_size_display":" KB","upload_time":'
+    b'"file_extension":"description":"s3_location":"s3://"level":"INFO","WARNING",'
+    b'"ERROR","DEBUG","message":"Log message : System operation completed","component":'
+    b'"auth","database","api","worker","scheduler""metric_name":"cpu_usage",'
+    b'"memory_usage","disk_io","network_latency","threshold":80,"status":"ok","exceeded"'
+    b'"sensor_id":"sensor-","temperature":"humidity":"pressure":"location":'
+    b'"server-room-1","server-room-2","office-floor","data-center","cloud-region",'
+    b'"status":"normal","warning","critical","unit":"\\u00b0C","%"'
+    b'{"user_id":"username":"data_type":"sensor","log","metric","event","custom",'
+    b'"data_content":{"value":"sender":"partition_key":"timestamp":"2026-'
+)
+
+DEFAULT_MIN_COMPRESS_BYTES = 128
+
+
+def _compress(body, compression):
+    if compression == COMPRESSION_ZLIB:
+        compressor = zlib.compressobj(level=6, zdict=ZLIB_DICTIONARY_V1)
+        return compressor.compress(body) + compressor.flush()
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+def _decompress(body, compression):
+    if compression == COMPRESSION_NONE:
+        return body
+    if compression == COMPRESSION_ZLIB:
+        decompressor = zlib.decompressobj(zdict=ZLIB_DICTIONARY_V1)
+        return decompressor.decompress(body) + decompressor.flush()
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError('Record is zstd-compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError(f'Unknown compression id {compression}')
+
+
+class RecordCodec:
+    """
+    Encodes payloads into the versioned envelope.
+
+    Compression is only applied to bodies of at least
+    ``min_compress_bytes`` and only kept when it actually saves space.
+    """
+
+    def __init__(self, format='json', compression='zlib', min_compress_bytes=DEFAULT_MIN_COMPRESS_BYTES):
+        self.format = FORMATS[format]
+        self.compression = COMPRESSIONS[compression]
+        if self.format == FORMAT_MSGPACK and msgpack is None:
+            self.format = FORMAT_JSON
+        if self.compression == COMPRESSION_ZSTD and zstandard is None:
+            self.compression = COMPRESSION_ZLIB
+        self.min_compress_bytes = min_compress_bytes
+
+    def encode(self, data):
+        if self.format == FORMAT_MSGPACK:
+            body = msgpack.packb(data, use_bin_type=True, default=str)
+        else:
+            body = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+
+        compression = COMPRESSION_NONE
+        if self.compression != COMPRESSION_NONE and len(body) >= self.min_compress_bytes:
+            compressed = _compress(body, self.compression)
+            if len(compressed) < len(body):
+                body = compressed
+                compression = self.compression
+        return bytes([ENVELOPE_VERSION | (compression << 2) | self.format]) + body
+
+
+class PlainJSONCodec:
+    """
+    Legacy encoding: ``json.dumps`` text without an envelope
+    """
+
+    def encode(self, data):
+        return json.dumps(data).encode('utf-8')
+
+
+def decode(payload):
+    """
+    Decode an enveloped or legacy plain-JSON payload (bytes or str)
+    """
+    if isinstance(payload, str):
+        return json.loads(payload)
+    if not payload or payload[0] & VERSION_MASK != ENVELOPE_VERSION:
+        return json.loads(payload.decode('utf-8'))
+
+    header = payload[0]
+    format = header & 0x03
+    if format not in FORMATS.values():
+        raise ValueError(f'Unknown format id {format}')
+    body = _decompress(payload[1:], (header >> 2) & 0x03)
+    if format == FORMAT_MSGPACK:
+        if msgpack is None:
+            raise ValueError('Record is MessagePack-encoded but msgpack is not installed')
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body.decode('utf-8'))
+
+
+def get_codec(name=None, compression=None):
+    """
+    Codec from KINESIS_RECORD_CODEC (plain | json | msgpack) and
+    KINESIS_RECORD_COMPRESSION (none | zlib | zstd)
+    """
+    name = name or os.environ.get('KINESIS_RECORD_CODEC', 'json')
+    compression = compression or os.environ.get('KINESIS_RECORD_COMPRESSION', 'zlib')
+    if name == 'plain':
+        return PlainJSONCodec()
+    return RecordCodec(format=name, compression=compression)
+
+
+default_codec = get_codec()
+
+
+def encode(data, codec=None):
+    return (codec or default_codec).encode(data)
@@ -0,0 +1,127 @@
+"""
+Cold-start measurement for the Lambda entry point.
+
+Every measurement runs in a fresh interpreter, so nothing imported by the
+caller (Django, the test runner) hides the real cost::
+
+    python -m datastream.coldstart                 # lambda_function
+    python -m datastream.coldstart some_module --top 20
+
+``import_times()`` parses ``python -X importtime`` output; ``cold_start()``
+times the import plus the first handler invocation. The command exits
+non-zero when the import goes over IMPORT_BUDGET_MS or pulls in one of
+HEAVY_MODULES; the test suite checks the same budget.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_BUDGET_MS = float(os.environ.get('LAMBDA_IMPORT_BUDGET_MS', 250))
+
+# Must only be loaded once a code path needs them
+HEAVY_MODULES = ('boto3', 'botocore', 'numpy', 'pandas', 'django')
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+_CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+loaded = set(sys.modules)
+class Context:
+    function_name = 'cold-start-harness'
+getattr(module, sys.argv[2])(json.loads(sys.argv[3]), Context())
+invoked = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_invocation_ms': (invoked - imported) * 1000,
+    'modules_after_import': sorted(loaded),
+    'modules_after_invocation': sorted(sys.modules),
+}))
+'''
+
+
+def _run(args):
+    return subprocess.run(
+        [sys.executable] + args, cwd=PROJECT_DIR,
+        capture_output=True, text=True, check=True
+    )
+
+
+def import_times(module='lambda_function'):
+    """
+    Import ``module`` in a fresh interpreter under ``-X importtime``.
+
+    Returns ``(total_ms, entries)``: the cumulative time of ``module`` and
+    every import it triggered, as
+    ``{'module', 'self_ms', 'cumulative_ms', 'depth'}`` in import order.
+    """
+    result = _run(['-X', 'importtime', '-c', f'import {module}'])
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append({
+                'module': match.group(4),
+                'self_ms': int(match.group(1)) / 1000,
+                'cumulative_ms': int(match.group(2)) / 1000,
+                'depth': len(match.group(3)) // 2,
+            })
+    # Interpreter startup imports are listed too; only count ``module``
+    total_ms = next(
+        e['cumulative_ms'] for e in reversed(entries)
+        if e['depth'] == 0 and e['module'] == module
+    )
+    return total_ms, entries
+
+
+def heavy_imports(entries):
+    """
+    HEAVY_MODULES (top-level packages) that appear in ``entries``
+    """
+    loaded = {e['module'].split('.')[0] for e in entries}
+    return sorted(loaded.intersection(HEAVY_MODULES))
+
+
+def cold_start(module='lambda_function', handler='lambda_handler', event=None):
+    """
+    Import ``module`` and call its handler once, in a fresh interpreter
+    """
+    event = event if event is not None else {'Records': []}
+    result = _run(['-c', _CHILD, module, handler, json.dumps(event)])
+    # The handler may print; the report is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure Lambda cold-start cost')
+    parser.add_argument('module', nargs='?', default='lambda_function')
+    parser.add_argument('--handler', default='lambda_handler')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args(argv)
+
+    total_ms, entries = import_times(args.module)
+    print(f"Import of {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for entry in sorted(entries, key=lambda e: e['self_ms'], reverse=True)[:args.top]:
+        print(f"  {entry['self_ms']:8.1f} ms  {entry['module']}")
+
+    report = cold_start(args.module, args.handler)
+    print(f"First invocation: {report['first_invocation_ms']:.1f} ms")
+
+    heavy = heavy_imports(entries)
+    if heavy:
+        print(f"Heavy modules imported at load time: {', '.join(heavy)}")
+    if heavy or total_ms > args.budget_ms:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
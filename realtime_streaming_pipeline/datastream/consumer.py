@@ -0,0 +1,264 @@
+"""
+Polling consumer for every shard of a Kinesis stream.
+
+A StreamConsumer owns one shard group: the shards whose id hashes to
+``group`` out of ``groups``, so several worker processes can split a
+stream between them without talking to each other. Each shard is read
+with GetShardIterator/GetRecords, its user records (KPL aggregates are
+expanded) are passed to ``handler(shard_id, records)``, and the last
+sequence number is then checkpointed, so delivery is at-least-once. If the
+handler raises, the batch is not checkpointed and is read again after
+``poll_interval``; a handler that should skip bad records has to catch
+their errors itself.
+
+Resharding: the shard list is re-read every ``refresh_interval`` seconds.
+A shard is only started once its parent shards (ParentShardId /
+AdjacentParentShardId) have been read to the end, which keeps per-key
+order across splits and merges even when the parent belongs to another
+group; a shard that reaches its end is checkpointed as finished.
+
+Checkpoint stores need two methods::
+
+    load() -> {shard_id: (sequence_number, finished)}
+    save(shard_id, sequence_number, finished=False)
+
+``on_idle()``, if given, is called whenever a poll round reads nothing and
+every shard is caught up (MillisBehindLatest 0).
+
+Errors from Kinesis or the checkpoint store (timeouts, lost connections,
+a database that is down) do not stop the consumer: the shard, or the
+shard list, is tried again after ``ERROR_BACKOFF`` seconds, and a
+checkpoint that could not be saved is saved on the shard's next poll.
+"""
+import threading
+import time
+import zlib
+from .aggregation import deaggregate_stream_records
+
+# GetRecords allows 5 calls per second per shard
+MIN_POLL_INTERVAL = 0.2
+# Pause before a shard or the shard list is retried after an error
+ERROR_BACKOFF = 5.0
+
+
+class MemoryCheckpointStore:
+    """
+    Non-durable checkpoints, for tests and one-off runs
+    """
+    def __init__(self):
+        self.checkpoints = {}
+
+    def load(self):
+        return dict(self.checkpoints)
+
+    def save(self, shard_id, sequence_number, finished=False):
+        self.checkpoints[shard_id] = (sequence_number, finished)
+
+
+def shard_group(shard_id, groups):
+    """
+    Stable group number of ``shard_id`` (the same in every process)
+    """
+    return zlib.crc32(shard_id.encode('utf-8')) % groups
+
+
+def _error_code(exc):
+    response = getattr(exc, 'response', None) or {}
+    return response.get('Error', {}).get('Code')
+
+
+class StreamConsumer:
+    """
+    Reads one shard group of ``stream_name``; see the module docstring
+    """
+    def __init__(self, client, stream_name, checkpoints, handler, group=0, groups=1,
+                 initial_position='TRIM_HORIZON', batch_size=1000, poll_interval=1.0,
+                 refresh_interval=30.0, on_idle=None):
+        if not 0 <= group < groups:
+            raise ValueError(f'Shard group {group} is not in 0..{groups - 1}')
+        self.client = client
+        self.stream_name = stream_name
+        self.checkpoints = checkpoints
+        self.handler = handler
+        self.group = group
+        self.groups = groups
+        # Where a shard without a checkpoint starts: TRIM_HORIZON or LATEST
+        self.initial_position = initial_position
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self.on_idle = on_idle
+        self.processed = 0
+        self.lag = {}
+        self._iterators = {}
+        self._sequences = {}
+        self._next_poll = {}
+        self._unsaved = set()
+        self._refreshed = None
+        self._stop = threading.Event()
+
+    @property
+    def shards(self):
+        """
+        Shards currently being read
+        """
+        return sorted(self._iterators)
+
+    def stop(self):
+        self._stop.set()
+
+    def list_shards(self):
+        shards = []
+        kwargs = {'StreamName': self.stream_name}
+        while True:
+            response = self.client.list_shards(**kwargs)
+            shards.extend(response['Shards'])
+            if not response.get('NextToken'):
+                return shards
+            # NextToken and StreamName are mutually exclusive
+            kwargs = {'NextToken': response['NextToken']}
+
+    def refresh(self):
+        """
+        Start reading any shard of this group that is ready
+        """
+        self._refreshed = time.monotonic()
+        shards = self.list_shards()
+        known = {shard['ShardId'] for shard in shards}
+        checkpoints = self.checkpoints.load()
+
+        def finished(shard_id):
+            # Parents past the retention period are no longer listed
+            return shard_id not in known or checkpoints.get(shard_id, (None, False))[1]
+
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if shard_id in self._iterators or finished(shard_id):
+                continue
+            if shard_group(shard_id, self.groups) != self.group:
+                continue
+            parents = [shard.get('ParentShardId'), shard.get('AdjacentParentShardId')]
+            if not all(finished(parent) for parent in parents if parent):
+                continue  # picked up once the parents are drained
+            sequence_number = checkpoints.get(shard_id, (None, False))[0]
+            # A child shard starts at its beginning so nothing after the
+            # parents is skipped
+            position = 'TRIM_HORIZON' if any(parents) else self.initial_position
+            self._start(shard_id, sequence_number, position)
+
+    def _start(self, shard_id, sequence_number, position=None):
+        kwargs = {'StreamName': self.stream_name, 'ShardId': shard_id}
+        if sequence_number:
+            kwargs.update(ShardIteratorType='AFTER_SEQUENCE_NUMBER', StartingSequenceNumber=sequence_number)
+        else:
+            kwargs['ShardIteratorType'] = position or self.initial_position
+        self._iterators[shard_id] = self.client.get_shard_iterator(**kwargs)['ShardIterator']
+        self._sequences[shard_id] = sequence_number
+        self._next_poll[shard_id] = 0.0
+        print(f"[CONSUMER] Reading {shard_id} from {sequence_number or kwargs['ShardIteratorType']}")
+
+    def poll_shard(self, shard_id):
+        """
+        One GetRecords call; returns the number of Kinesis records read
+        """
+        started = time.monotonic()
+        if self._iterators[shard_id] is None:
+            # Read to the end; only the final checkpoint is missing
+            self._finish(shard_id)
+            return 0
+        try:
+            response = self.client.get_records(ShardIterator=self._iterators[shard_id], Limit=self.batch_size)
+        except Exception as e:
+            code = _error_code(e)
+            if code in ('ProvisionedThroughputExceededException', 'LimitExceededException'):
+                self._next_poll[shard_id] = started + 1.0
+                return 0
+            if code == 'ExpiredIteratorException':
+                try:
+                    self._start(shard_id, self._sequences[shard_id])
+                except Exception as restart_error:
+                    self._back_off(shard_id, started, restart_error)
+                return 0
+            # Timeouts, lost connections, ...
+            self._back_off(shard_id, started, e)
+            return 0
+
+        records = response['Records']
+        # Keep reading a shard with a backlog as fast as its limit allows
+        self._next_poll[shard_id] = started + (MIN_POLL_INTERVAL if records else self.poll_interval)
+        self.lag[shard_id] = response.get('MillisBehindLatest', 0)
+        if records:
+            user_records = list(deaggregate_stream_records(records))
+            try:
+                self.handler(shard_id, user_records)
+            except Exception as e:
+                # Keep the other shards going; the same records are read
+                # again with the unchanged iterator after a pause
+                print(f"[CONSUMER] Handler failed on {shard_id}, retrying the batch: {e}")
+                self._next_poll[shard_id] = started + self.poll_interval
+                return 0
+            self.processed += len(user_records)
+            self._sequences[shard_id] = records[-1]['SequenceNumber']
+
+        next_iterator = response.get('NextShardIterator')
+        if next_iterator is None:
+            # Closed by a split or merge and read to the end
+            self._finish(shard_id)
+        else:
+            self._iterators[shard_id] = next_iterator
+            if records or shard_id in self._unsaved:
+                self._save(shard_id)
+        return len(records)
+
+    def _back_off(self, shard_id, started, error):
+        print(f"[CONSUMER] Reading {shard_id} failed, retrying in {ERROR_BACKOFF:.0f}s: {error}")
+        self._next_poll[shard_id] = started + ERROR_BACKOFF
+
+    def _save(self, shard_id, finished=False):
+        """
+        Checkpoint the shard's last sequence number; False (and retried on
+        the next poll) if the store fails
+        """
+        try:
+            self.checkpoints.save(shard_id, self._sequences[shard_id], finished=finished)
+        except Exception as e:
+            print(f"[CONSUMER] Checkpointing {shard_id} failed, retrying on the next poll: {e}")
+            self._unsaved.add(shard_id)
+            return False
+        self._unsaved.discard(shard_id)
+        return True
+
+    def _finish(self, shard_id):
+        self._iterators[shard_id] = None
+        if not self._save(shard_id, finished=True):
+            self._next_poll[shard_id] = time.monotonic() + ERROR_BACKOFF
+            return
+        print(f"[CONSUMER] Finished {shard_id}")
+        del self._iterators[shard_id]
+        self._refreshed = None  # look for the child shards now
+
+    def run_once(self):
+        """
+        Poll every shard that is due; returns the number of records read
+        """
+        if self._refreshed is None or time.monotonic() - self._refreshed >= self.refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[CONSUMER] Listing shards failed, retrying in {ERROR_BACKOFF:.0f}s: {e}")
+                # Due again after ERROR_BACKOFF instead of refresh_interval
+                self._refreshed = time.monotonic() - self.refresh_interval + ERROR_BACKOFF
+        count = 0
+        now = time.monotonic()
+        for shard_id in list(self._iterators):
+            if self._next_poll[shard_id] <= now:
+                count += self.poll_shard(shard_id)
+        return count
+
+    def run(self):
+        while not self._stop.is_set():
+            if not self.run_once() and self.on_idle and not any(self.lag.values()):
+                self.on_idle()
+            now = time.monotonic()
+            due = min((self._next_poll[shard_id] for shard_id in self._iterators), default=now + self.poll_interval)
+            self._stop.wait(min(max(due - now, 0.0), self.poll_interval))
@@ -1,47 +1,502 @@
-import json
-import boto3
+import os
 import time
+import random
+import atexit
+import threading
+from concurrent.futures import Future
 from aws_config import AWSConfig
+from .clients import get_kinesis_client
+from .aggregation import DEFAULT_MAX_AGGREGATE_BYTES, aggregate
+from .codec import default_codec
+from .partitioning import get_default_partitioner, get_default_tracker
+from .rate_limiter import ShardRateLimiter
+
+# PutRecords limits
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 5 * 1024 * 1024
+MAX_RECORD_BYTES = 1024 * 1024
+
+# Pace sends against each shard's write budget before Kinesis throttles them
+CLIENT_RATE_LIMIT = os.environ.get('KINESIS_CLIENT_RATE_LIMIT', 'True') == 'True'
+
+
+class KinesisPutError(Exception):
+    """
+    Raised (or set on a record's future) when Kinesis rejects a record
+    """
+    def __init__(self, error_code, error_message=''):
+        super().__init__(f"{error_code}: {error_message}")
+        self.error_code = error_code
+        self.error_message = error_message
+
+
+# Per-record and request-level error codes that are worth retrying
+RETRYABLE_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'ThrottlingException',
+    'LimitExceededException',
+    'KMSThrottlingException',
+    'TransportError',
+}
+
+
+class RetryPolicy:
+    """
+    Bounded retry budget with jittered exponential backoff
+    """
+    def __init__(self, max_attempts=6, base_delay=0.05, max_delay=2.0, deadline=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        # "Full jitter": uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def _error_code(exc):
+    response = getattr(exc, 'response', None) or {}
+    return response.get('Error', {}).get('Code', 'TransportError')
+
+
+def _order_key(record):
+    # Aggregates and explicitly routed records are ordered per hash key
+    return record.get('ExplicitHashKey') or record['PartitionKey']
+
+
+def put_records_with_retry(client, stream_name, records, policy=None, limiter=None,
+                           preserve_order=False):
+    """
+    Send up to 500 PutRecords entries, resending only the failed ones.
+
+    Failed entries are resent in their original relative order, but
+    Kinesis can fail one entry and accept a later one for the same key in
+    the same request, so by default per-key order is only kept among the
+    retried subset. With ``preserve_order`` every request carries at most
+    one entry per partition key (or explicit hash key), and later entries
+    for a key are held back until the earlier one has gone through or
+    given up. That keeps per-key order at the cost of one round trip per
+    record for a single hot key.
+
+    Returns one outcome per input record, in input order: the Kinesis result
+    entry (``SequenceNumber``/``ShardId``) on success, or a dict with
+    ``ErrorCode``/``ErrorMessage`` once the retry budget is spent or the
+    error is not retryable. ``Attempts`` is set on every outcome.
+
+    With a ShardRateLimiter every attempt first waits for shard budget, and
+    throttled records drain their shard's bucket.
+    """
+    policy = policy or RetryPolicy()
+    outcomes = [None] * len(records)
+    attempts = [0] * len(records)
+    pending = list(range(len(records)))
+    deadline = time.monotonic() + policy.deadline
+    failed_rounds = 0
+
+    while pending:
+        if preserve_order:
+            keys = set()
+            sending = []
+            for i in pending:
+                key = _order_key(records[i])
+                if key not in keys:
+                    keys.add(key)
+                    sending.append(i)
+        else:
+            sending = pending
+
+        if limiter is not None:
+            limiter.acquire([records[i] for i in sending])
+        try:
+            response = client.put_records(
+                Records=[records[i] for i in sending],
+                StreamName=stream_name
+            )
+            entries = response['Records']
+        except Exception as e:
+            entries = [{'ErrorCode': _error_code(e), 'ErrorMessage': str(e)}] * len(sending)
+
+        retry = set()
+        for index, entry in zip(sending, entries):
+            attempts[index] += 1
+            entry = dict(entry, Attempts=attempts[index])
+            outcomes[index] = entry
+            if entry.get('ErrorCode') in RETRYABLE_ERRORS and attempts[index] < policy.max_attempts:
+                retry.add(index)
+
+        if limiter is not None:
+            throttled = [records[i] for i in sending
+                         if outcomes[i].get('ErrorCode') == 'ProvisionedThroughputExceededException']
+            if throttled:
+                limiter.throttled(throttled)
+
+        done = set(sending) - retry
+        pending = [i for i in pending if i not in done]
+        if not pending:
+            break
+        if retry:
+            failed_rounds += 1
+            delay = policy.backoff(failed_rounds)
+            if time.monotonic() + delay > deadline:
+                break
+            time.sleep(delay)
+        elif time.monotonic() > deadline:
+            break
+
+    for index in pending:
+        if outcomes[index] is None:
+            # Held back behind a same-key record until the deadline ran out
+            outcomes[index] = {
+                'ErrorCode': 'RetryBudgetExceeded',
+                'ErrorMessage': 'Not sent: an earlier record with the same key was still being retried',
+                'Attempts': 0,
+            }
+    return outcomes
+
 
 class KinesisDataProducer:
-    def __init__(self):
-        self.client = AWSConfig.get_kinesis_client()
-        self.stream_name = AWSConfig.KINESIS_STREAM_NAME
+    def __init__(self, client=None, stream_name=None, retry_policy=None,
+                 aggregate=False, max_aggregate_bytes=DEFAULT_MAX_AGGREGATE_BYTES,
+                 partitioner=None, tracker=None, codec=None, rate_limiter=None,
+                 preserve_order=False):
+        self.client = client or get_kinesis_client()
+        self.stream_name = stream_name or AWSConfig.KINESIS_STREAM_NAME
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Pack many small user records into one KPL aggregated record
+        self.aggregate = aggregate
+        self.max_aggregate_bytes = max_aggregate_bytes
+        # Chooses partition key / explicit hash key for records sent without one
+        self.partitioner = partitioner or get_default_partitioner(self.client, self.stream_name)
+        # Feeds the partitioner's hot-key detection when it has a tracker
+        self.tracker = tracker or getattr(self.partitioner, 'tracker', None) or get_default_tracker()
+        # Payload envelope (datastream/codec.py); lambda_function decodes any
+        self.codec = codec or default_codec
+        if rate_limiter is None and CLIENT_RATE_LIMIT:
+            rate_limiter = ShardRateLimiter(self.client, self.stream_name)
+        self.rate_limiter = rate_limiter or None
+        # Strict per-key order across retries (see put_records_with_retry)
+        self.preserve_order = preserve_order
     
-    def send_to_stream(self, data, partition_key="default"):
+    def put_record(self, data, partition_key=None):
+        """
+        PutRecord ``data`` and return the response plus the ``PartitionKey``
+        the partitioner chose. Errors are raised, not swallowed.
+        """
+        record = self.build_record(data, partition_key)
+        response = self.client.put_record(StreamName=self.stream_name, **record)
+        self.tracker.record(response.get('ShardId'), record['PartitionKey'], len(record['Data']))
+        return dict(response, PartitionKey=record['PartitionKey'])
+    
+    def send_to_stream(self, data, partition_key=None):
         """
         Send data to Kinesis stream
         """
         try:
-            response = self.client.put_record(
-                StreamName=self.stream_name,
-                Data=json.dumps(data),
-                PartitionKey=partition_key
-            )
+            response = self.put_record(data, partition_key)
             print(f"Data sent to Kinesis. Sequence: {response['SequenceNumber']}")
             return response
         except Exception as e:
             print(f"Error sending to Kinesis: {e}")
             return None
     
-    def send_batch(self, data_list, partition_key="default"):
+    def send_batch(self, data_list, partition_key=None):
         """
-        Send batch data to Kinesis
+        Send batch data to Kinesis, retrying throttled records.
+
+        Returns a PutRecords-shaped dict whose ``Records`` hold one outcome
+        per input item, in order; ``FailedRecordCount`` counts the records
+        that were still failing when the retry budget ran out.
         """
         records = []
         for data in data_list:
-            record = {
-                'Data': json.dumps(data),
-                'PartitionKey': partition_key
-            }
+            record = self.build_record(data, partition_key)
             records.append(record)
         
-        try:
-            response = self.client.put_records(
-                Records=records,
-                StreamName=self.stream_name
-            )
-            return response
-        except Exception as e:
-            print(f"Error sending batch to Kinesis: {e}")
-            return None
\ No newline at end of file
+        return self.send_records(records)
+
+    def send_records(self, records):
+        """
+        Send prepared ``{'Data', 'PartitionKey'}`` entries, any number of them.
+
+        Same return shape as send_batch.
+        """
+        outcomes = self._put_entries(records)
+
+        failed = [o for o in outcomes if 'ErrorCode' in o]
+        if failed:
+            print(f"Error sending batch to Kinesis: {len(failed)} of {len(outcomes)} records failed "
+                  f"({failed[0]['ErrorCode']})")
+        return {'FailedRecordCount': len(failed), 'Records': outcomes}
+
+    def throughput_stats(self):
+        """
+        Per-shard and top per-key write rates from the last full window
+        """
+        return self.tracker.snapshot()
+
+    def build_record(self, data, partition_key=None):
+        """
+        PutRecords entry for ``data``, keyed by the producer's partitioner
+        """
+        partition_key, explicit_hash_key = self.partitioner.assign(data, partition_key)
+        record = {'Data': self.codec.encode(data), 'PartitionKey': partition_key}
+        if explicit_hash_key is not None:
+            record['ExplicitHashKey'] = explicit_hash_key
+        return record
+
+    def _put(self, records):
+        outcomes = put_records_with_retry(
+            self.client, self.stream_name, records, self.retry_policy, self.rate_limiter,
+            self.preserve_order
+        )
+        for record, outcome in zip(records, outcomes):
+            if 'ErrorCode' not in outcome:
+                self.tracker.record(outcome.get('ShardId'), record['PartitionKey'], len(record['Data']))
+            elif outcome['ErrorCode'] == 'ProvisionedThroughputExceededException':
+                self.tracker.record_throttle(record['PartitionKey'])
+        return outcomes
+
+    def _put_entries(self, records):
+        """
+        PutRecords ``records`` in chunks of 500 and return one outcome per
+        input entry. In aggregation mode the entries are packed first and
+        each user record's outcome carries its ``SubSequenceNumber``.
+        """
+        if not self.aggregate:
+            outcomes = []
+            for start in range(0, len(records), MAX_BATCH_RECORDS):
+                outcomes.extend(self._put(records[start:start + MAX_BATCH_RECORDS]))
+            return outcomes
+
+        # Pack across keys per shard, using the rate limiter's shard map
+        shard_starts = self.rate_limiter.shard_starts() if self.rate_limiter is not None else None
+        packed = aggregate(
+            [(r['PartitionKey'], r['Data'], r.get('ExplicitHashKey')) for r in records],
+            self.max_aggregate_bytes, shard_starts
+        )
+        outcomes = [None] * len(records)
+        for start in range(0, len(packed), MAX_BATCH_RECORDS):
+            chunk = packed[start:start + MAX_BATCH_RECORDS]
+            results = self._put([entry for entry, _ in chunk])
+            for (_, members), result in zip(chunk, results):
+                for sub_sequence, index in enumerate(members):
+                    outcomes[index] = result if 'ErrorCode' in result else dict(
+                        result, SubSequenceNumber=sub_sequence
+                    )
+        return outcomes
+
+
+_default_producer = None
+_default_lock = threading.Lock()
+
+
+def get_default_producer():
+    """
+    Process-wide KinesisDataProducer for KINESIS_STREAM_NAME, so requests
+    share one rate limiter (and its shard map and bucket state) instead of
+    describing the stream and starting from full buckets every time
+    """
+    global _default_producer
+    if _default_producer is None:
+        with _default_lock:
+            if _default_producer is None:
+                _default_producer = KinesisDataProducer()
+    return _default_producer
+
+
+class _PendingRecord:
+    __slots__ = ('data', 'partition_key', 'explicit_hash_key', 'size', 'future', 'enqueued')
+
+    def __init__(self, data, partition_key, explicit_hash_key, future):
+        self.data = data
+        self.partition_key = partition_key
+        self.explicit_hash_key = explicit_hash_key
+        self.size = len(data) + len(partition_key.encode('utf-8'))
+        self.future = future
+        self.enqueued = None
+
+    def entry(self):
+        record = {'Data': self.data, 'PartitionKey': self.partition_key}
+        if self.explicit_hash_key is not None:
+            record['ExplicitHashKey'] = self.explicit_hash_key
+        return record
+
+
+class BufferedKinesisProducer(KinesisDataProducer):
+    """
+    Producer that buffers records in memory and sends them with PutRecords
+    from a background thread.
+
+    A batch is flushed as soon as it reaches ``max_batch_records`` records or
+    ``max_batch_bytes`` bytes, or once the oldest buffered record has waited
+    ``linger_ms`` milliseconds. ``put()`` never blocks on Kinesis; it returns
+    a Future resolving to the PutRecords result entry for that record
+    (``SequenceNumber``/``ShardId``) or failing with KinesisPutError.
+
+    Batches go out one at a time, so a batch is only sent once every
+    retry of the one before it has finished. Within a batch, pass
+    ``preserve_order=True`` to keep same-key records in order when some of
+    them are throttled.
+    """
+
+    def __init__(self, client=None, stream_name=None,
+                 max_batch_records=MAX_BATCH_RECORDS, max_batch_bytes=MAX_BATCH_BYTES,
+                 linger_ms=100, max_buffered_records=100000, **kwargs):
+        super().__init__(client=client, stream_name=stream_name, **kwargs)
+        # When aggregating, the 500-entry limit applies to the packed
+        # records, so batches are only cut by size and linger time
+        self.max_batch_records = None if self.aggregate else min(max_batch_records, MAX_BATCH_RECORDS)
+        self.max_batch_bytes = min(max_batch_bytes, MAX_BATCH_BYTES)
+        self.linger = linger_ms / 1000.0
+        self.max_buffered_records = max_buffered_records
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._oldest = None
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, name='kinesis-producer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, data, partition_key=None, callback=None):
+        """
+        Queue a record for sending and return its Future
+        """
+        payload = self._encode(data)
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        partition_key, explicit_hash_key = self.partitioner.assign(data, partition_key)
+        record = _PendingRecord(payload, partition_key, explicit_hash_key, future)
+        if record.size > MAX_RECORD_BYTES:
+            future.set_exception(KinesisPutError('RecordTooLarge', f'{record.size} bytes'))
+            return future
+
+        with self._cond:
+            # Apply back-pressure instead of growing without bound
+            while len(self._buffer) >= self.max_buffered_records and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError('Producer is closed')
+            record.enqueued = time.monotonic()
+            if not self._buffer:
+                self._oldest = record.enqueued
+            self._buffer.append(record)
+            self._buffer_bytes += record.size
+            self._cond.notify_all()
+        return future
+
+    def flush(self, timeout=None):
+        """
+        Send everything buffered so far and wait until it has been acknowledged
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._buffer or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Flush the buffer and stop the background thread
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        atexit.unregister(self.close)
+
+    @property
+    def buffered_records(self):
+        return len(self._buffer)
+
+    def _encode(self, data):
+        if isinstance(data, bytes):
+            return data
+        if isinstance(data, str):
+            return data.encode('utf-8')
+        return self.codec.encode(data)
+
+    def _batch_ready(self):
+        if not self._buffer:
+            return False
+        if self._closed or self._flush_requested:
+            return True
+        if self._buffer_bytes >= self.max_batch_bytes:
+            return True
+        if self.max_batch_records and len(self._buffer) >= self.max_batch_records:
+            return True
+        return time.monotonic() - self._oldest >= self.linger
+
+    def _take_batch(self):
+        batch = []
+        batch_bytes = 0
+        for record in self._buffer:
+            if self.max_batch_records and len(batch) >= self.max_batch_records:
+                break
+            if batch and batch_bytes + record.size > self.max_batch_bytes:
+                break
+            batch.append(record)
+            batch_bytes += record.size
+
+        del self._buffer[:len(batch)]
+        self._buffer_bytes -= batch_bytes
+        # Records left behind keep their own linger deadline
+        self._oldest = self._buffer[0].enqueued if self._buffer else None
+        if not self._buffer:
+            self._flush_requested = False
+        self._in_flight += len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._batch_ready():
+                    if self._closed and not self._buffer:
+                        return
+                    timeout = None
+                    if self._buffer:
+                        timeout = max(self.linger - (time.monotonic() - self._oldest), 0)
+                    self._cond.wait(timeout)
+                batch = self._take_batch()
+                # Wake producers blocked on a full buffer
+                self._cond.notify_all()
+
+            try:
+                self._send(batch)
+            except Exception as e:
+                # Fail this batch but keep the sender thread alive
+                print(f"[KINESIS] Sending {len(batch)} buffered records failed: {e}")
+                error = KinesisPutError(_error_code(e), str(e))
+                for record in batch:
+                    if not record.future.done():
+                        record.future.set_exception(error)
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._cond.notify_all()
+
+    def _send(self, batch):
+        outcomes = self._put_entries([r.entry() for r in batch])
+        for record, entry in zip(batch, outcomes):
+            if 'ErrorCode' in entry:
+                record.future.set_exception(
+                    KinesisPutError(entry['ErrorCode'], entry.get('ErrorMessage', ''))
+                )
+            else:
+                record.future.set_result(entry)
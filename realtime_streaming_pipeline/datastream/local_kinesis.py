@@ -0,0 +1,584 @@
+"""
+In-process stand-in for the Kinesis Data Streams API.
+
+Implements the subset of the boto3 Kinesis client the pipeline uses, with
+the same shard semantics as the real service: partition keys are routed to
+shards by the MD5 of the key (or an explicit hash key) over the 128-bit hash
+key space, sequence numbers increase monotonically within a shard, and the
+per-shard limits (writes: 1000 records/s and 1 MB/s; reads: 5 calls/s and
+2 MB/s) are enforced with ProvisionedThroughputExceededException.
+
+SplitShard and MergeShards are supported: the parent shards are closed
+(GetRecords ends with a null NextShardIterator once they are drained) and
+new records go to the child shards, which list their parents.
+
+LocalKinesis keeps its streams in the memory of one process. SQLiteKinesis
+stores them in a SQLite file instead, so every process that opens the same
+file (the web server, consume_stream workers, a shell) sees the same
+stream.
+"""
+import base64
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from .partitioning import hash_key_for
+
+HASH_KEY_SPACE = 2 ** 128
+
+SHARD_WRITE_RECORDS_PER_SEC = 1000
+SHARD_WRITE_BYTES_PER_SEC = 1024 * 1024
+SHARD_READ_CALLS_PER_SEC = 5
+SHARD_READ_BYTES_PER_SEC = 2 * 1024 * 1024
+MAX_RECORD_BYTES = 1024 * 1024
+
+
+def _client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class _Window:
+    """
+    Fixed one-second window counter used for the per-shard limits
+    """
+    def __init__(self):
+        self.start = 0.0
+        self.count = 0
+        self.bytes = 0
+
+    def admit(self, now, count, size, max_count, max_bytes):
+        if now - self.start >= 1.0:
+            self.start = now
+            self.count = 0
+            self.bytes = 0
+        if self.count + count > max_count or self.bytes + size > max_bytes:
+            return False
+        self.count += count
+        self.bytes += size
+        return True
+
+
+class _Shard:
+    def __init__(self, index, starting_hash_key, ending_hash_key, parents=()):
+        self.index = index
+        self.shard_id = f'shardId-{index:012d}'
+        self.starting_hash_key = starting_hash_key
+        self.ending_hash_key = ending_hash_key
+        self.parents = [parent.shard_id for parent in parents]
+        # Seeded from the clock so numbers keep increasing across restarts,
+        # and past the parents' so order is kept across a reshard
+        self.next_sequence = max([time.time_ns() // 1000] + [p.next_sequence for p in parents])
+        self.starting_sequence = self.next_sequence + 1
+        self.ending_sequence = None
+        self.sequence_numbers = []
+        self.records = []
+        self.trimmed = 0
+        self.write_window = _Window()
+        self.read_window = _Window()
+
+    @property
+    def closed(self):
+        return self.ending_sequence is not None
+
+    def close(self):
+        self.ending_sequence = self.next_sequence
+
+    def describe(self):
+        description = {
+            'ShardId': self.shard_id,
+            'HashKeyRange': {
+                'StartingHashKey': str(self.starting_hash_key),
+                'EndingHashKey': str(self.ending_hash_key),
+            },
+            'SequenceNumberRange': {
+                'StartingSequenceNumber': self.format_sequence(self.starting_sequence),
+            },
+        }
+        if self.parents:
+            description['ParentShardId'] = self.parents[0]
+        if len(self.parents) > 1:
+            description['AdjacentParentShardId'] = self.parents[1]
+        if self.closed:
+            description['SequenceNumberRange']['EndingSequenceNumber'] = self.format_sequence(self.ending_sequence)
+        return description
+
+    def format_sequence(self, value):
+        # Zero-padded so lexical and numeric order agree; the shard index
+        # suffix keeps numbers unique across shards
+        return f'{value:021d}{self.index:04d}'
+
+    def position(self, sequence_number, after=False):
+        value = int(sequence_number[:-4])
+        search = bisect.bisect_right if after else bisect.bisect_left
+        return self.trimmed + search(self.sequence_numbers, value)
+
+
+class _Stream:
+    def __init__(self, name, shard_count, retention_records, shards=None):
+        self.name = name
+        self.arn = f'arn:aws:kinesis:local:000000000000:stream/{name}'
+        self.retention_records = retention_records
+        self.lock = threading.Lock()
+        self.shards = shards or []
+        if not self.shards:
+            step = HASH_KEY_SPACE // shard_count
+            for index in range(shard_count):
+                start = index * step
+                end = HASH_KEY_SPACE - 1 if index == shard_count - 1 else start + step - 1
+                self.shards.append(_Shard(index, start, end))
+        self._route()
+
+    def _route(self):
+        self._open = sorted((s for s in self.shards if not s.closed), key=lambda s: s.starting_hash_key)
+        self._starts = [shard.starting_hash_key for shard in self._open]
+
+    def add_shard(self, starting_hash_key, ending_hash_key, parents):
+        shard = _Shard(len(self.shards), starting_hash_key, ending_hash_key, parents)
+        self.shards.append(shard)
+        return shard
+
+    def shard_for(self, partition_key, explicit_hash_key=None):
+        hash_key = int(explicit_hash_key) if explicit_hash_key is not None else hash_key_for(partition_key)
+        return self._open[bisect.bisect_right(self._starts, hash_key) - 1]
+
+    def shard_by_id(self, shard_id, operation):
+        for shard in self.shards:
+            if shard.shard_id == shard_id:
+                return shard
+        raise _client_error('ResourceNotFoundException', f'Shard {shard_id} not found', operation)
+
+
+class LocalKinesis:
+    """
+    boto3-compatible Kinesis client backed by in-memory shards.
+
+    Streams are created on first use with ``shard_count`` shards. Only the
+    newest ``retention_records`` records per shard are kept.
+    """
+
+    def __init__(self, shard_count=2, enforce_limits=True, retention_records=100000):
+        self.shard_count = shard_count
+        self.enforce_limits = enforce_limits
+        self.retention_records = retention_records
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _stream(self, name):
+        stream = self._streams.get(name)
+        if stream is None:
+            with self._lock:
+                stream = self._streams.setdefault(
+                    name, _Stream(name, self.shard_count, self.retention_records)
+                )
+        return stream
+
+    def _append(self, stream, data, partition_key, explicit_hash_key, operation):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        size = len(data) + len(partition_key.encode('utf-8'))
+        if size > MAX_RECORD_BYTES:
+            raise _client_error('ValidationException', 'Record size exceeds 1 MB', operation)
+
+        shard = stream.shard_for(partition_key, explicit_hash_key)
+        now = time.monotonic()
+        if self.enforce_limits and not shard.write_window.admit(
+                now, 1, size, SHARD_WRITE_RECORDS_PER_SEC, SHARD_WRITE_BYTES_PER_SEC):
+            return shard, None
+
+        shard.next_sequence += 1
+        shard.sequence_numbers.append(shard.next_sequence)
+        shard.records.append({
+            'SequenceNumber': shard.format_sequence(shard.next_sequence),
+            'ApproximateArrivalTimestamp': datetime.now(timezone.utc),
+            'Data': data,
+            'PartitionKey': partition_key,
+        })
+        overflow = len(shard.records) - stream.retention_records
+        if overflow > 0:
+            del shard.records[:overflow]
+            del shard.sequence_numbers[:overflow]
+            shard.trimmed += overflow
+        return shard, shard.records[-1]['SequenceNumber']
+
+    # --- Producer API ---
+
+    def put_record(self, StreamName, Data, PartitionKey, ExplicitHashKey=None, **kwargs):
+        stream = self._stream(StreamName)
+        with stream.lock:
+            shard, sequence = self._append(stream, Data, PartitionKey, ExplicitHashKey, 'PutRecord')
+        if sequence is None:
+            raise _client_error('ProvisionedThroughputExceededException',
+                                f'Rate exceeded for shard {shard.shard_id}', 'PutRecord')
+        return {'ShardId': shard.shard_id, 'SequenceNumber': sequence}
+
+    def put_records(self, Records, StreamName, **kwargs):
+        if len(Records) > 500:
+            raise _client_error('ValidationException', 'At most 500 records per request', 'PutRecords')
+        stream = self._stream(StreamName)
+        results = []
+        failed = 0
+        with stream.lock:
+            for record in Records:
+                shard, sequence = self._append(
+                    stream, record['Data'], record['PartitionKey'],
+                    record.get('ExplicitHashKey'), 'PutRecords'
+                )
+                if sequence is None:
+                    failed += 1
+                    results.append({
+                        'ErrorCode': 'ProvisionedThroughputExceededException',
+                        'ErrorMessage': f'Rate exceeded for shard {shard.shard_id}',
+                    })
+                else:
+                    results.append({'ShardId': shard.shard_id, 'SequenceNumber': sequence})
+        return {'FailedRecordCount': failed, 'Records': results}
+
+    # --- Stream metadata ---
+
+    def describe_stream(self, StreamName, **kwargs):
+        stream = self._stream(StreamName)
+        return {
+            'StreamDescription': {
+                'StreamName': stream.name,
+                'StreamARN': stream.arn,
+                'StreamStatus': 'ACTIVE',
+                'Shards': [shard.describe() for shard in stream.shards],
+                'HasMoreShards': False,
+                'RetentionPeriodHours': 24,
+            }
+        }
+
+    def list_shards(self, StreamName=None, **kwargs):
+        stream = self._stream(StreamName)
+        return {'Shards': [shard.describe() for shard in stream.shards]}
+
+    # --- Resharding ---
+
+    def split_shard(self, StreamName, ShardToSplit, NewStartingHashKey, **kwargs):
+        stream = self._stream(StreamName)
+        with stream.lock:
+            parent = stream.shard_by_id(ShardToSplit, 'SplitShard')
+            split_at = int(NewStartingHashKey)
+            if parent.closed or not parent.starting_hash_key < split_at <= parent.ending_hash_key:
+                raise _client_error('InvalidArgumentException',
+                                    f'Cannot split {ShardToSplit} at {NewStartingHashKey}', 'SplitShard')
+            parent.close()
+            stream.add_shard(parent.starting_hash_key, split_at - 1, [parent])
+            stream.add_shard(split_at, parent.ending_hash_key, [parent])
+            stream._route()
+        return {}
+
+    def merge_shards(self, StreamName, ShardToMerge, AdjacentShardToMerge, **kwargs):
+        stream = self._stream(StreamName)
+        with stream.lock:
+            first = stream.shard_by_id(ShardToMerge, 'MergeShards')
+            second = stream.shard_by_id(AdjacentShardToMerge, 'MergeShards')
+            low, high = sorted([first, second], key=lambda s: s.starting_hash_key)
+            if first.closed or second.closed or low.ending_hash_key + 1 != high.starting_hash_key:
+                raise _client_error('InvalidArgumentException',
+                                    f'{ShardToMerge} and {AdjacentShardToMerge} are not adjacent open shards',
+                                    'MergeShards')
+            first.close()
+            second.close()
+            stream.add_shard(low.starting_hash_key, high.ending_hash_key, [first, second])
+            stream._route()
+        return {}
+
+    # --- Consumer API ---
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType,
+                           StartingSequenceNumber=None, Timestamp=None, **kwargs):
+        stream = self._stream(StreamName)
+        with stream.lock:
+            shard = stream.shard_by_id(ShardId, 'GetShardIterator')
+            if ShardIteratorType == 'TRIM_HORIZON':
+                position = shard.trimmed
+            elif ShardIteratorType == 'LATEST':
+                position = shard.trimmed + len(shard.records)
+            elif ShardIteratorType == 'AT_SEQUENCE_NUMBER':
+                position = shard.position(StartingSequenceNumber)
+            elif ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+                position = shard.position(StartingSequenceNumber, after=True)
+            elif ShardIteratorType == 'AT_TIMESTAMP':
+                if not isinstance(Timestamp, datetime):
+                    Timestamp = datetime.fromtimestamp(float(Timestamp), timezone.utc)
+                arrivals = [r['ApproximateArrivalTimestamp'] for r in shard.records]
+                position = shard.trimmed + bisect.bisect_left(arrivals, Timestamp)
+            else:
+                raise _client_error('InvalidArgumentException',
+                                    f'Unknown ShardIteratorType {ShardIteratorType}', 'GetShardIterator')
+        return {'ShardIterator': self._encode_iterator(stream.name, shard.shard_id, position)}
+
+    def get_records(self, ShardIterator, Limit=10000, **kwargs):
+        name, shard_id, position = self._decode_iterator(ShardIterator)
+        stream = self._stream(name)
+        with stream.lock:
+            shard = stream.shard_by_id(shard_id, 'GetRecords')
+            if self.enforce_limits and not shard.read_window.admit(
+                    time.monotonic(), 1, 0, SHARD_READ_CALLS_PER_SEC, SHARD_READ_BYTES_PER_SEC):
+                raise _client_error('ProvisionedThroughputExceededException',
+                                    f'Rate exceeded for shard {shard.shard_id}', 'GetRecords')
+
+            start = max(position, shard.trimmed) - shard.trimmed
+            records = []
+            size = 0
+            for record in shard.records[start:start + min(Limit, 10000)]:
+                size += len(record['Data'])
+                if records and size > SHARD_READ_BYTES_PER_SEC:
+                    break
+                records.append(record)
+            if self.enforce_limits:
+                shard.read_window.bytes += size
+
+            next_position = shard.trimmed + start + len(records)
+            # A closed shard has no next iterator once it has been read to the end
+            drained = shard.closed and next_position >= shard.trimmed + len(shard.records)
+            behind = 0
+            if records and next_position < shard.trimmed + len(shard.records):
+                latest = shard.records[-1]['ApproximateArrivalTimestamp']
+                behind = int((latest - records[-1]['ApproximateArrivalTimestamp']).total_seconds() * 1000)
+        return {
+            'Records': [dict(record) for record in records],
+            'NextShardIterator': None if drained else self._encode_iterator(name, shard_id, next_position),
+            'MillisBehindLatest': behind,
+        }
+
+    @staticmethod
+    def _encode_iterator(stream_name, shard_id, position):
+        raw = json.dumps([stream_name, shard_id, position]).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    @staticmethod
+    def _decode_iterator(shard_iterator):
+        try:
+            return json.loads(base64.urlsafe_b64decode(shard_iterator.encode('ascii')))
+        except ValueError:
+            raise _client_error('InvalidArgumentException', 'Invalid ShardIterator', 'GetRecords')
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    stream TEXT NOT NULL,
+    shard_index INTEGER NOT NULL,
+    starting_hash_key TEXT NOT NULL,
+    ending_hash_key TEXT NOT NULL,
+    parents TEXT NOT NULL,
+    starting_sequence INTEGER NOT NULL,
+    ending_sequence INTEGER,
+    next_sequence INTEGER NOT NULL,
+    PRIMARY KEY (stream, shard_index)
+);
+CREATE TABLE IF NOT EXISTS records (
+    stream TEXT NOT NULL,
+    shard_index INTEGER NOT NULL,
+    sequence INTEGER NOT NULL,
+    arrival REAL NOT NULL,
+    partition_key TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (stream, shard_index, sequence)
+);
+"""
+
+
+class SQLiteKinesis(LocalKinesis):
+    """
+    LocalKinesis backed by a SQLite file shared between processes.
+
+    Every call runs in its own write transaction, so producers and
+    consumers in different processes see one consistent stream. Routing,
+    sequence numbers and resharding behave as in LocalKinesis; the shard
+    limits are counted per process.
+    """
+
+    def __init__(self, path, shard_count=2, enforce_limits=True, retention_records=100000):
+        super().__init__(shard_count, enforce_limits, retention_records)
+        self.path = path
+        self._local = threading.local()
+        self._windows = {}
+
+    def _connection(self):
+        # One connection per thread, reopened in a forked child
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(_SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+            self._local.streams = {}
+        return self._local.db
+
+    @contextmanager
+    def _shared(self, name):
+        """
+        Load ``name`` for the duration of one transaction and write back
+        what the call changed
+        """
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            stream = self._load(db, name)
+            self._local.streams = {name: stream}
+            yield db, stream
+            self._save(db, stream)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        else:
+            db.execute('COMMIT')
+        finally:
+            self._local.streams = {}
+
+    def _stream(self, name):
+        return self._local.streams[name]
+
+    def _load(self, db, name):
+        rows = db.execute(
+            'SELECT shard_index, starting_hash_key, ending_hash_key, parents, starting_sequence, '
+            'ending_sequence, next_sequence FROM shards WHERE stream = ? ORDER BY shard_index', (name,)
+        ).fetchall()
+        shards = []
+        for index, start, end, parents, starting_sequence, ending_sequence, next_sequence in rows:
+            shard = _Shard(index, int(start), int(end))
+            shard.parents = json.loads(parents)
+            shard.starting_sequence = starting_sequence
+            shard.ending_sequence = ending_sequence
+            shard.next_sequence = next_sequence
+            shards.append(shard)
+        stream = _Stream(name, self.shard_count, self.retention_records, shards)
+        stream.saved = {shard.index: self._shard_row(stream, shard) for shard in shards}
+        for shard in stream.shards:
+            shard.write_window, shard.read_window = self._windows.setdefault(
+                (name, shard.index), (_Window(), _Window())
+            )
+        return stream
+
+    @staticmethod
+    def _shard_row(stream, shard):
+        return (stream.name, shard.index, str(shard.starting_hash_key), str(shard.ending_hash_key),
+                json.dumps(shard.parents), shard.starting_sequence, shard.ending_sequence,
+                shard.next_sequence)
+
+    def _save(self, db, stream):
+        for shard in stream.shards:
+            row = self._shard_row(stream, shard)
+            if stream.saved.get(shard.index) != row:
+                db.execute('INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?, ?, ?, ?, ?)', row)
+            if not shard.records:
+                continue
+            # Only records appended by this call are in memory
+            db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)', [
+                (stream.name, shard.index, int(record['SequenceNumber'][:-4]),
+                 record['ApproximateArrivalTimestamp'].timestamp(), record['PartitionKey'], record['Data'])
+                for record in shard.records
+            ])
+            db.execute(
+                'DELETE FROM records WHERE stream = ? AND shard_index = ? AND sequence <= ('
+                'SELECT sequence FROM records WHERE stream = ? AND shard_index = ? '
+                'ORDER BY sequence DESC LIMIT 1 OFFSET ?)',
+                (stream.name, shard.index, stream.name, shard.index, stream.retention_records)
+            )
+
+    # --- Producer API, metadata and resharding: LocalKinesis on the loaded stream ---
+
+    def put_record(self, StreamName, **kwargs):
+        with self._shared(StreamName):
+            return super().put_record(StreamName=StreamName, **kwargs)
+
+    def put_records(self, Records, StreamName, **kwargs):
+        with self._shared(StreamName):
+            return super().put_records(Records=Records, StreamName=StreamName, **kwargs)
+
+    def describe_stream(self, StreamName, **kwargs):
+        with self._shared(StreamName):
+            return super().describe_stream(StreamName=StreamName, **kwargs)
+
+    def list_shards(self, StreamName=None, **kwargs):
+        with self._shared(StreamName):
+            return super().list_shards(StreamName=StreamName, **kwargs)
+
+    def split_shard(self, StreamName, **kwargs):
+        with self._shared(StreamName):
+            return super().split_shard(StreamName=StreamName, **kwargs)
+
+    def merge_shards(self, StreamName, **kwargs):
+        with self._shared(StreamName):
+            return super().merge_shards(StreamName=StreamName, **kwargs)
+
+    # --- Consumer API ---
+    # Iterators hold the sequence number read up to rather than a position
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType,
+                           StartingSequenceNumber=None, Timestamp=None, **kwargs):
+        with self._shared(StreamName) as (db, stream):
+            shard = stream.shard_by_id(ShardId, 'GetShardIterator')
+            if ShardIteratorType == 'TRIM_HORIZON':
+                after = 0
+            elif ShardIteratorType == 'LATEST':
+                after = shard.next_sequence
+            elif ShardIteratorType == 'AT_SEQUENCE_NUMBER':
+                after = int(StartingSequenceNumber[:-4]) - 1
+            elif ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+                after = int(StartingSequenceNumber[:-4])
+            elif ShardIteratorType == 'AT_TIMESTAMP':
+                if isinstance(Timestamp, datetime):
+                    Timestamp = Timestamp.timestamp()
+                first, = db.execute(
+                    'SELECT MIN(sequence) FROM records WHERE stream = ? AND shard_index = ? AND arrival >= ?',
+                    (stream.name, shard.index, float(Timestamp))
+                ).fetchone()
+                after = shard.next_sequence if first is None else first - 1
+            else:
+                raise _client_error('InvalidArgumentException',
+                                    f'Unknown ShardIteratorType {ShardIteratorType}', 'GetShardIterator')
+        return {'ShardIterator': self._encode_iterator(stream.name, shard.shard_id, after)}
+
+    def get_records(self, ShardIterator, Limit=10000, **kwargs):
+        name, shard_id, after = self._decode_iterator(ShardIterator)
+        with self._shared(name) as (db, stream):
+            shard = stream.shard_by_id(shard_id, 'GetRecords')
+            if self.enforce_limits and not shard.read_window.admit(
+                    time.monotonic(), 1, 0, SHARD_READ_CALLS_PER_SEC, SHARD_READ_BYTES_PER_SEC):
+                raise _client_error('ProvisionedThroughputExceededException',
+                                    f'Rate exceeded for shard {shard.shard_id}', 'GetRecords')
+
+            rows = db.execute(
+                'SELECT sequence, arrival, partition_key, data FROM records '
+                'WHERE stream = ? AND shard_index = ? AND sequence > ? ORDER BY sequence LIMIT ?',
+                (name, shard.index, after, min(Limit, 10000))
+            ).fetchall()
+            records = []
+            size = 0
+            for sequence, arrival, partition_key, data in rows:
+                size += len(data)
+                if records and size > SHARD_READ_BYTES_PER_SEC:
+                    break
+                records.append({
+                    'SequenceNumber': shard.format_sequence(sequence),
+                    'ApproximateArrivalTimestamp': datetime.fromtimestamp(arrival, timezone.utc),
+                    'Data': bytes(data),
+                    'PartitionKey': partition_key,
+                })
+                after = sequence
+            if self.enforce_limits:
+                shard.read_window.bytes += size
+
+            latest = db.execute(
+                'SELECT sequence, arrival FROM records WHERE stream = ? AND shard_index = ? '
+                'ORDER BY sequence DESC LIMIT 1', (name, shard.index)
+            ).fetchone()
+            caught_up = latest is None or after >= latest[0]
+            # A closed shard has no next iterator once it has been read to the end
+            drained = shard.closed and caught_up
+            behind = 0
+            if records and not caught_up:
+                behind = int((latest[1] - records[-1]['ApproximateArrivalTimestamp'].timestamp()) * 1000)
+        return {
+            'Records': records,
+            'NextShardIterator': None if drained else self._encode_iterator(name, shard_id, after),
+            'MillisBehindLatest': behind,
+        }
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('data_type', models.CharField(default='*', max_length=50)),
+                ('conditions', models.JSONField()),
+                ('alert', models.CharField(max_length=100)),
+                ('severity', models.CharField(default='medium', max_length=20)),
+                ('priority', models.IntegerField(default=100)),
+                ('enabled', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['priority', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datastream', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stream_name', models.CharField(max_length=128)),
+                ('shard_id', models.CharField(max_length=128)),
+                ('sequence_number', models.CharField(blank=True, max_length=128, null=True)),
+                ('finished', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('stream_name', 'shard_id')},
+            },
+        ),
+    ]
@@ -1,3 +1,61 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from .rules import WILDCARD, Rule, RuleSet
 
-# Create your models here.
+class AlertRule(models.Model):
+    """
+    Alert rule in the format of datastream/rules.py; exported to the Lambda
+    with ``manage.py export_alert_rules``
+    """
+    name = models.CharField(max_length=100, unique=True)
+    data_type = models.CharField(max_length=50, default=WILDCARD)
+    conditions = models.JSONField()
+    alert = models.CharField(max_length=100)
+    severity = models.CharField(max_length=20, default='medium')
+    priority = models.IntegerField(default=100)
+    enabled = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['priority', 'id']
+    
+    def __str__(self):
+        return f"{self.name} ({self.data_type}) -> {self.alert}"
+    
+    def to_spec(self):
+        return {
+            'name': self.name,
+            'data_type': self.data_type,
+            'conditions': self.conditions,
+            'alert': self.alert,
+            'severity': self.severity,
+        }
+    
+    def clean(self):
+        try:
+            Rule(self.to_spec())
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValidationError({'conditions': f"Invalid rule: {e}"})
+    
+    @classmethod
+    def rule_set(cls):
+        """
+        Compiled RuleSet of the enabled rules, in priority order
+        """
+        return RuleSet([rule.to_spec() for rule in cls.objects.filter(enabled=True)])
+
+class ShardCheckpoint(models.Model):
+    """
+    Last processed sequence number of a shard, written by consume_stream
+    """
+    stream_name = models.CharField(max_length=128)
+    shard_id = models.CharField(max_length=128)
+    sequence_number = models.CharField(max_length=128, null=True, blank=True)
+    finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = [('stream_name', 'shard_id')]
+    
+    def __str__(self):
+        return f"{self.stream_name}/{self.shard_id} @ {self.sequence_number}"
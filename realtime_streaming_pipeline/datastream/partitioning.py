@@ -0,0 +1,235 @@
+# datastream/partitioning.py
+import os
+import hashlib
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Per-shard write limits used for hot-shard detection
+SHARD_RECORDS_PER_SEC = 1000
+SHARD_BYTES_PER_SEC = 1024 * 1024
+
+# key | random | round_robin | salted
+PARTITION_STRATEGY = os.environ.get('KINESIS_PARTITION_STRATEGY', 'key')
+# Comma-separated keys the 'salted' strategy spreads over several shards
+HOT_KEYS = [key for key in os.environ.get('KINESIS_HOT_KEYS', '').split(',') if key]
+
+
+def hash_key_for(partition_key):
+    """
+    The 128-bit hash key Kinesis routes ``partition_key`` by
+    """
+    return int.from_bytes(hashlib.md5(partition_key.encode('utf-8')).digest(), 'big')
+
+
+class KeyPartitioner:
+    """
+    Default strategy: the caller's key, else ``data['partition_key']``,
+    else ``'default'``
+    """
+    def assign(self, data, partition_key=None):
+        if partition_key is None and isinstance(data, dict):
+            partition_key = data.get('partition_key')
+        return str(partition_key or 'default'), None
+
+
+class RandomPartitioner:
+    """
+    Spreads records uniformly over all shards; gives up per-key ordering
+    """
+    def assign(self, data, partition_key=None):
+        return uuid.uuid4().hex, None
+
+
+class RoundRobinPartitioner:
+    """
+    Cycles through explicit hash keys, one per shard, so every shard gets
+    the same share of records regardless of the partition keys used
+    """
+    def __init__(self, hash_keys):
+        if not hash_keys:
+            raise ValueError('RoundRobinPartitioner needs at least one hash key')
+        self.hash_keys = [str(key) for key in hash_keys]
+        self._cycle = itertools.cycle(self.hash_keys)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_stream(cls, client, stream_name):
+        """
+        One hash key per open shard, taken from the middle of its range
+        """
+        shards = client.describe_stream(StreamName=stream_name)['StreamDescription']['Shards']
+        hash_keys = []
+        for shard in shards:
+            if 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {}):
+                continue  # closed by a split/merge
+            start = int(shard['HashKeyRange']['StartingHashKey'])
+            end = int(shard['HashKeyRange']['EndingHashKey'])
+            hash_keys.append((start + end) // 2)
+        return cls(hash_keys)
+
+    def assign(self, data, partition_key=None):
+        with self._lock:
+            hash_key = next(self._cycle)
+        return partition_key or hash_key, hash_key
+
+
+class SaltedKeyPartitioner:
+    """
+    Appends a rotating ``#<n>`` salt to hot keys so their traffic spreads
+    over up to ``salts`` shards; other keys pass through unchanged.
+
+    Hot keys are either configured up front or, with a ThroughputTracker,
+    picked up automatically from the tracker's current hot keys. Consumers
+    that need the original key should read it from the record body.
+    """
+    def __init__(self, hot_keys=(), salts=8, base=None, tracker=None):
+        self.hot_keys = set(hot_keys)
+        self.salts = salts
+        self.base = base or KeyPartitioner()
+        self.tracker = tracker
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def assign(self, data, partition_key=None):
+        partition_key, explicit_hash_key = self.base.assign(data, partition_key)
+        if partition_key not in self.hot_keys and not (
+                self.tracker and partition_key in self.tracker.hot_keys):
+            return partition_key, explicit_hash_key
+        with self._lock:
+            salt = self._counters.get(partition_key, 0)
+            self._counters[partition_key] = (salt + 1) % self.salts
+        return f'{partition_key}#{salt}', None
+
+
+_default_partitioner = None
+_default_lock = threading.Lock()
+
+
+def get_default_partitioner(client=None, stream_name=None):
+    """
+    Process-wide partitioner for KINESIS_PARTITION_STRATEGY; round_robin
+    reads the shard layout from ``describe_stream`` once, salted picks up
+    hot keys from the default ThroughputTracker
+    """
+    global _default_partitioner
+    if _default_partitioner is None:
+        with _default_lock:
+            if _default_partitioner is None:
+                if PARTITION_STRATEGY == 'random':
+                    _default_partitioner = RandomPartitioner()
+                elif PARTITION_STRATEGY == 'round_robin':
+                    _default_partitioner = RoundRobinPartitioner.from_stream(client, stream_name)
+                elif PARTITION_STRATEGY == 'salted':
+                    _default_partitioner = SaltedKeyPartitioner(hot_keys=HOT_KEYS, tracker=get_default_tracker())
+                else:
+                    _default_partitioner = KeyPartitioner()
+    return _default_partitioner
+
+
+class ThroughputTracker:
+    """
+    Per-shard and per-key write throughput over fixed windows.
+
+    ``record()`` is O(1). At the end of each ``window_seconds`` window the
+    rates are published (``snapshot()``) and a warning is printed for any
+    shard running above ``hot_fraction`` of its write limit, or carrying
+    more than ``skew_factor`` times the mean shard load.
+    """
+    def __init__(self, window_seconds=10.0, hot_fraction=0.8, skew_factor=2.0,
+                 top_keys=10, max_keys=10000):
+        self.window_seconds = window_seconds
+        self.hot_fraction = hot_fraction
+        self.skew_factor = skew_factor
+        self.top_keys = top_keys
+        self.max_keys = max_keys
+        self.hot_keys = set()
+        self._lock = threading.Lock()
+        self._last = {'shards': {}, 'keys': [], 'hot_shards': [], 'throttled': 0}
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self._window_start = now
+        self._shard_records = Counter()
+        self._shard_bytes = Counter()
+        self._key_records = Counter()
+        self._throttled = 0
+
+    def record(self, shard_id, partition_key, size):
+        with self._lock:
+            self._roll()
+            self._shard_records[shard_id] += 1
+            self._shard_bytes[shard_id] += size
+            if partition_key in self._key_records or len(self._key_records) < self.max_keys:
+                self._key_records[partition_key] += 1
+
+    def record_throttle(self, partition_key):
+        with self._lock:
+            self._roll()
+            self._throttled += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._roll()
+            return self._last
+
+    def _roll(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window_seconds:
+            return
+
+        shards = {
+            shard_id: {
+                'records_per_sec': self._shard_records[shard_id] / elapsed,
+                'bytes_per_sec': self._shard_bytes[shard_id] / elapsed,
+            }
+            for shard_id in self._shard_records
+        }
+        mean = sum(s['records_per_sec'] for s in shards.values()) / len(shards) if shards else 0
+        hot_shards = []
+        for shard_id, rates in shards.items():
+            load = max(rates['records_per_sec'] / SHARD_RECORDS_PER_SEC,
+                       rates['bytes_per_sec'] / SHARD_BYTES_PER_SEC)
+            skewed = len(shards) > 1 and rates['records_per_sec'] > self.skew_factor * mean
+            if load >= self.hot_fraction or skewed:
+                hot_shards.append(shard_id)
+                print(f"[KINESIS] Hot shard {shard_id}: {rates['records_per_sec']:.0f} records/s, "
+                      f"{rates['bytes_per_sec'] / 1024:.0f} KB/s ({load:.0%} of limit)")
+
+        keys = [
+            {'partition_key': key, 'records_per_sec': count / elapsed}
+            for key, count in self._key_records.most_common(self.top_keys)
+        ]
+        # A key is hot when it alone drives a hot shard past half its budget
+        self.hot_keys = {
+            k['partition_key'] for k in keys
+            if hot_shards and k['records_per_sec'] >= SHARD_RECORDS_PER_SEC * self.hot_fraction / 2
+        }
+        self._last = {
+            'shards': shards,
+            'keys': keys,
+            'hot_shards': hot_shards,
+            'throttled': self._throttled,
+        }
+        self._reset(now)
+
+
+_default_tracker = None
+_default_tracker_lock = threading.Lock()
+
+
+def get_default_tracker():
+    """
+    Process-wide ThroughputTracker, shared by the default partitioner and
+    by every writer that does not bring its own, so the keys they report
+    feed back into salting
+    """
+    global _default_tracker
+    if _default_tracker is None:
+        with _default_tracker_lock:
+            if _default_tracker is None:
+                _default_tracker = ThroughputTracker()
+    return _default_tracker
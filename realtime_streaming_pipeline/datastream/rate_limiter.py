@@ -0,0 +1,167 @@
+# datastream/rate_limiter.py
+import bisect
+import threading
+import time
+from .partitioning import SHARD_BYTES_PER_SEC, SHARD_RECORDS_PER_SEC, hash_key_for
+
+
+class TokenBucket:
+    """
+    Token bucket that may go into debt.
+
+    Callers wait out ``wait_time()`` until the bucket is non-negative and
+    then ``take()`` the full amount, so a request larger than the burst
+    capacity still goes through and simply pushes later callers back. Over time the admitted
+    rate converges on ``rate`` per second.
+    """
+    def __init__(self, rate, capacity=None, now=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+
+class ShardRateLimiter:
+    """
+    Paces PutRecords calls so no shard is asked for more than its write
+    budget (1000 records/s and 1 MB/s by default).
+
+    Records are mapped to shards the way Kinesis does it, from the MD5 of
+    the partition key (or the explicit hash key) and each shard's hash key
+    range. The shard map is re-read from ``describe_stream`` every
+    ``refresh_interval`` seconds; when the number of open shards changes
+    the buckets are rebuilt, so capacity scales with resharding. If the
+    stream cannot be described the limiter lets everything through.
+    ``clock`` and ``sleep`` can be replaced, e.g. by a fake clock in tests.
+    """
+    def __init__(self, client, stream_name, records_per_sec=SHARD_RECORDS_PER_SEC,
+                 bytes_per_sec=SHARD_BYTES_PER_SEC, burst=0.5, refresh_interval=60.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.client = client
+        self.stream_name = stream_name
+        self.records_per_sec = records_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        # Bucket capacity in seconds of budget; keeps bursts from spilling
+        # over into Kinesis' next accounting window
+        self.burst = burst
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.waited = 0.0
+        self._lock = threading.Lock()
+        self._starts = []
+        self._shards = []
+        self._buckets = {}
+        self._refreshed = None
+
+    @property
+    def shard_count(self):
+        return len(self._shards)
+
+    def refresh(self):
+        self._refreshed = now = self.clock()
+        try:
+            description = self.client.describe_stream(StreamName=self.stream_name)['StreamDescription']
+        except Exception as e:
+            print(f"[KINESIS] Rate limiter disabled, cannot describe stream: {e}")
+            self._starts, self._shards = [], []
+            return
+
+        shards = sorted(
+            (int(s['HashKeyRange']['StartingHashKey']), s['ShardId'])
+            for s in description['Shards']
+            if 'EndingSequenceNumber' not in s.get('SequenceNumberRange', {})
+        )
+        shard_ids = [shard_id for _, shard_id in shards]
+        if shard_ids != self._shards:
+            if self._shards:
+                print(f"[KINESIS] Shard count changed: {len(self._shards)} -> {len(shard_ids)}")
+            # Keep the state of shards that still exist
+            self._buckets = {
+                shard_id: self._buckets.get(shard_id) or (
+                    TokenBucket(self.records_per_sec, self.records_per_sec * self.burst, now),
+                    TokenBucket(self.bytes_per_sec, self.bytes_per_sec * self.burst, now),
+                )
+                for shard_id in shard_ids
+            }
+        self._starts = [start for start, _ in shards]
+        self._shards = shard_ids
+
+    def shard_starts(self):
+        """
+        Sorted starting hash keys of the open shards (empty if unknown)
+        """
+        with self._lock:
+            if self._refreshed is None or self.clock() - self._refreshed >= self.refresh_interval:
+                self.refresh()
+            return list(self._starts)
+
+    def shard_for(self, record):
+        if 'ExplicitHashKey' in record:
+            hash_key = int(record['ExplicitHashKey'])
+        else:
+            hash_key = hash_key_for(record['PartitionKey'])
+        return self._shards[max(bisect.bisect_right(self._starts, hash_key) - 1, 0)]
+
+    def _demand(self, records):
+        demand = {}
+        for record in records:
+            shard_id = self.shard_for(record)
+            count, size = demand.get(shard_id, (0, 0))
+            demand[shard_id] = (count + 1, size + len(record['Data']) + len(record['PartitionKey']))
+        return demand
+
+    def acquire(self, records):
+        """
+        Block until every shard touched by ``records`` has budget, then
+        charge it
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                if self._refreshed is None or self.clock() - self._refreshed >= self.refresh_interval:
+                    self.refresh()
+                if not self._shards:
+                    return waited
+
+                demand = self._demand(records)
+                now = self.clock()
+                delay = max(
+                    max(self._buckets[shard_id][0].wait_time(now), self._buckets[shard_id][1].wait_time(now))
+                    for shard_id in demand
+                )
+                if delay <= 0:
+                    for shard_id, (count, size) in demand.items():
+                        self._buckets[shard_id][0].take(count)
+                        self._buckets[shard_id][1].take(size)
+                    self.waited += waited
+                    return waited
+            # Sleep outside the lock so sends to other shards are not held up
+            self.sleep(delay)
+            waited += delay
+
+    def throttled(self, records):
+        """
+        Kinesis throttled these records anyway: empty their shards' buckets
+        so the next sends back off
+        """
+        with self._lock:
+            if not self._shards:
+                return
+            for shard_id in self._demand(records):
+                for bucket in self._buckets[shard_id]:
+                    bucket.drain()
@@ -0,0 +1,395 @@
+"""
+Declarative alert rules.
+
+A rule is a plain dict, so rules can live in a JSON file (ALERT_RULES_FILE,
+exported from the AlertRule table with ``manage.py export_alert_rules``) or
+in the database::
+
+    {
+        "name": "high_temperature",
+        "data_type": "sensor",          # "*" applies to every data type
+        "conditions": [                 # all must hold
+            {"field": "temperature", "op": "gt", "value": 30}
+        ],
+        "alert": "HIGH_TEMPERATURE",
+        "severity": "high"
+    }
+
+Operators: gt, gte, lt, lte, eq, ne, in, not_in, contains, exists.
+``field`` may be a dotted path into nested dicts; instead of ``value`` a
+condition can give ``value_field`` to compare two fields of the record.
+Numeric operators only match finite real numbers, so a malformed value
+never raises.
+
+Rules are compiled once into a RuleSet, indexed by data_type. Within a
+data type, rules whose first condition is a numeric threshold are kept in
+sorted arrays per (field, op) and found with a binary search, and
+equality rules are found with a dict lookup, so the cost per record grows
+with the number of distinct fields checked rather than with the number of
+rules. numpy is only imported by the batch path.
+"""
+import os
+import bisect
+import json
+import math
+import operator
+import threading
+
+WILDCARD = '*'
+
+MISSING = object()
+
+NUMERIC_OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+OPERATORS = dict(NUMERIC_OPERATORS, **{
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'in': lambda actual, expected: actual in expected,
+    'not_in': lambda actual, expected: actual not in expected,
+    'contains': lambda actual, expected: expected in actual,
+})
+
+# Kept for records without an alert rule configuration
+DEFAULT_RULES = [
+    {
+        'name': 'high_value',
+        'data_type': WILDCARD,
+        'conditions': [{'field': 'value', 'op': 'gt', 'value': 100}],
+        'alert': 'HIGH_VALUE_ALERT',
+        'severity': 'high',
+    },
+    {
+        'name': 'high_temperature',
+        'data_type': 'sensor',
+        'conditions': [{'field': 'temperature', 'op': 'gt', 'value': 30}],
+        'alert': 'HIGH_TEMPERATURE',
+        'severity': 'medium',
+    },
+    {
+        'name': 'sensor_critical',
+        'data_type': 'sensor',
+        'conditions': [{'field': 'status', 'op': 'eq', 'value': 'critical'}],
+        'alert': 'SENSOR_CRITICAL',
+        'severity': 'high',
+    },
+    {
+        'name': 'metric_over_threshold',
+        'data_type': 'metric',
+        'conditions': [{'field': 'value', 'op': 'gte', 'value_field': 'threshold'}],
+        'alert': 'METRIC_THRESHOLD_EXCEEDED',
+        'severity': 'medium',
+    },
+    {
+        'name': 'metric_status_exceeded',
+        'data_type': 'metric',
+        'conditions': [{'field': 'status', 'op': 'eq', 'value': 'exceeded'}],
+        'alert': 'METRIC_THRESHOLD_EXCEEDED',
+        'severity': 'medium',
+    },
+    {
+        'name': 'log_error',
+        'data_type': 'log',
+        'conditions': [{'field': 'level', 'op': 'eq', 'value': 'ERROR'}],
+        'alert': 'LOG_ERROR',
+        'severity': 'medium',
+    },
+]
+
+
+def _is_number(value):
+    # bool is an int subclass but not a measurement; NaN and infinities
+    # compare inconsistently (and sort anywhere in a binary search)
+    return type(value) is int or (type(value) is float and math.isfinite(value))
+
+
+def _getter(field):
+    parts = field.split('.')
+    if len(parts) == 1:
+        return lambda data: data.get(field, MISSING)
+
+    def get(data):
+        for part in parts:
+            if not isinstance(data, dict):
+                return MISSING
+            data = data.get(part, MISSING)
+        return data
+    return get
+
+
+class Condition:
+    def __init__(self, field, op, value=None, value_field=None):
+        if op != 'exists' and op not in OPERATORS:
+            raise ValueError(f'Unknown operator {op!r}')
+        if op in NUMERIC_OPERATORS and value_field is None and not _is_number(value):
+            raise ValueError(f'Operator {op!r} needs a numeric value, got {value!r}')
+        if op in ('in', 'not_in') and not isinstance(value, (list, tuple, set)):
+            raise ValueError(f'Operator {op!r} needs a list value, got {value!r}')
+        self.field = field
+        self.op = op
+        self.value = set(value) if op in ('in', 'not_in') and all(
+            isinstance(v, (str, int, float)) for v in value) else value
+        self.value_field = value_field
+        self.get = _getter(field)
+        self.matches = self._compile()
+
+    def _compile(self):
+        get = self.get
+        if self.op == 'exists':
+            expected = self.value is None or bool(self.value)
+            return lambda data: (get(data) is not MISSING) == expected
+
+        compare = OPERATORS[self.op]
+        numeric = self.op in NUMERIC_OPERATORS
+        if self.value_field is not None:
+            get_other = _getter(self.value_field)
+        else:
+            constant = self.value
+            get_other = lambda data: constant
+
+        def matches(data):
+            actual = get(data)
+            expected = get_other(data)
+            if actual is MISSING or expected is MISSING:
+                return False
+            if numeric and not (_is_number(actual) and _is_number(expected)):
+                return False
+            try:
+                return bool(compare(actual, expected))
+            except TypeError:
+                return False
+        return matches
+
+    @property
+    def is_threshold(self):
+        return self.op in NUMERIC_OPERATORS and self.value_field is None
+
+    @property
+    def is_equality(self):
+        if self.value_field is not None:
+            return False
+        if self.op == 'eq':
+            return isinstance(self.value, (str, int, float))
+        return self.op == 'in' and isinstance(self.value, set)
+
+
+class Rule:
+    def __init__(self, spec, order=0):
+        self.name = spec['name']
+        self.data_type = spec.get('data_type') or WILDCARD
+        self.alert = spec['alert']
+        self.severity = spec.get('severity', 'medium')
+        self.order = order
+        conditions = spec.get('conditions') or []
+        if not conditions:
+            raise ValueError(f'Rule {self.name!r} has no conditions')
+        self.conditions = [
+            Condition(c['field'], c['op'], c.get('value'), c.get('value_field'))
+            for c in conditions
+        ]
+        # The first indexable condition is looked up; the rest are checked
+        anchor = next(
+            (c for c in self.conditions if c.is_threshold or c.is_equality),
+            self.conditions[0]
+        )
+        self.anchor = anchor
+        rest = [c.matches for c in self.conditions if c is not anchor]
+        self.check_rest = lambda data: all(matches(data) for matches in rest)
+
+    def matches(self, data):
+        return all(condition.matches(data) for condition in self.conditions)
+
+
+class _ThresholdGroup:
+    """
+    Threshold rules on one (field, op), sorted by threshold
+    """
+    def __init__(self, op, rules):
+        self.op = op
+        rules = sorted(rules, key=lambda rule: rule.anchor.value)
+        self.rules = rules
+        self.thresholds = [rule.anchor.value for rule in rules]
+        self._array = None
+        # gt/gte match a prefix of the thresholds, lt/lte a suffix
+        self.prefix = op in ('gt', 'gte')
+        self.side = 'left' if op in ('gt', 'lte') else 'right'
+
+    def cut(self, value):
+        if self.side == 'left':
+            return bisect.bisect_left(self.thresholds, value)
+        return bisect.bisect_right(self.thresholds, value)
+
+    def cuts(self, values):
+        import numpy as np
+        if self._array is None:
+            self._array = np.array(self.thresholds, dtype=np.float64)
+        return np.searchsorted(self._array, values, side=self.side)
+
+    def candidates(self, cut):
+        return self.rules[:cut] if self.prefix else self.rules[cut:]
+
+
+class _TypeIndex:
+    """
+    The rules that apply to one data type
+    """
+    def __init__(self, rules):
+        thresholds = {}
+        self.equality = {}
+        self.scanned = []
+        for rule in rules:
+            anchor = rule.anchor
+            if anchor.is_threshold:
+                thresholds.setdefault((anchor.field, anchor.op), []).append(rule)
+            elif anchor.is_equality:
+                lookup = self.equality.setdefault(anchor.field, (anchor.get, {}))[1]
+                for value in (anchor.value if anchor.op == 'in' else [anchor.value]):
+                    lookup.setdefault(value, []).append(rule)
+            else:
+                self.scanned.append(rule)
+        self.thresholds = [
+            (field, rules[0].anchor.get, _ThresholdGroup(op, rules))
+            for (field, op), rules in thresholds.items()
+        ]
+
+    def candidates(self, data, cuts=None):
+        found = []
+        for position, (field, get, group) in enumerate(self.thresholds):
+            if cuts is not None:
+                cut = cuts[position]
+                if cut < 0:
+                    continue
+            else:
+                value = get(data)
+                if not _is_number(value):
+                    continue
+                cut = group.cut(value)
+            found.extend(group.candidates(cut))
+        for get, lookup in self.equality.values():
+            value = get(data)
+            if value is not MISSING:
+                try:
+                    found.extend(lookup.get(value, ()))
+                except TypeError:
+                    pass  # unhashable value
+        return found
+
+    def match(self, data, cuts=None):
+        matched = [rule for rule in self.candidates(data, cuts) if rule.check_rest(data)]
+        matched.extend(rule for rule in self.scanned if rule.matches(data))
+        matched.sort(key=lambda rule: rule.order)
+        return matched
+
+
+class RuleSet:
+    """
+    Compiled, data_type-indexed alert rules
+    """
+    def __init__(self, specs):
+        self.rules = [Rule(spec, order) for order, spec in enumerate(specs)]
+        wildcard = [rule for rule in self.rules if rule.data_type == WILDCARD]
+        by_type = {}
+        for rule in self.rules:
+            if rule.data_type != WILDCARD:
+                by_type.setdefault(rule.data_type, []).append(rule)
+        self._wildcard = _TypeIndex(wildcard)
+        self._by_type = {
+            data_type: _TypeIndex(rules + wildcard) for data_type, rules in by_type.items()
+        }
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _index_for(self, data):
+        data_type = data.get('data_type')
+        try:
+            return self._by_type.get(data_type, self._wildcard)
+        except TypeError:
+            return self._wildcard
+
+    def evaluate(self, data):
+        """
+        Rules matched by one record, in rule order
+        """
+        return self._index_for(data).match(data)
+
+    def evaluate_batch(self, data_list):
+        """
+        Same as ``evaluate`` for every record; threshold lookups run as one
+        ``searchsorted`` per (data type, field, op)
+        """
+        import numpy as np
+        groups = {}
+        for i, data in enumerate(data_list):
+            groups.setdefault(id(self._index_for(data)), []).append(i)
+
+        results = [None] * len(data_list)
+        for positions in groups.values():
+            index = self._index_for(data_list[positions[0]])
+            # cuts[p][j]: threshold cut for record j in group p, -1 if not numeric
+            columns = []
+            for field, get, group in index.thresholds:
+                values = np.zeros(len(positions), dtype=np.float64)
+                numeric = np.zeros(len(positions), dtype=bool)
+                for j, i in enumerate(positions):
+                    value = get(data_list[i])
+                    if _is_number(value):
+                        numeric[j] = True
+                        values[j] = value
+                columns.append(np.where(numeric, group.cuts(values), -1).tolist())
+            for j, i in enumerate(positions):
+                cuts = [column[j] for column in columns]
+                results[i] = index.match(data_list[i], cuts)
+        return results
+
+    @staticmethod
+    def annotate(data, matched):
+        """
+        Record the matched alerts on ``data``: the first one in 'alert',
+        every distinct one in 'alerts'
+        """
+        if not matched:
+            return data
+        alerts = list(dict.fromkeys(rule.alert for rule in matched))
+        data['alert'] = alerts[0]
+        data['alerts'] = alerts
+        return data
+
+    def apply(self, data):
+        return self.annotate(data, self.evaluate(data))
+
+    def apply_batch(self, data_list):
+        for data, matched in zip(data_list, self.evaluate_batch(data_list)):
+            self.annotate(data, matched)
+        return data_list
+
+
+def load_rules(path=None):
+    """
+    Rule specs from ALERT_RULES_FILE (a JSON list), else DEFAULT_RULES
+    """
+    path = path or os.environ.get('ALERT_RULES_FILE')
+    if not path:
+        return DEFAULT_RULES
+    with open(path) as f:
+        return json.load(f)
+
+
+_rule_set = None
+_rule_set_lock = threading.Lock()
+
+
+def get_rule_set():
+    """
+    Process-wide RuleSet, compiled on first use
+    """
+    global _rule_set
+    if _rule_set is None:
+        with _rule_set_lock:
+            if _rule_set is None:
+                _rule_set = RuleSet(load_rules())
+    return _rule_set
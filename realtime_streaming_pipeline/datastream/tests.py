@@ -1,3 +1,1164 @@
-from django.test import TestCase
+import base64
+import bisect
+import copy
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from decimal import Decimal
+from unittest import mock, skipIf
+from boto3.dynamodb.types import TypeSerializer
+from django.test import SimpleTestCase, TestCase
+import lambda_function
+from . import clients, codec, coldstart, partitioning
+from .anomaly import AnomalyDetector
+from .aggregation import KPL_MAGIC, RecordAggregator, aggregate, deaggregate
+from .checkpoints import DatabaseCheckpointStore
+from .codec import default_codec
+from .consumer import ERROR_BACKOFF, MemoryCheckpointStore, StreamConsumer
+from .rules import DEFAULT_RULES, RuleSet
+from .partitioning import (
+    KeyPartitioner, RandomPartitioner, RoundRobinPartitioner, SaltedKeyPartitioner, ThroughputTracker,
+    get_default_partitioner, hash_key_for
+)
+from .kinesis_producer import (
+    BufferedKinesisProducer, KinesisDataProducer, KinesisPutError, RetryPolicy, put_records_with_retry
+)
+from .local_kinesis import LocalKinesis, SQLiteKinesis
+from .rate_limiter import ShardRateLimiter, TokenBucket
+from .windows import WindowAggregator, parse_windows
 
-# Create your tests here.
+class LambdaColdStartTests(SimpleTestCase):
+    """
+    Import-time budget for lambda_function (see datastream/coldstart.py)
+    """
+    
+    def test_import_skips_heavy_modules(self):
+        _, entries = coldstart.import_times('lambda_function')
+        self.assertEqual(coldstart.heavy_imports(entries), [])
+    
+    def test_import_within_budget(self):
+        # Best of three: a busy machine should not fail the build
+        total_ms = min(coldstart.import_times('lambda_function')[0] for _ in range(3))
+        self.assertLessEqual(
+            total_ms, coldstart.IMPORT_BUDGET_MS,
+            f"Importing lambda_function took {total_ms:.1f} ms "
+            f"(budget {coldstart.IMPORT_BUDGET_MS:.0f} ms); "
+            f"run 'python -m datastream.coldstart' for the slowest imports"
+        )
+    
+    def test_empty_invocation_creates_no_clients(self):
+        report = coldstart.cold_start('lambda_function')
+        self.assertNotIn('boto3', report['modules_after_invocation'])
+
+
+class ClientRegistryTests(SimpleTestCase):
+    """
+    One boto3 client per (service, region) per process, and the Kinesis
+    backend switch
+    """
+    
+    def setUp(self):
+        self.registry = clients.ClientRegistry(region_name='eu-west-1')
+        self.session = mock.Mock()
+        self.session.client.side_effect = lambda service, **kwargs: mock.Mock(service=service, **kwargs)
+        patcher = mock.patch.object(self.registry, '_get_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_client_is_shared(self):
+        kinesis = self.registry.client('kinesis')
+        self.assertIs(self.registry.client('kinesis'), kinesis)
+        self.assertIs(self.registry.client('kinesis', 'eu-west-1'), kinesis)
+        self.assertIsNot(self.registry.client('kinesis', 'us-east-1'), kinesis)
+        self.assertIsNot(self.registry.client('lambda'), kinesis)
+        self.assertEqual(self.session.client.call_count, 3)
+        self.assertEqual(self.registry.client('kinesis', 'us-east-1').region_name, 'us-east-1')
+    
+    def test_concurrent_callers_share_one_client(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.registry.client('kinesis')))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(client) for client in results}), 1)
+        self.assertEqual(self.session.client.call_count, 1)
+    
+    def test_new_process_gets_new_clients(self):
+        kinesis = self.registry.client('kinesis')
+        self.registry.after_fork()
+        self.assertIsNot(self.registry.client('kinesis'), kinesis)
+    
+    def test_kinesis_backend_switch(self):
+        local = LocalKinesis()
+        with mock.patch.object(clients, 'KINESIS_BACKEND', 'local'), \
+                mock.patch.object(clients, '_local_kinesis', local):
+            self.assertIs(clients.get_kinesis_client(), local)
+            self.assertFalse(self.session.client.called)
+        with mock.patch.object(clients, 'KINESIS_BACKEND', 'aws'), \
+                mock.patch.object(clients, 'registry', self.registry):
+            self.assertIs(clients.get_kinesis_client(), self.registry.client('kinesis'))
+            self.assertEqual(self.session.client.call_args[0], ('kinesis',))
+
+
+class CodecTests(SimpleTestCase):
+    """
+    Record envelope round trips, legacy payloads and bad headers
+    """
+    
+    event = {
+        'user_id': 7, 'username': 'alice', 'data_type': 'sensor',
+        'data_content': {'sensor_id': 'sensor-12', 'temperature': 21.5, 'unit': '\u00b0C',
+                         'location': 'server-room-1', 'status': 'normal'},
+        'timestamp': '2026-01-02T03:04:05', 'partition_key': 'sensor-12',
+    }
+    
+    def header(self, payload):
+        return payload[0] & codec.VERSION_MASK, (payload[0] >> 2) & 0x03, payload[0] & 0x03
+    
+    def test_zlib_round_trip_uses_dictionary(self):
+        payload = codec.RecordCodec(format='json', compression='zlib').encode(self.event)
+        self.assertEqual(self.header(payload), (codec.ENVELOPE_VERSION, codec.COMPRESSION_ZLIB, codec.FORMAT_JSON))
+        self.assertEqual(codec.decode(payload), self.event)
+        
+        plain = json.dumps(self.event, separators=(',', ':')).encode()
+        without_dictionary = zlib.compress(plain, 6)
+        self.assertLess(len(payload), len(without_dictionary))
+        # The body cannot be inflated without the preset dictionary
+        with self.assertRaises(zlib.error):
+            zlib.decompress(payload[1:])
+    
+    def test_small_records_are_not_compressed(self):
+        payload = codec.RecordCodec(compression='zlib').encode({'n': 1})
+        self.assertEqual(self.header(payload)[1], codec.COMPRESSION_NONE)
+        self.assertEqual(payload[1:], b'{"n":1}')
+        self.assertEqual(codec.decode(payload), {'n': 1})
+    
+    def test_legacy_plain_json(self):
+        payload = codec.PlainJSONCodec().encode(self.event)
+        self.assertEqual(payload, json.dumps(self.event).encode())
+        self.assertEqual(codec.decode(payload), self.event)
+        self.assertEqual(codec.decode(payload.decode()), self.event)
+        self.assertEqual(codec.decode(json.dumps(['\u00e9']).encode()), ['\u00e9'])
+    
+    def test_unknown_version_or_codec_is_rejected(self):
+        body = b'{"n":1}'
+        for header in [codec.ENVELOPE_VERSION | (3 << 2), codec.ENVELOPE_VERSION | 2, codec.ENVELOPE_VERSION | 3]:
+            with self.assertRaises(ValueError):
+                codec.decode(bytes([header]) + body)
+        # Not an envelope and not JSON either
+        with self.assertRaises(ValueError):
+            codec.decode(bytes([0xB0]) + body)
+        with self.assertRaises(KeyError):
+            codec.RecordCodec(format='avro')
+    
+    @skipIf(codec.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        payload = codec.RecordCodec(format='msgpack', compression='none').encode(self.event)
+        self.assertEqual(self.header(payload)[2], codec.FORMAT_MSGPACK)
+        self.assertEqual(codec.decode(payload), self.event)
+    
+    @skipIf(codec.zstandard is None, 'zstandard is not installed')
+    def test_zstd_round_trip(self):
+        payload = codec.RecordCodec(compression='zstd', min_compress_bytes=0).encode(self.event)
+        self.assertEqual(self.header(payload)[1], codec.COMPRESSION_ZSTD)
+        self.assertEqual(codec.decode(payload), self.event)
+    
+    @skipIf(codec.msgpack is not None and codec.zstandard is not None, 'msgpack and zstandard are installed')
+    def test_falls_back_without_optional_packages(self):
+        record_codec = codec.RecordCodec(format='msgpack', compression='zstd')
+        if codec.msgpack is None:
+            self.assertEqual(record_codec.format, codec.FORMAT_JSON)
+            with self.assertRaises(ValueError):
+                codec.decode(bytes([codec.ENVELOPE_VERSION | codec.FORMAT_MSGPACK]) + b'\x81\xa1n\x01')
+        if codec.zstandard is None:
+            self.assertEqual(record_codec.compression, codec.COMPRESSION_ZLIB)
+            with self.assertRaises(ValueError):
+                codec.decode(bytes([codec.ENVELOPE_VERSION | (codec.COMPRESSION_ZSTD << 2)]) + b'\x28\xb5\x2f\xfd')
+        self.assertEqual(codec.decode(record_codec.encode(self.event)), self.event)
+
+
+class PutRecordsRetryTests(SimpleTestCase):
+    """
+    put_records_with_retry against LocalKinesis with the shard limits on
+    """
+    
+    def setUp(self):
+        self.client = LocalKinesis(shard_count=1, enforce_limits=True)
+        self.policy = RetryPolicy(max_attempts=50, base_delay=0.05, max_delay=0.2, deadline=10)
+    
+    def stored(self):
+        shard_id = self.client.describe_stream(StreamName='test')['StreamDescription']['Shards'][0]['ShardId']
+        iterator = self.client.get_shard_iterator(
+            StreamName='test', ShardId=shard_id, ShardIteratorType='TRIM_HORIZON'
+        )['ShardIterator']
+        return self.client.get_records(ShardIterator=iterator)['Records']
+    
+    def fill_shard(self, count):
+        # Use up most of this second's 1000-record write budget
+        for start in range(0, count, 500):
+            self.client.put_records(
+                StreamName='test',
+                Records=[{'Data': b'-', 'PartitionKey': 'filler'}] * min(500, count - start)
+            )
+    
+    def test_throttled_records_are_retried(self):
+        self.fill_shard(900)
+        records = [{'Data': str(i).encode(), 'PartitionKey': f'key-{i % 7}'} for i in range(300)]
+        outcomes = put_records_with_retry(self.client, 'test', records, self.policy)
+        
+        self.assertTrue(all('SequenceNumber' in o for o in outcomes))
+        self.assertEqual(outcomes[0]['Attempts'], 1)
+        self.assertGreater(outcomes[-1]['Attempts'], 1)
+        self.assertEqual(len(self.stored()), 1200)
+    
+    def test_gives_up_after_max_attempts(self):
+        self.fill_shard(900)
+        records = [{'Data': b'x', 'PartitionKey': 'key'} for _ in range(300)]
+        policy = RetryPolicy(max_attempts=2, base_delay=0, max_delay=0)
+        outcomes = put_records_with_retry(self.client, 'test', records, policy)
+        
+        failed = [o for o in outcomes if 'ErrorCode' in o]
+        self.assertEqual(len(failed), 200)
+        self.assertEqual({o['ErrorCode'] for o in failed}, {'ProvisionedThroughputExceededException'})
+        self.assertEqual({o['Attempts'] for o in failed}, {2})
+    
+    def test_non_retryable_error_is_not_retried(self):
+        records = [{'Data': b'x' * (1024 * 1024 + 1), 'PartitionKey': 'key'}]
+        outcomes = put_records_with_retry(self.client, 'test', records, self.policy)
+        self.assertEqual(outcomes[0]['ErrorCode'], 'ValidationException')
+        self.assertEqual(outcomes[0]['Attempts'], 1)
+    
+    def _same_key_records(self):
+        # The second record overflows the shard's 1 MB/s; the third still fits
+        return [
+            {'Data': bytes([i]) * size, 'PartitionKey': 'key'}
+            for i, size in enumerate([600 * 1024, 600 * 1024, 10 * 1024])
+        ]
+    
+    def test_retry_can_reorder_same_key_records(self):
+        outcomes = put_records_with_retry(self.client, 'test', self._same_key_records(), self.policy)
+        self.assertTrue(all('SequenceNumber' in o for o in outcomes))
+        self.assertEqual([r['Data'][0] for r in self.stored()], [0, 2, 1])
+    
+    def test_preserve_order_holds_back_same_key_records(self):
+        outcomes = put_records_with_retry(
+            self.client, 'test', self._same_key_records(), self.policy, preserve_order=True
+        )
+        self.assertTrue(all('SequenceNumber' in o for o in outcomes))
+        self.assertEqual([r['Data'][0] for r in self.stored()], [0, 1, 2])
+
+
+class BufferedProducerTests(SimpleTestCase):
+    """
+    BufferedKinesisProducer batching, flushing and failure handling
+    """
+    
+    def producer(self, **kwargs):
+        kwargs.setdefault('linger_ms', 10000)
+        producer = BufferedKinesisProducer(
+            client=LocalKinesis(enforce_limits=False), stream_name='test',
+            partitioner=KeyPartitioner(), tracker=ThroughputTracker(), **kwargs
+        )
+        self.addCleanup(producer.close, 5)
+        return producer
+    
+    def test_linger_triggers_send(self):
+        producer = self.producer(linger_ms=50)
+        started = time.monotonic()
+        future = producer.put({'n': 1}, 'key')
+        self.assertIn('SequenceNumber', future.result(timeout=5))
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+    
+    def test_full_batch_is_sent_without_waiting_for_linger(self):
+        producer = self.producer(max_batch_records=3)
+        futures = [producer.put({'n': i}, 'key') for i in range(4)]
+        for future in futures[:3]:
+            self.assertIn('SequenceNumber', future.result(timeout=5))
+        self.assertFalse(futures[3].done())
+        self.assertEqual(producer.buffered_records, 1)
+    
+    def test_leftover_records_keep_their_enqueue_time(self):
+        producer = self.producer(max_batch_records=2)
+        # Hold the sender back until all three records are queued
+        with producer._cond:
+            sent = [producer.put({'n': i}, 'key') for i in range(2)]
+            before = time.monotonic()
+            producer.put({'n': 2}, 'key')
+            after = time.monotonic()
+        for future in sent:
+            future.result(timeout=5)
+        
+        self.assertEqual(producer.buffered_records, 1)
+        self.assertGreaterEqual(producer._oldest, before)
+        self.assertLessEqual(producer._oldest, after)
+    
+    def test_flush_sends_everything_buffered(self):
+        producer = self.producer()
+        futures = [producer.put({'n': i}, f'key-{i}') for i in range(5)]
+        self.assertTrue(producer.flush(timeout=5))
+        self.assertTrue(all('SequenceNumber' in f.result(timeout=0) for f in futures))
+        self.assertEqual(producer.buffered_records, 0)
+    
+    def test_close_drains_buffer(self):
+        producer = self.producer()
+        futures = [producer.put({'n': i}, 'key') for i in range(5)]
+        producer.close(timeout=5)
+        self.assertTrue(all('SequenceNumber' in f.result(timeout=0) for f in futures))
+        with self.assertRaises(RuntimeError):
+            producer.put({'n': 5}, 'key')
+    
+    def test_failed_send_fails_batch_and_keeps_running(self):
+        producer = self.producer(linger_ms=10)
+        with mock.patch.object(producer, '_put_entries', side_effect=RuntimeError('connection reset')):
+            failed = producer.put({'n': 0}, 'key')
+            with self.assertRaises(KinesisPutError):
+                failed.result(timeout=5)
+        
+        self.assertTrue(producer.flush(timeout=5))
+        self.assertIn('SequenceNumber', producer.put({'n': 1}, 'key').result(timeout=5))
+
+
+class _FakeClock:
+    """
+    monotonic() stand-in whose sleep() just moves time forward
+    """
+    
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+    
+    def __call__(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTests(SimpleTestCase):
+    """
+    Per-shard token buckets, run on a fake clock. Rates and times are
+    powers of two so the refill arithmetic is exact.
+    """
+    
+    def setUp(self):
+        self.clock = _FakeClock()
+    
+    def limiter(self, **kwargs):
+        kwargs.setdefault('records_per_sec', 8)
+        kwargs.setdefault('bytes_per_sec', 2 ** 30)
+        kwargs.setdefault('burst', 1.0)
+        limiter = ShardRateLimiter(
+            LocalKinesis(shard_count=2), 'test', clock=self.clock, sleep=self.clock.sleep, **kwargs
+        )
+        self.assertEqual(len(limiter.shard_starts()), 2)
+        return limiter
+    
+    def records(self, limiter, shard, count, size=16):
+        # Partition keys that hash into the ``shard``-th shard
+        keys = (f'key-{i:04d}' for i in range(10000))
+        key = next(k for k in keys if limiter.shard_for({'PartitionKey': k}) == limiter._shards[shard])
+        return [{'Data': b'x' * (size - len(key)), 'PartitionKey': key}] * count
+    
+    def assertWaited(self, limiter, records, seconds):
+        self.assertEqual(limiter.acquire(records), seconds)
+    
+    def test_token_bucket(self):
+        bucket = TokenBucket(8, 4, now=0.0)
+        self.assertEqual(bucket.wait_time(0.0), 0)
+        bucket.take(6)
+        self.assertEqual(bucket.wait_time(0.0), 0.25)
+        self.assertEqual(bucket.wait_time(1.0), 0)
+        self.assertEqual(bucket.tokens, 4)
+    
+    def test_record_budget_is_per_shard(self):
+        limiter = self.limiter()
+        self.assertWaited(limiter, self.records(limiter, 0, 8), 0)
+        self.assertWaited(limiter, self.records(limiter, 0, 4), 0)
+        self.assertWaited(limiter, self.records(limiter, 1, 8), 0)
+        # Shard 0 is 4 records in debt: the next send waits half a second
+        self.assertWaited(limiter, self.records(limiter, 0, 1), 0.5)
+        self.assertEqual(self.clock.slept, [0.5])
+        
+        self.clock.now += 8
+        self.assertWaited(limiter, self.records(limiter, 0, 8), 0)
+    
+    def test_byte_budget(self):
+        limiter = self.limiter(records_per_sec=2 ** 20, bytes_per_sec=1024)
+        self.assertWaited(limiter, self.records(limiter, 0, 2, size=512), 0)
+        self.assertWaited(limiter, self.records(limiter, 0, 1, size=512), 0)
+        self.assertWaited(limiter, self.records(limiter, 0, 1, size=512), 0.5)
+        self.assertWaited(limiter, self.records(limiter, 1, 2, size=512), 0)
+    
+    def test_burst_capacity_caps_refill(self):
+        limiter = self.limiter(burst=0.5)
+        self.clock.now += 64
+        self.assertWaited(limiter, self.records(limiter, 0, 5), 0)
+        self.assertWaited(limiter, self.records(limiter, 0, 1), 0.125)
+    
+    def test_throttled_shard_blocks(self):
+        limiter = self.limiter()
+        records = self.records(limiter, 0, 1)
+        self.assertWaited(limiter, records, 0)
+        limiter.throttled(records)
+        self.assertWaited(limiter, self.records(limiter, 0, 4), 0)
+        self.assertWaited(limiter, records, 0.5)
+        self.assertWaited(limiter, self.records(limiter, 1, 1), 0)
+
+class AggregationTests(SimpleTestCase):
+    """
+    KPL aggregated record encoding and shard-aware packing
+    """
+    
+    def test_matches_kpl_wire_format(self):
+        aggregator = RecordAggregator()
+        aggregator.add('a', b'hi')
+        aggregator.add('b', b'yo', explicit_hash_key='7')
+        # AggregatedRecord{partition_key_table: [a, b], explicit_hash_key_table: [7],
+        #   records: [{pk 0, data hi}, {pk 1, ehk 0, data yo}]}
+        body = bytes.fromhex(
+            '0a0161' '0a0162'                   # partition_key_table
+            '120137'                            # explicit_hash_key_table
+            '1a06' '0800' '1a026869'            # records[0]
+            '1a08' '0801' '1000' '1a02796f'     # records[1]
+        )
+        self.assertEqual(aggregator.build(), KPL_MAGIC + body + hashlib.md5(body).digest())
+    
+    def test_round_trip(self):
+        aggregator = RecordAggregator()
+        records = [('user-1', b'one', None), ('user-2', b'', '12345'), ('user-1', 'three', None)]
+        for partition_key, data, explicit_hash_key in records:
+            self.assertTrue(aggregator.add(partition_key, data, explicit_hash_key))
+        self.assertEqual(
+            deaggregate(aggregator.build(), 'user-1'),
+            [('user-1', None, b'one'), ('user-2', '12345', b''), ('user-1', None, b'three')]
+        )
+    
+    def test_packs_distinct_keys_by_shard(self):
+        starts = [0, 2 ** 127]
+        records = [(f'user-{i}', b'{"value": 1}', None) for i in range(500)]
+        packed = aggregate(records, shard_starts=starts)
+        
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(sorted(i for _, members in packed for i in members), list(range(500)))
+        for entry, members in packed:
+            shard = bisect.bisect_right(starts, int(entry['ExplicitHashKey'])) - 1
+            user_records = deaggregate(entry['Data'])
+            self.assertEqual([pk for pk, _, _ in user_records], [records[i][0] for i in members])
+            for partition_key, _, _ in user_records:
+                self.assertEqual(bisect.bisect_right(starts, hash_key_for(partition_key)) - 1, shard)
+    
+    def test_splits_aggregates_at_max_size(self):
+        records = [(f'user-{i}', b'x' * 100, None) for i in range(50)]
+        packed = aggregate(records, max_size=1000, shard_starts=[0])
+        self.assertGreater(len(packed), 1)
+        self.assertTrue(all(len(entry['Data']) <= 1000 for entry, _ in packed))
+        self.assertEqual([i for _, members in packed for i in members], list(range(50)))
+
+
+class SQLiteKinesisTests(SimpleTestCase):
+    """
+    Two clients on one file stand in for two processes
+    """
+    
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'kinesis.sqlite3')
+        self.producer = SQLiteKinesis(path, shard_count=2)
+        self.consumer = SQLiteKinesis(path, shard_count=2)
+    
+    def read(self, client, shard_id, iterator_type='TRIM_HORIZON', **kwargs):
+        iterator = client.get_shard_iterator(
+            StreamName='test', ShardId=shard_id, ShardIteratorType=iterator_type, **kwargs
+        )['ShardIterator']
+        return client.get_records(ShardIterator=iterator)
+    
+    def test_records_are_shared(self):
+        sent = self.producer.put_records(StreamName='test', Records=[
+            {'Data': f'{i}'.encode(), 'PartitionKey': 'key'} for i in range(5)
+        ])['Records']
+        shard_id = sent[0]['ShardId']
+        
+        response = self.read(self.consumer, shard_id)
+        self.assertEqual([r['Data'] for r in response['Records']], [b'0', b'1', b'2', b'3', b'4'])
+        self.assertEqual([r['SequenceNumber'] for r in response['Records']], [r['SequenceNumber'] for r in sent])
+        self.assertEqual(self.consumer.get_records(ShardIterator=response['NextShardIterator'])['Records'], [])
+        
+        after = self.read(self.consumer, shard_id, 'AFTER_SEQUENCE_NUMBER', StartingSequenceNumber=sent[2]['SequenceNumber'])
+        self.assertEqual([r['Data'] for r in after['Records']], [b'3', b'4'])
+    
+    def test_resharding_is_shared(self):
+        self.producer.put_record(StreamName='test', Data=b'before', PartitionKey='key')
+        shards = self.consumer.list_shards(StreamName='test')['Shards']
+        parent = shards[0]
+        middle = (int(parent['HashKeyRange']['StartingHashKey']) + int(parent['HashKeyRange']['EndingHashKey'])) // 2
+        self.consumer.split_shard(StreamName='test', ShardToSplit=parent['ShardId'], NewStartingHashKey=str(middle))
+        
+        shards = self.producer.describe_stream(StreamName='test')['StreamDescription']['Shards']
+        self.assertEqual(len(shards), 4)
+        self.assertIn('EndingSequenceNumber', shards[0]['SequenceNumberRange'])
+        self.assertEqual({s.get('ParentShardId') for s in shards[2:]}, {parent['ShardId']})
+        
+        # The closed parent ends once read to the end
+        response = self.read(self.producer, parent['ShardId'])
+        if response['NextShardIterator']:
+            response = self.producer.get_records(ShardIterator=response['NextShardIterator'])
+        self.assertIsNone(response['NextShardIterator'])
+
+
+class HotKeySaltingTests(SimpleTestCase):
+    """
+    Keys the producer reports as hot are salted by the partitioner
+    """
+    
+    def test_producer_feeds_salted_partitioner(self):
+        tracker = ThroughputTracker(window_seconds=0.2)
+        producer = KinesisDataProducer(
+            client=LocalKinesis(shard_count=2), stream_name='test',
+            partitioner=SaltedKeyPartitioner(tracker=tracker)
+        )
+        self.assertIs(producer.tracker, tracker)
+        
+        self.assertEqual(producer.build_record({}, 'hot')['PartitionKey'], 'hot')
+        producer.send_batch([{'n': i} for i in range(500)], 'hot')
+        time.sleep(0.25)
+        self.assertTrue(tracker.snapshot()['hot_shards'])
+        self.assertEqual(tracker.hot_keys, {'hot'})
+        self.assertEqual(producer.build_record({}, 'hot')['PartitionKey'], 'hot#0')
+        self.assertEqual(producer.build_record({}, 'cold')['PartitionKey'], 'cold')
+    
+    def test_put_record_returns_assigned_key(self):
+        tracker = ThroughputTracker()
+        producer = KinesisDataProducer(
+            client=LocalKinesis(shard_count=2), stream_name='test',
+            partitioner=SaltedKeyPartitioner(hot_keys=['hot'], tracker=tracker)
+        )
+        response = producer.put_record({'n': 1}, 'hot')
+        self.assertEqual(response['PartitionKey'], 'hot#0')
+        self.assertIn('SequenceNumber', response)
+        self.assertEqual(sum(tracker._key_records.values()), 1)
+        self.assertEqual(producer.put_record({'partition_key': 'cold'})['PartitionKey'], 'cold')
+
+
+class DefaultPartitionerTests(SimpleTestCase):
+    """
+    get_default_partitioner builds the KINESIS_PARTITION_STRATEGY partitioner once
+    """
+    
+    def default_for(self, strategy):
+        with mock.patch.object(partitioning, 'PARTITION_STRATEGY', strategy), \
+                mock.patch.object(partitioning, '_default_partitioner', None):
+            partitioner = get_default_partitioner(LocalKinesis(shard_count=4), 'test')
+            self.assertIs(get_default_partitioner(), partitioner)
+            return partitioner
+    
+    def test_key(self):
+        partitioner = self.default_for('key')
+        self.assertIsInstance(partitioner, KeyPartitioner)
+        self.assertEqual(partitioner.assign({'partition_key': 'a'}), ('a', None))
+        self.assertEqual(partitioner.assign({}), ('default', None))
+        self.assertEqual(partitioner.assign({'partition_key': 'a'}, 'b'), ('b', None))
+    
+    def test_random(self):
+        partitioner = self.default_for('random')
+        self.assertIsInstance(partitioner, RandomPartitioner)
+        self.assertNotEqual(partitioner.assign({}, 'a'), partitioner.assign({}, 'a'))
+    
+    def test_round_robin_cycles_through_shards(self):
+        partitioner = self.default_for('round_robin')
+        self.assertIsInstance(partitioner, RoundRobinPartitioner)
+        assigned = [partitioner.assign({})[1] for _ in range(8)]
+        self.assertEqual(len(set(assigned)), 4)
+        self.assertEqual(assigned[:4], assigned[4:])
+        
+        shards = LocalKinesis(shard_count=4).describe_stream(StreamName='test')['StreamDescription']['Shards']
+        starts = sorted(int(shard['HashKeyRange']['StartingHashKey']) for shard in shards)
+        self.assertEqual(sorted(bisect.bisect(starts, int(key)) for key in assigned[:4]), [1, 2, 3, 4])
+    
+    def test_salted_uses_default_tracker(self):
+        partitioner = self.default_for('salted')
+        self.assertIsInstance(partitioner, SaltedKeyPartitioner)
+        self.assertIs(partitioner.tracker, partitioning.get_default_tracker())
+
+
+class ThroughputTrackerTests(SimpleTestCase):
+    """
+    Hot shard and hot key detection at the end of each window
+    """
+    
+    def setUp(self):
+        self.now = 0.0
+        clock = mock.Mock(monotonic=lambda: self.now)
+        patcher = mock.patch.object(partitioning, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tracker = ThroughputTracker(window_seconds=10)
+    
+    def end_window(self):
+        self.now += 10
+        return self.tracker.snapshot()
+    
+    def test_shard_near_record_limit_is_hot(self):
+        for _ in range(9000):
+            self.tracker.record('shard-0', 'busy', 10)
+        snapshot = self.end_window()
+        self.assertEqual(snapshot['hot_shards'], ['shard-0'])
+        self.assertEqual(snapshot['shards']['shard-0']['records_per_sec'], 900)
+        self.assertEqual(self.tracker.hot_keys, {'busy'})
+    
+    def test_shard_near_byte_limit_is_hot(self):
+        for _ in range(10):
+            self.tracker.record('shard-0', 'big', 1024 * 1024)
+        self.assertEqual(self.end_window()['hot_shards'], ['shard-0'])
+        # One record a second is not enough to call the key hot
+        self.assertEqual(self.tracker.hot_keys, set())
+    
+    def test_skewed_shard_is_hot(self):
+        for shard_id, count in [('shard-0', 50), ('shard-1', 5), ('shard-2', 5)]:
+            for _ in range(count):
+                self.tracker.record(shard_id, shard_id, 10)
+        self.assertEqual(self.end_window()['hot_shards'], ['shard-0'])
+    
+    def test_even_load_is_not_hot(self):
+        for shard_id in ('shard-0', 'shard-1'):
+            for _ in range(100):
+                self.tracker.record(shard_id, shard_id, 10)
+        self.assertEqual(self.tracker.snapshot()['hot_shards'], [])
+        snapshot = self.end_window()
+        self.assertEqual(snapshot['hot_shards'], [])
+        self.assertEqual(snapshot['keys'][0]['records_per_sec'], 10)
+        # The next window starts empty
+        self.assertEqual(self.end_window()['shards'], {})
+
+
+class _FakeTable:
+    """
+    DynamoDB table double: keeps written items, fails any batch holding
+    an item with one of ``fail_keys`` as its partition_key
+    """
+    def __init__(self, fail_keys=()):
+        self.items = []
+        self.fail_keys = set(fail_keys)
+    
+    def Table(self, name):
+        return self
+    
+    def batch_writer(self):
+        return _FakeBatch(self)
+
+
+class _FakeBatch:
+    def __init__(self, table):
+        self.table = table
+        self.items = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            if any(item.get('partition_key') in self.table.fail_keys for item in self.items):
+                raise RuntimeError('ProvisionedThroughputExceededException')
+            self.table.items.extend(self.items)
+    
+    def put_item(self, Item):
+        self.items.append(Item)
+
+
+class _FakeDynamoDBMixin:
+    """
+    Runs lambda_handler against a _FakeTable
+    """
+    
+    def setUp(self):
+        self.table = _FakeTable()
+        for name, value in [('get_dynamodb_resource', lambda **kwargs: self.table),
+                            ('_table', None), ('IO_WORKERS', 4), ('BATCH_PROCESSING', False)]:
+            patcher = mock.patch.object(lambda_function, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def kinesis_record(self, sequence_number, data, partition_key='key'):
+        if isinstance(data, dict):
+            data = default_codec.encode(dict(data, partition_key=partition_key))
+        return {'kinesis': {
+            'sequenceNumber': str(sequence_number),
+            'partitionKey': partition_key,
+            'data': base64.b64encode(data).decode('ascii'),
+        }}
+
+
+class LambdaBatchItemFailureTests(_FakeDynamoDBMixin, SimpleTestCase):
+    """
+    batchItemFailures reported by lambda_handler
+    """
+    
+    def invoke(self, records):
+        context = mock.Mock(function_name='test')
+        response = lambda_function.lambda_handler({'Records': records, 'response_mode': 'full'}, context)
+        body = json.loads(response['body'])
+        return response['batchItemFailures'], [r['record_id'] for r in body['processed_records']]
+    
+    def test_no_failures(self):
+        failures, processed = self.invoke([self.kinesis_record(i, {'n': i}) for i in range(1, 4)])
+        self.assertEqual(failures, [])
+        self.assertEqual(processed, ['1', '2', '3'])
+        self.assertEqual(len(self.table.items), 3)
+    
+    def test_decode_failure(self):
+        records = [self.kinesis_record(1, {'n': 1}), self.kinesis_record(2, b'\x00not json'),
+                   self.kinesis_record(3, {'n': 3})]
+        failures, processed = self.invoke(records)
+        self.assertEqual(failures, [{'itemIdentifier': '2'}])
+        self.assertEqual(processed, ['1'])
+    
+    def test_processing_failure(self):
+        records = [self.kinesis_record(1, {'n': 1}), self.kinesis_record(2, b'[1, 2, 3]'),
+                   self.kinesis_record(3, {'n': 3})]
+        failures, processed = self.invoke(records)
+        self.assertEqual(failures, [{'itemIdentifier': '2'}])
+        self.assertEqual(processed, ['1'])
+    
+    def test_store_failure_truncates_at_lowest_sequence_number(self):
+        # 'a' and 'b' hash to different write groups
+        self.table.fail_keys = {'b'}
+        records = [self.kinesis_record(i, {'n': i}, 'a' if i % 2 else 'b') for i in range(1, 7)]
+        failures, processed = self.invoke(records)
+        self.assertEqual(failures, [{'itemIdentifier': '2'}])
+        self.assertEqual(processed, ['1'])
+    
+    def test_write_groups_keep_keys_together(self):
+        records = [{'record_id': str(i), 'partition_key': f'user-{i % 100}'} for i in range(300)]
+        groups = lambda_function._write_groups(records)
+        
+        self.assertLessEqual(len(groups), 4)
+        self.assertEqual(sum(len(group) for group in groups), 300)
+        for group in groups:
+            self.assertEqual(group, sorted(group, key=lambda r: int(r['record_id'])))
+        owners = {}
+        for number, group in enumerate(groups):
+            for record in group:
+                self.assertEqual(owners.setdefault(record['partition_key'], number), number)
+    
+    def test_failing_sub_record_fails_its_parent(self):
+        aggregator = RecordAggregator()
+        for payload in [default_codec.encode({'n': 1}), b'[1]', default_codec.encode({'n': 3})]:
+            aggregator.add('key', payload)
+        records = [self.kinesis_record(1, {'n': 0}), self.kinesis_record(2, aggregator.build()),
+                   self.kinesis_record(3, {'n': 4})]
+        failures, processed = self.invoke(records)
+        self.assertEqual(failures, [{'itemIdentifier': '2'}])
+        self.assertEqual(processed, ['1'])
+    
+    def test_undecodable_sub_record_fails_its_parent(self):
+        aggregator = RecordAggregator()
+        for payload in [default_codec.encode({'n': 1}), b'\x00not json']:
+            aggregator.add('key', payload)
+        failures, processed = self.invoke([self.kinesis_record(1, {'n': 0}), self.kinesis_record(2, aggregator.build())])
+        self.assertEqual(failures, [{'itemIdentifier': '2'}])
+        self.assertEqual(processed, ['1'])
+    
+    def test_non_finite_numbers_are_stored_as_null(self):
+        data = {'value': float('nan'), 'readings': [float('inf'), -float('inf'), 1.5], 'n': 2}
+        failures, processed = self.invoke([self.kinesis_record(1, data)])
+        self.assertEqual((failures, processed), ([], ['1']))
+        
+        item = self.table.items[0]
+        self.assertIsNone(item['value'])
+        self.assertEqual(item['readings'], [None, None, Decimal('1.5')])
+        # boto3 raises on Decimal('NaN') before the request is sent
+        TypeSerializer().serialize(item)
+
+
+class LambdaResponseModeTests(_FakeDynamoDBMixin, SimpleTestCase):
+    """
+    Summary and full response bodies
+    """
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(lambda_function, 'get_detector', lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        records = [{'data_type': 'sensor', 'value': 250, 'temperature': 250}] * 60
+        records += [{'data_type': 'log', 'level': 'ERROR'}] * 5 + [{'data_type': 'log', 'level': 'INFO'}] * 5
+        self.records = [self.kinesis_record(i, data) for i, data in enumerate(records, 1)]
+    
+    def invoke(self, **event):
+        context = mock.Mock(function_name='test')
+        return json.loads(lambda_function.lambda_handler(dict(event, Records=self.records), context)['body'])
+    
+    def test_summary(self):
+        with mock.patch.object(lambda_function, 'RESPONSE_MODE', 'summary'):
+            body = self.invoke()
+        self.assertEqual(body['processed_count'], 70)
+        self.assertIsNone(body['failed_sequence_number'])
+        self.assertEqual(body['alert_counts'], {'HIGH_VALUE_ALERT': 60, 'HIGH_TEMPERATURE': 60, 'LOG_ERROR': 5})
+        self.assertEqual(len(body['alerted_records']), lambda_function.SUMMARY_MAX_ALERT_IDS)
+        self.assertEqual(body['alerted_records'][0], {
+            'record_id': '1', 'sub_sequence_number': None, 'alerts': ['HIGH_VALUE_ALERT', 'HIGH_TEMPERATURE']
+        })
+        self.assertEqual(set(body['timings']), {'decode_ms', 'process_ms', 'store_ms'})
+        self.assertNotIn('processed_records', body)
+        self.assertEqual(len(self.table.items), 70)
+    
+    def test_full_on_request(self):
+        with mock.patch.object(lambda_function, 'RESPONSE_MODE', 'summary'):
+            body = self.invoke(response_mode='full')
+        self.assertEqual(body['processed_count'], 70)
+        self.assertEqual([r['record_id'] for r in body['processed_records']], [str(i) for i in range(1, 71)])
+        self.assertEqual(body['processed_records'][-1]['data']['level'], 'INFO')
+    
+    def test_full_by_default(self):
+        with mock.patch.object(lambda_function, 'RESPONSE_MODE', 'full'):
+            self.assertEqual(len(self.invoke()['processed_records']), 70)
+            self.assertNotIn('processed_records', self.invoke(response_mode='summary'))
+
+
+class RuleSetTests(SimpleTestCase):
+    """
+    The batch path matches exactly what the per-record path matches
+    """
+    
+    RULES = DEFAULT_RULES + [
+        {'name': 'low_value', 'data_type': '*', 'conditions': [{'field': 'value', 'op': 'lt', 'value': 0}],
+         'alert': 'LOW_VALUE'},
+        {'name': 'value_at_least', 'data_type': '*', 'conditions': [{'field': 'value', 'op': 'gte', 'value': 50}],
+         'alert': 'VALUE_AT_LEAST'},
+        {'name': 'cold', 'data_type': 'sensor', 'conditions': [{'field': 'temperature', 'op': 'lte', 'value': 0}],
+         'alert': 'COLD'},
+    ]
+    
+    def test_batch_matches_per_record(self):
+        values = [150, 50, 49.5, -1, 0, float('nan'), float('inf'), float('-inf'), True, '200', None, [1]]
+        records = []
+        for value in values:
+            records.append({'data_type': 'sensor', 'value': value, 'temperature': value})
+            records.append({'data_type': 'metric', 'value': value, 'threshold': 10})
+            records.append({'value': value})
+        rule_set = RuleSet(self.RULES)
+        
+        def names(matched):
+            return [rule.name for rule in matched]
+        self.assertEqual(
+            [names(matched) for matched in rule_set.evaluate_batch(records)],
+            [names(rule_set.evaluate(record)) for record in records]
+        )
+    
+    def test_non_finite_values_match_no_numeric_rule(self):
+        rule_set = RuleSet(self.RULES)
+        for value in (float('nan'), float('inf'), float('-inf')):
+            record = {'data_type': 'sensor', 'value': value, 'temperature': value}
+            self.assertEqual(rule_set.evaluate(record), [])
+            self.assertEqual(rule_set.evaluate_batch([record]), [[]])
+
+
+class StreamBatchEquivalenceTests(SimpleTestCase):
+    """
+    process_stream_batch (vectorized) gives exactly what process_stream_data
+    gives record by record
+    """
+    
+    VALUES = [20.5, 21, 19.75, 250, float('nan'), True, False, '200', None, float('inf'), [1], -5]
+    
+    def records(self):
+        records = []
+        for i in range(96):
+            value = self.VALUES[i // 4 % len(self.VALUES)] if i % 4 == 3 else 20 + (i % 5) * 0.25
+            kind = i % 3
+            if kind == 0:
+                records.append({'data_type': 'sensor', 'sensor_id': f's{i % 2}', 'value': value,
+                                'temperature': value, 'partition_key': 'sensors'})
+            elif kind == 1:
+                records.append({'data_type': 'metric', 'metric_name': 'cpu_usage', 'value': value,
+                                'threshold': 80, 'partition_key': 'metrics'})
+            else:
+                records.append({'data_type': 'log', 'level': 'ERROR' if i % 7 == 0 else 'INFO',
+                                'value': value, 'alerts': 'from the producer' if i % 11 == 0 else []})
+        # Far outside every series' baseline
+        records.append({'data_type': 'sensor', 'sensor_id': 's0', 'value': 5000, 'temperature': 5000})
+        return records
+    
+    def run_path(self, process, records):
+        detector = AnomalyDetector(method='ewma', min_samples=5)
+        with mock.patch.object(lambda_function, 'get_detector', lambda: detector):
+            output = process(records)
+        for data in output:
+            self.assertIn('processing_timestamp', data)
+            data.pop('processing_timestamp')
+        return json.dumps(output, sort_keys=True)
+    
+    def test_batch_matches_per_record(self):
+        records = self.records()
+        self.assertGreaterEqual(len(records), lambda_function.BATCH_MIN_RECORDS)
+        
+        batch = self.run_path(lambda_function.process_stream_batch, copy.deepcopy(records))
+        single = self.run_path(
+            lambda data_list: [lambda_function.process_stream_data(data) for data in data_list],
+            copy.deepcopy(records)
+        )
+        self.assertEqual(batch, single)
+        self.assertIn('ANOMALY_DETECTED', batch)
+        self.assertIn('NaN', batch)
+
+
+class StreamConsumerTests(SimpleTestCase):
+    """
+    StreamConsumer against LocalKinesis: checkpoints, resharding, failures
+    """
+    
+    def setUp(self):
+        self.client = LocalKinesis(shard_count=1, enforce_limits=False)
+        self.checkpoints = MemoryCheckpointStore()
+        self.received = []
+    
+    def put(self, *values, partition_key='key'):
+        response = self.client.put_records(StreamName='test', Records=[
+            {'Data': str(value).encode(), 'PartitionKey': partition_key} for value in values
+        ])
+        return [r['SequenceNumber'] for r in response['Records']]
+    
+    def consumer(self, handler=None):
+        return StreamConsumer(
+            self.client, 'test', self.checkpoints,
+            handler or (lambda shard_id, records: self.received.extend(r['data'] for r in records))
+        )
+    
+    def drain(self, consumer, rounds=4):
+        for _ in range(rounds):
+            consumer.refresh()
+            for shard_id in consumer.shards:
+                consumer.poll_shard(shard_id)
+    
+    def test_checkpoints_and_resumes(self):
+        sequences = self.put(0, 1, 2)
+        self.drain(self.consumer())
+        self.assertEqual(self.received, [b'0', b'1', b'2'])
+        self.assertEqual(self.checkpoints.load(), {'shardId-000000000000': (sequences[-1], False)})
+        
+        self.put(3)
+        self.received = []
+        self.drain(self.consumer())
+        self.assertEqual(self.received, [b'3'])
+    
+    def test_children_wait_for_their_parent(self):
+        self.put(0, 1, 2)
+        parent = self.client.list_shards(StreamName='test')['Shards'][0]
+        self.client.split_shard(StreamName='test', ShardToSplit=parent['ShardId'],
+                                NewStartingHashKey=str(2 ** 127))
+        self.put(3, 4, 5)
+        
+        consumer = self.consumer()
+        consumer.refresh()
+        self.assertEqual(consumer.shards, [parent['ShardId']])
+        self.drain(consumer)
+        
+        self.assertEqual(self.received, [b'0', b'1', b'2', b'3', b'4', b'5'])
+        self.assertTrue(self.checkpoints.load()[parent['ShardId']][1])
+        self.assertEqual(len(consumer.shards), 2)
+    
+    def test_failed_batch_is_read_again(self):
+        sequences = self.put(0, 1)
+        calls = []
+        
+        def handler(shard_id, records):
+            calls.append([r['data'] for r in records])
+            if len(calls) == 1:
+                raise TypeError('bad record')
+        
+        consumer = self.consumer(handler)
+        consumer.refresh()
+        self.assertEqual(consumer.poll_shard('shardId-000000000000'), 0)
+        self.assertEqual(self.checkpoints.load(), {})
+        
+        consumer.poll_shard('shardId-000000000000')
+        self.assertEqual(calls, [[b'0', b'1'], [b'0', b'1']])
+        self.assertEqual(self.checkpoints.load(), {'shardId-000000000000': (sequences[-1], False)})
+    
+    def failing(self, obj, name, *errors):
+        # Raise ``errors`` on the first calls, then behave normally
+        real = getattr(obj, name)
+        errors = list(errors)
+        
+        def call(*args, **kwargs):
+            if errors:
+                raise errors.pop(0)
+            return real(*args, **kwargs)
+        patcher = mock.patch.object(obj, name, call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_read_error_backs_off(self):
+        self.put(0, 1)
+        # e.g. botocore's ReadTimeoutError, which has no error code
+        self.failing(self.client, 'get_records', OSError('Read timeout on endpoint URL'))
+        consumer = self.consumer()
+        consumer.run_once()
+        self.assertEqual(consumer.shards, ['shardId-000000000000'])
+        self.assertGreater(consumer._next_poll['shardId-000000000000'], time.monotonic() + ERROR_BACKOFF - 1)
+        self.assertEqual(consumer.run_once(), 0)
+        
+        consumer._next_poll['shardId-000000000000'] = 0.0
+        self.assertEqual(consumer.run_once(), 2)
+        self.assertEqual(self.received, [b'0', b'1'])
+    
+    def test_list_shards_error_is_retried(self):
+        self.put(0)
+        self.failing(self.client, 'list_shards', OSError('Could not connect to the endpoint URL'))
+        consumer = self.consumer()
+        self.assertEqual(consumer.run_once(), 0)
+        self.assertEqual(consumer.shards, [])
+        # Due again after ERROR_BACKOFF, not after refresh_interval
+        consumer._refreshed -= ERROR_BACKOFF
+        self.assertEqual(consumer.run_once(), 1)
+    
+    def test_failed_checkpoint_is_saved_on_next_poll(self):
+        sequences = self.put(0, 1)
+        self.failing(self.checkpoints, 'save', RuntimeError('database is locked'))
+        consumer = self.consumer()
+        consumer.refresh()
+        self.assertEqual(consumer.poll_shard('shardId-000000000000'), 2)
+        self.assertEqual(self.checkpoints.load(), {})
+        
+        self.assertEqual(consumer.poll_shard('shardId-000000000000'), 0)
+        self.assertEqual(self.received, [b'0', b'1'])
+        self.assertEqual(self.checkpoints.load(), {'shardId-000000000000': (sequences[-1], False)})
+    
+    def test_failed_final_checkpoint_is_retried(self):
+        self.put(0)
+        parent = self.client.list_shards(StreamName='test')['Shards'][0]['ShardId']
+        self.client.split_shard(StreamName='test', ShardToSplit=parent, NewStartingHashKey=str(2 ** 127))
+        consumer = self.consumer()
+        consumer.refresh()
+        self.failing(self.checkpoints, 'save', RuntimeError('database is locked'))
+        # Reads the last record and finds the shard closed
+        self.assertEqual(consumer.poll_shard(parent), 1)
+        self.assertEqual(self.checkpoints.load(), {})
+        self.assertEqual(consumer.shards, [parent])
+        
+        consumer.poll_shard(parent)
+        self.assertEqual(self.checkpoints.load()[parent][1], True)
+        self.assertEqual(consumer.shards, [])
+
+
+class WindowAggregatorTests(SimpleTestCase):
+    """
+    Window assignment, watermark and lateness
+    """
+    
+    def aggregator(self, spec, allowed_lateness=10):
+        return WindowAggregator(parse_windows(spec), allowed_lateness=allowed_lateness, clock=lambda: 1000.0)
+    
+    def windows(self, rows):
+        return sorted({(row['window_seconds'], int(row['window_start'].timestamp())) for row in rows})
+    
+    def test_tumbling(self):
+        aggregator = self.aggregator('60')
+        for t, value in [(120, 1), (125, 5), (179.5, 3), (180, 7)]:
+            self.assertTrue(aggregator.add({'timestamp': t, 'data_type': 'sensor', 'value': value}, 'key'))
+        rows = aggregator.flush(force=True)
+        self.assertEqual(self.windows(rows), [(60, 120), (60, 180)])
+        
+        value = next(row for row in rows if row['field'] == 'value' and row['window_start'].timestamp() == 120)
+        self.assertEqual((value['count'], value['sum'], value['min'], value['max']), (3, 9.0, 1.0, 5.0))
+        self.assertEqual((value['data_type'], value['partition_key']), ('sensor', 'key'))
+        count = next(row for row in rows if row['field'] == '' and row['window_start'].timestamp() == 120)
+        self.assertEqual((count['count'], count['min']), (3, None))
+    
+    def test_sliding(self):
+        aggregator = self.aggregator('300/60')
+        aggregator.add({'timestamp': 125})
+        self.assertEqual(self.windows(aggregator.flush(force=True)),
+                         [(300, -120), (300, -60), (300, 0), (300, 60), (300, 120)])
+    
+    def test_record_time_falls_back_to_clock(self):
+        aggregator = self.aggregator('60')
+        aggregator.add({'timestamp': 'not a time'})
+        aggregator.add({})
+        rows = aggregator.flush(force=True)
+        self.assertEqual(self.windows(rows), [(60, 960)])
+        self.assertEqual(rows[0]['count'], 2)
+    
+    def test_lateness(self):
+        aggregator = self.aggregator('60', allowed_lateness=10)
+        aggregator.add({'timestamp': 100})
+        self.assertEqual(aggregator.flush(), [])
+        
+        aggregator.add({'timestamp': 200})
+        self.assertEqual(aggregator.watermark, 190)
+        self.assertEqual(self.windows(aggregator.flush()), [(60, 60)])
+        # Its window has been emitted
+        self.assertFalse(aggregator.add({'timestamp': 110}))
+        # Behind the newest record but within the allowed lateness
+        self.assertTrue(aggregator.add({'timestamp': 185}))
+        self.assertEqual(aggregator.late_records, 1)
+        self.assertEqual(aggregator.open_windows, 1)
+        
+        aggregator.advance(now=300)
+        self.assertEqual(self.windows(aggregator.flush()), [(60, 180)])
+    
+    def test_only_finite_numbers_are_aggregated(self):
+        aggregator = self.aggregator('60')
+        for value in (2, float('nan'), float('inf'), True, '7', None, 4.5):
+            aggregator.add({'timestamp': 0, 'value': value})
+        rows = {row['field']: row for row in aggregator.flush(force=True)}
+        self.assertEqual(rows['']['count'], 7)
+        self.assertEqual((rows['value']['count'], rows['value']['sum'], rows['value']['max']), (2, 6.5, 4.5))
+
+
+class DatabaseCheckpointStoreTests(TestCase):
+    
+    def test_save_and_load(self):
+        store = DatabaseCheckpointStore('test')
+        self.assertEqual(store.load(), {})
+        store.save('shardId-000000000000', '100')
+        store.save('shardId-000000000000', '200', finished=True)
+        store.save('shardId-000000000001', '300')
+        DatabaseCheckpointStore('other').save('shardId-000000000000', '1')
+        self.assertEqual(store.load(), {
+            'shardId-000000000000': ('200', True),
+            'shardId-000000000001': ('300', False),
+        })
+
+
+class AnomalyDetectorTests(SimpleTestCase):
+    
+    def test_non_list_alerts_in_payload(self):
+        detector = AnomalyDetector(method='welford', min_samples=3)
+        for value in (10, 10.5, 9.5, 10):
+            detector.apply({'sensor_id': 's1', 'value': value})
+        data = detector.apply({'sensor_id': 's1', 'value': 1000, 'alerts': 'from the producer'})
+        self.assertEqual(data['alerts'], ['ANOMALY_DETECTED'])
+    
+    def test_batch_fallback_learns_each_value_once(self):
+        detector = AnomalyDetector(method='welford', min_samples=1000)
+        apply = detector.apply
+        
+        def failing_apply(data):
+            apply(data)
+            if data.get('poison'):
+                raise ValueError('poison record')
+        
+        records = [
+            {'record_id': str(i), 'data': {'sensor_id': 's1', 'value': float(i), 'poison': i == 50}}
+            for i in range(80)
+        ]
+        with mock.patch.object(lambda_function, 'get_detector', lambda: detector), \
+                mock.patch.object(lambda_function, 'BATCH_PROCESSING', True), \
+                mock.patch.object(detector, 'apply', failing_apply):
+            processed, failed = lambda_function.process_batch(records)
+        
+        self.assertEqual(failed, '50')
+        self.assertEqual(len(processed), 50)
+        # Records 0-50 once each, not the batch's 51 plus the fallback's 51
+        self.assertEqual(detector.snapshot([records[0]['data']])[('', 's1', 'value')].count, 51)
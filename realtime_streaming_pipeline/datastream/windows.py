@@ -0,0 +1,174 @@
+"""
+Incremental tumbling and sliding window aggregation.
+
+Records are bucketed by event time (their ``timestamp`` field, else the
+time they were seen) into windows of ``size`` seconds that start every
+``slide`` seconds; ``slide == size`` is a tumbling window. Each window keeps
+count/sum/min/max per (data_type, partition_key, metric_name, field), so
+state is O(open windows x keys) no matter how many records pass through.
+
+The watermark is the highest event time seen minus ``allowed_lateness``.
+A window is emitted once the watermark passes its end; records that only
+belong to emitted windows are counted in ``late_records`` and dropped. If
+the stream goes quiet, ``advance(now)`` moves the watermark on processing
+time so the last windows still close.
+
+Emitted rows are partial aggregates: a sink should merge them (add counts
+and sums, take min/max) into what it already holds, which also makes
+``flush(force=True)`` on shutdown safe. A window is identified by
+(size, start) only, since its contents do not depend on the slide.
+"""
+import math
+from datetime import datetime, timezone
+
+# A 60 s tumbling window and a 300 s window sliding every 60 s
+DEFAULT_WINDOWS = '60,300/60'
+# Numeric fields aggregated when present; '' is the plain record count
+DEFAULT_FIELDS = ('value', 'temperature', 'humidity', 'pressure')
+
+
+def parse_windows(spec):
+    """
+    '60,300/60' -> [(60, 60), (300, 60)]: a 60 s tumbling window and a
+    300 s window sliding every 60 s
+    """
+    windows = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        size, _, slide = part.partition('/')
+        size = int(size)
+        slide = int(slide) if slide else size
+        if size <= 0 or slide <= 0 or size % slide:
+            raise ValueError(f'Window size must be a positive multiple of its slide: {part!r}')
+        windows.append((size, slide))
+    return windows
+
+
+def event_time(data, default):
+    """
+    Epoch seconds of ``data['timestamp']`` (ISO 8601), else ``default``
+    """
+    value = data.get('timestamp')
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return default
+
+
+class _Cell:
+    __slots__ = ('count', 'sum', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value=None):
+        self.count += 1
+        if value is None:
+            return
+        self.sum += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+
+class WindowAggregator:
+    """
+    Open windows and the watermark; see the module docstring
+    """
+    def __init__(self, windows=None, allowed_lateness=30.0, fields=DEFAULT_FIELDS, clock=None):
+        self.windows = windows or parse_windows(DEFAULT_WINDOWS)
+        self.allowed_lateness = allowed_lateness
+        self.fields = fields
+        self.clock = clock or (lambda: datetime.now(timezone.utc).timestamp())
+        self.max_event_time = None
+        self.watermark = float('-inf')
+        self.late_records = 0
+        # (size, start) -> {(data_type, partition_key, metric_name, field): _Cell}
+        self._open = {}
+
+    @property
+    def open_windows(self):
+        return len(self._open)
+
+    def _starts(self, t):
+        seen = set()
+        for size, slide in self.windows:
+            start = (t // slide) * slide
+            while start > t - size:
+                if (size, start) not in seen:
+                    seen.add((size, start))
+                    yield size, start
+                start -= slide
+
+    def add(self, data, partition_key=''):
+        """
+        Fold one processed record into its open windows; False if it was late.
+
+        The record's own partition_key is preferred over the Kinesis one,
+        which may be salted or random depending on the partitioner.
+        """
+        now = self.clock()
+        t = event_time(data, now)
+        keys = [(size, start) for size, start in self._starts(t) if start + size > self.watermark]
+        if not keys:
+            self.late_records += 1
+            return False
+
+        dims = (
+            str(data.get('data_type') or ''),
+            str(data.get('partition_key') or partition_key or ''),
+            str(data.get('metric_name') or ''),
+        )
+        values = [(field, data.get(field)) for field in self.fields]
+        values = [(field, float(v)) for field, v in values if type(v) in (int, float) and math.isfinite(v)]
+        for key in keys:
+            cells = self._open.setdefault(key, {})
+            cells.setdefault(dims + ('',), _Cell()).add()
+            for field, value in values:
+                cells.setdefault(dims + (field,), _Cell()).add(value)
+
+        if self.max_event_time is None or t > self.max_event_time:
+            self.max_event_time = t
+            self.watermark = max(self.watermark, t - self.allowed_lateness)
+        return True
+
+    def advance(self, now=None):
+        """
+        Move the watermark on processing time, so the last windows of a
+        quiet stream are emitted. Only call this when the consumer is caught
+        up: during a replay it would turn every record late.
+        """
+        now = self.clock() if now is None else now
+        self.watermark = max(self.watermark, now - self.allowed_lateness)
+
+    def flush(self, force=False):
+        """
+        Remove and return the windows the watermark has passed (every open
+        window with ``force``) as rows of plain dicts
+        """
+        rows = []
+        for size, start in sorted(self._open):
+            if not force and start + size > self.watermark:
+                continue
+            for (data_type, partition_key, metric_name, field), cell in self._open.pop((size, start)).items():
+                rows.append({
+                    'window_start': datetime.fromtimestamp(start, timezone.utc),
+                    'window_seconds': size,
+                    'data_type': data_type,
+                    'partition_key': partition_key,
+                    'metric_name': metric_name,
+                    'field': field,
+                    'count': cell.count,
+                    'sum': cell.sum,
+                    'min': cell.min,
+                    'max': cell.max,
+                })
+        return rows
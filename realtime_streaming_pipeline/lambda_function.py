@@ -1,41 +1,239 @@
+import os
 import json
-import boto3
-import base64
+import time
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 from datetime import datetime
+from datastream.aggregation import deaggregate_records
+from datastream.codec import decode
+from datastream.clients import DEFAULT_REGION, get_dynamodb_resource
+from datastream.anomaly import get_detector
+from datastream.rules import get_rule_set
+
+DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'ProcessedStreamData')
+DYNAMODB_REGION = os.environ.get('DYNAMODB_REGION') or DEFAULT_REGION
+# Concurrent DynamoDB writers; 1 writes everything from the handler thread
+IO_WORKERS = int(os.environ.get('LAMBDA_IO_WORKERS', '8'))
+# Write each partition key's records in order on a single worker
+PRESERVE_KEY_ORDER = os.environ.get('LAMBDA_PRESERVE_KEY_ORDER', 'True') == 'True'
+# Process whole batches with vectorized operations (see process_stream_batch)
+BATCH_PROCESSING = os.environ.get('LAMBDA_BATCH_PROCESSING', 'True') == 'True'
+# Below this many records the per-record path is faster
+BATCH_MIN_RECORDS = int(os.environ.get('LAMBDA_BATCH_MIN_RECORDS', '64'))
+# 'summary' or 'full'; an event can also ask for {"response_mode": "full"}
+RESPONSE_MODE = os.environ.get('LAMBDA_RESPONSE_MODE', 'summary')
+# Alerted record ids listed in a summary response
+SUMMARY_MAX_ALERT_IDS = 50
+# Build the DynamoDB table and alert rules during the init phase instead of
+# on the first invocation (for provisioned concurrency / SnapStart)
+PREWARM = os.environ.get('LAMBDA_PREWARM', 'False') == 'True'
+
+# Module imports stay light (boto3 and numpy are loaded on first use), so
+# a cold start only pays for what the invocation needs
+_table = None
+
+def get_table():
+    """
+    DynamoDB table, created on first use and reused by every invocation
+    """
+    global _table
+    if _table is None:
+        _table = get_dynamodb_resource(region_name=DYNAMODB_REGION).Table(DYNAMODB_TABLE)
+    return _table
+
+_io_pool = None
+_io_pool_lock = threading.Lock()
+
+def get_io_pool():
+    global _io_pool
+    if _io_pool is None:
+        with _io_pool_lock:
+            if _io_pool is None:
+                _io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='ddb-writer')
+    return _io_pool
 
 def lambda_handler(event, context):
     """
     AWS Lambda function to process Kinesis stream data
+
+    Implements the ReportBatchItemFailures contract: processing stops at the
+    first record that fails and its sequence number is returned in
+    ``batchItemFailures``, so Lambda checkpoints everything before it and
+    retries only from that record on. Pair it with MaximumRetryAttempts and
+    an on-failure destination on the event source mapping so a poison
+    record is eventually skipped.
+
+    The batch is decoded first and then processed as a whole
+    (``process_batch``). Both run on the handler thread; the DynamoDB writes
+    are spread over LAMBDA_IO_WORKERS threads (see ``store_concurrently``).
+    Per-stage timings are logged and returned in the body.
+
+    The body is a summary (counts, alerts, failed id, timings) unless full
+    output is asked for with LAMBDA_RESPONSE_MODE or the event's
+    ``response_mode``; only then are the processed records returned.
     """
     print(f"Lambda function invoked: {context.function_name}")
     
     processed_records = []
+    failed_sequence = None
+    timings = {'decode_ms': 0.0, 'process_ms': 0.0, 'store_ms': 0.0}
+    
+    started = time.perf_counter()
+    for kinesis_record in event.get('Records', []):
+        sequence_number = kinesis_record['kinesis']['sequenceNumber']
+        first = len(processed_records)
+        try:
+            # Kinesis data is base64 encoded and may hold KPL-aggregated user records
+            for record in deaggregate_records([kinesis_record]):
+                processed_records.append({
+                    'record_id': record['sequenceNumber'],
+                    'partition_key': record['partitionKey'],
+                    'sub_sequence_number': record['subSequenceNumber'],
+                    # Enveloped (any codec) or legacy plain JSON
+                    'data': decode(record['data'])
+                })
+        except Exception as e:
+            print(f"Error processing record {sequence_number}: {e}")
+            # The whole Kinesis record is retried, including any
+            # sub-records that had already been processed
+            del processed_records[first:]
+            failed_sequence = sequence_number
+            break
+    timings['decode_ms'] = (time.perf_counter() - started) * 1000
+    
+    # Process the data
+    started = time.perf_counter()
+    processed_records, process_failure = process_batch(processed_records)
+    timings['process_ms'] = (time.perf_counter() - started) * 1000
+    if process_failure is not None:
+        failed_sequence = process_failure
+    
+    # Store in DynamoDB or send to another service, 25 items per request
+    started = time.perf_counter()
+    store_failure = store_concurrently(processed_records)
+    timings['store_ms'] = (time.perf_counter() - started) * 1000
+    if store_failure is not None:
+        # Everything from the failed record on is retried (puts are idempotent)
+        failed_sequence = store_failure
+        processed_records = [r for r in processed_records if int(r['record_id']) < int(store_failure)]
     
-    for record in event['Records']:
-        # Kinesis data is base64 encoded
-        payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
-        data = json.loads(payload)
-        
-        # Process the data
-        processed_data = process_stream_data(data)
-        
-        # Store in DynamoDB or send to another service
-        store_processed_data(processed_data)
-        
-        processed_records.append({
-            'record_id': record['kinesis']['sequenceNumber'],
-            'processed_at': datetime.utcnow().isoformat(),
-            'data': processed_data
-        })
+    batch_item_failures = [{'itemIdentifier': failed_sequence}] if failed_sequence else []
+    timings = {stage: round(ms, 2) for stage, ms in timings.items()}
+    print(f"Stage timings: {timings}")
+    
+    body = summarize(processed_records, failed_sequence, timings)
+    if event.get('response_mode', RESPONSE_MODE) == 'full':
+        body['processed_records'] = processed_records
     
     return {
         'statusCode': 200,
-        'body': json.dumps({
-            'message': f'Processed {len(processed_records)} records',
-            'processed_records': processed_records
-        })
+        'body': json.dumps(body),
+        'batchItemFailures': batch_item_failures
+    }
+
+def summarize(processed_records, failed_sequence, timings):
+    """
+    Response body without the record payloads
+    """
+    alert_counts = {}
+    alerted = []
+    for record in processed_records:
+        alerts = record['data'].get('alerts')
+        if not alerts:
+            continue
+        for alert in alerts:
+            alert_counts[alert] = alert_counts.get(alert, 0) + 1
+        if len(alerted) < SUMMARY_MAX_ALERT_IDS:
+            alerted.append({
+                'record_id': record['record_id'],
+                'sub_sequence_number': record['sub_sequence_number'],
+                'alerts': alerts
+            })
+    
+    return {
+        'message': f'Processed {len(processed_records)} records',
+        'processed_count': len(processed_records),
+        'failed_sequence_number': failed_sequence,
+        'alert_counts': alert_counts,
+        'alerted_records': alerted,
+        'timings': timings
     }
 
+def process_batch(records):
+    """
+    Process decoded records in place, vectorized when enabled.
+
+    Returns the records that were processed and the sequence number of the
+    first one that failed (None if all succeeded). A failing sub-record
+    fails its whole Kinesis record.
+    """
+    processed_at = datetime.utcnow().isoformat()
+    for record in records:
+        record['processed_at'] = processed_at
+    if BATCH_PROCESSING:
+        try:
+            process_stream_batch([r['data'] for r in records])
+            return records, None
+        except Exception:
+            pass  # rolled back by process_stream_batch
+    
+    # Find the failing record one by one
+    for index, record in enumerate(records):
+        try:
+            process_stream_data(record['data'])
+        except Exception as e:
+            failed_sequence = record['record_id']
+            print(f"Error processing record {failed_sequence}: {e}")
+            while index and records[index - 1]['record_id'] == failed_sequence:
+                index -= 1
+            return records[:index], failed_sequence
+    return records, None
+
+def process_stream_batch(data_list):
+    """
+    Batch version of ``process_stream_data``: same output, with the alert
+    rules' threshold checks done as numpy searches over whole columns
+    (see ``RuleSet.evaluate_batch``). Anomaly detection is sequential per
+    record in both paths.
+
+    All or nothing: if any record fails, the records and the anomaly
+    baselines are put back as they were and the error is re-raised, so
+    the caller can go through the batch record by record without
+    learning any value twice.
+    """
+    detector = get_detector()
+    snapshot = detector.snapshot(data_list) if detector is not None else None
+    originals = [dict(data) if isinstance(data, dict) else None for data in data_list]
+    try:
+        return _process_stream_batch(data_list, detector)
+    except Exception:
+        if snapshot is not None:
+            detector.restore(snapshot)
+        for data, original in zip(data_list, originals):
+            if original is not None:
+                data.clear()
+                data.update(original)
+        raise
+
+def _process_stream_batch(data_list, detector):
+    if len(data_list) < BATCH_MIN_RECORDS:
+        return [process_stream_data(data) for data in data_list]
+    
+    processing_timestamp = datetime.utcnow().isoformat()
+    for data in data_list:
+        data['processed'] = True
+        data['processing_timestamp'] = processing_timestamp
+    
+    get_rule_set().apply_batch(data_list)
+    
+    if detector is not None:
+        for data in data_list:
+            detector.apply(data)
+    
+    return data_list
+
 def process_stream_data(data):
     """
     Process incoming stream data
@@ -44,23 +242,79 @@ def process_stream_data(data):
     data['processed'] = True
     data['processing_timestamp'] = datetime.utcnow().isoformat()
     
-    # Example: Detect anomalies or transform data
-    if 'value' in data:
-        if data['value'] > 100:
-            data['alert'] = 'HIGH_VALUE_ALERT'
+    # Alert rules for the record's data_type (see datastream/rules.py)
+    get_rule_set().apply(data)
+    
+    # Deviations from the series' own baseline (see datastream/anomaly.py)
+    detector = get_detector()
+    if detector is not None:
+        detector.apply(data)
     
     return data
 
-def store_processed_data(data):
+def to_dynamodb_item(data):
     """
-    Store processed data in DynamoDB
+    DynamoDB rejects Python floats; round-trip through JSON to get Decimals.
+    It has no NaN or infinity either, so those are stored as NULL
+    """
+    return json.loads(json.dumps(data, default=str), parse_float=Decimal, parse_constant=lambda name: None)
+
+def _write_groups(records):
+    """
+    Split records into up to IO_WORKERS independent write groups. When
+    order matters each partition key hashes to one group, so a key's
+    records are written in order by one worker while every group still
+    fills 25-item requests across keys; else contiguous chunks
+    """
+    if PRESERVE_KEY_ORDER:
+        groups = [[] for _ in range(IO_WORKERS)]
+        for record in records:
+            groups[zlib.crc32(str(record['partition_key']).encode('utf-8')) % IO_WORKERS].append(record)
+        return [group for group in groups if group]
+    size = -(-len(records) // IO_WORKERS)
+    return [records[i:i + size] for i in range(0, len(records), size)]
+
+def _store_group(records, target_table=None):
+    if target_table is None:
+        # boto3 resources are not thread-safe: each worker uses its own
+        target_table = get_dynamodb_resource(region_name=DYNAMODB_REGION).Table(DYNAMODB_TABLE)
+    if store_processed_batch([r['data'] for r in records], target_table) is None:
+        return min((r['record_id'] for r in records), key=int)
+    return None
+
+def store_concurrently(records):
+    """
+    Write processed records to DynamoDB, write groups in parallel.
+
+    Returns the lowest sequence number of any group that failed, or None.
+    """
+    if not records:
+        return None
+    if IO_WORKERS <= 1:
+        return _store_group(records, get_table())
+    failures = [
+        failure for failure in get_io_pool().map(_store_group, _write_groups(records))
+        if failure is not None
+    ]
+    return min(failures, key=int) if failures else None
+
+def store_processed_batch(items, target_table=None):
+    """
+    Store processed data in DynamoDB with BatchWriteItem.
+
+    batch_writer sends 25 items per request and re-queues any
+    UnprocessedItems until they are written; throttling errors are retried
+    with backoff by the client's retry config.
     """
-    dynamodb = boto3.resource('dynamodb', region_name='ap-south-1')
-    table = dynamodb.Table('ProcessedStreamData')
-    
     try:
-        response = table.put_item(Item=data)
-        return response
+        with (target_table or get_table()).batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=to_dynamodb_item(item))
+        return len(items)
     except Exception as e:
-        print(f"Error storing in DynamoDB: {e}")
-        return None
\ No newline at end of file
+        print(f"Error storing batch in DynamoDB: {e}")
+        return None
+
+if PREWARM:
+    get_table()
+    get_rule_set()
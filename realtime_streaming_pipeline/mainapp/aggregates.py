@@ -0,0 +1,77 @@
+# mainapp/aggregates.py
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .models import WindowAggregate
+
+KEY_FIELDS = ('window_seconds', 'window_start', 'data_type', 'partition_key', 'metric_name', 'field')
+
+
+def _key(obj):
+    return tuple(getattr(obj, name) for name in KEY_FIELDS)
+
+
+def merge_window_rows(rows):
+    """
+    Merge rows emitted by WindowAggregator.flush() into WindowAggregate:
+    counts and sums are added, min/max combined. Rows for a window that is
+    already stored (a restart, a late flush, another worker) extend it.
+    """
+    if not rows:
+        return 0
+    if not settings.USE_TZ:
+        rows = [dict(row, window_start=timezone.make_naive(row['window_start'])) for row in rows]
+    try:
+        return _merge(rows)
+    except IntegrityError:
+        # Another worker created one of the windows first; it exists now
+        return _merge(rows)
+
+
+@transaction.atomic
+def _merge(rows):
+    existing = {
+        _key(obj): obj
+        for obj in WindowAggregate.objects.select_for_update().filter(
+            window_seconds__in={row['window_seconds'] for row in rows},
+            window_start__in={row['window_start'] for row in rows},
+        )
+    }
+    created = {}
+    updated = {}
+    for row in rows:
+        key = tuple(row[name] for name in KEY_FIELDS)
+        obj = existing.get(key) or created.get(key)
+        if obj is None:
+            obj = created[key] = WindowAggregate(**{name: row[name] for name in KEY_FIELDS})
+        elif key not in created:
+            updated[key] = obj
+        obj.record_count += row['count']
+        obj.value_sum += row['sum']
+        if row['min'] is not None:
+            obj.value_min = row['min'] if obj.value_min is None else min(obj.value_min, row['min'])
+            obj.value_max = row['max'] if obj.value_max is None else max(obj.value_max, row['max'])
+
+    now = timezone.now()
+    for obj in updated.values():
+        obj.updated_at = now  # bulk_update skips auto_now
+    WindowAggregate.objects.bulk_create(created.values(), batch_size=500)
+    WindowAggregate.objects.bulk_update(
+        updated.values(), ['record_count', 'value_sum', 'value_min', 'value_max', 'updated_at'], batch_size=500
+    )
+    return len(rows)
+
+
+def recent_activity(window_seconds, since):
+    """
+    Records per data_type in windows of ``window_seconds`` starting at or
+    after ``since``, read from the aggregates instead of StreamData
+    """
+    return list(
+        WindowAggregate.objects
+        .filter(window_seconds=window_seconds, field='', window_start__gte=since)
+        .values('data_type')
+        .annotate(records=Sum('record_count'), windows=Count('window_start', distinct=True))
+        .order_by('-records')
+    )
@@ -0,0 +1,40 @@
+# mainapp/management/commands/backfill_promoted_fields.py
+from django.core.management.base import BaseCommand
+from mainapp.models import StreamData
+
+class Command(BaseCommand):
+    help = 'Fill the promoted StreamData columns from data_content (rows written before a field was promoted)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows read and updated per query')
+    
+    def handle(self, *args, **options):
+        columns = list(StreamData.PROMOTED_FIELDS)
+        batch_size = options['batch_size']
+        scanned = updated = 0
+        last_id = 0
+        
+        # Walk the primary key so each batch is an index range, however large the table
+        while True:
+            batch = list(
+                StreamData.objects.filter(pk__gt=last_id).order_by('pk')
+                .only('pk', 'data_content', *columns)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            
+            changed = []
+            for stream in batch:
+                values = StreamData.promoted_values(stream.data_content)
+                if any(getattr(stream, column) != value for column, value in values.items()):
+                    for column, value in values.items():
+                        setattr(stream, column, value)
+                    changed.append(stream)
+            StreamData.objects.bulk_update(changed, columns, batch_size=batch_size)
+            
+            scanned += len(batch)
+            updated += len(changed)
+            self.stdout.write(f"Scanned {scanned} rows, updated {updated}")
+        
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} of {scanned} rows ({', '.join(columns)})"))
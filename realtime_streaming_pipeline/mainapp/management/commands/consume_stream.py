@@ -0,0 +1,203 @@
+# mainapp/management/commands/consume_stream.py
+import signal
+import subprocess
+import sys
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from aws_config import AWSConfig
+from datastream.checkpoints import DatabaseCheckpointStore
+from datastream.clients import KINESIS_BACKEND, LOCAL_KINESIS_PATH, get_kinesis_client
+from datastream.codec import decode
+from datastream.consumer import StreamConsumer
+from datastream.windows import WindowAggregator, parse_windows
+from lambda_function import process_stream_batch, process_stream_data
+from mainapp.aggregates import merge_window_rows
+from mainapp.models import StreamData
+
+# Seconds between checks for exited worker processes (--processes)
+SUPERVISE_INTERVAL = 1.0
+
+class Command(BaseCommand):
+    help = 'Consume every shard of the Kinesis stream and process the records (alternative to the Lambda)'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Window rows a failed merge left behind; merged with the next ones
+        self.unmerged_rows = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stream', default=None, help='Stream name (default: KINESIS_STREAM_NAME)')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Start this many worker processes, one per shard group')
+        parser.add_argument('--groups', type=int, default=1, help='Number of shard groups')
+        parser.add_argument('--group', type=int, default=0, help='Shard group read by this process')
+        parser.add_argument('--initial-position', default='TRIM_HORIZON', choices=['TRIM_HORIZON', 'LATEST'],
+                            help='Where shards without a checkpoint start')
+        parser.add_argument('--batch-size', type=int, default=1000, help='GetRecords limit')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between polls of an idle shard')
+
+    def handle(self, *args, **options):
+        if options['processes'] > 1:
+            return self.supervise(options)
+
+        stream_name = options['stream'] or AWSConfig.KINESIS_STREAM_NAME
+        # Windowed aggregates, emitted to WindowAggregate as windows close
+        self.windows = WindowAggregator(
+            parse_windows(settings.STREAM_WINDOWS),
+            allowed_lateness=settings.STREAM_WINDOW_LATENESS,
+        )
+        if KINESIS_BACKEND == 'local' and LOCAL_KINESIS_PATH == ':memory:':
+            self.stdout.write(self.style.WARNING(
+                "LOCAL_KINESIS_PATH is ':memory:': the stream only holds records put by this process"
+            ))
+        consumer = StreamConsumer(
+            get_kinesis_client(),
+            stream_name,
+            DatabaseCheckpointStore(stream_name),
+            self.process_records,
+            group=options['group'],
+            groups=options['groups'],
+            initial_position=options['initial_position'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            on_idle=self.close_windows,
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: consumer.stop())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Consuming {stream_name}, shard group {options['group'] + 1} of {options['groups']}"
+        ))
+        consumer.run()
+        # Partial windows merge with what the next run adds
+        self.merge_windows(self.windows.flush(force=True))
+        self.stdout.write(f"Stopped after {consumer.processed} records "
+                          f"({self.windows.late_records} too late for their windows)")
+
+    def supervise(self, options):
+        """
+        Run one child process per shard group until interrupted, starting
+        a new one whenever a child exits
+        """
+        count = options['processes']
+        base = [sys.executable, sys.argv[0], 'consume_stream',
+                '--groups', str(count),
+                '--initial-position', options['initial_position'],
+                '--batch-size', str(options['batch_size']),
+                '--poll-interval', str(options['poll_interval'])]
+        if options['stream']:
+            base += ['--stream', options['stream']]
+
+        def start(group):
+            return subprocess.Popen(base + ['--group', str(group)])
+        children = {group: start(group) for group in range(count)}
+        stopping = threading.Event()
+
+        def stop(*_):
+            stopping.set()
+            for child in children.values():
+                child.terminate()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop)
+
+        while not stopping.wait(SUPERVISE_INTERVAL):
+            for group, child in list(children.items()):
+                returncode = child.poll()
+                if returncode is not None and not stopping.is_set():
+                    print(f"[CONSUMER] Shard group {group} exited with {returncode}, restarting it")
+                    children[group] = start(group)
+
+        # Again, in case a child was restarted while stop() ran
+        for child in children.values():
+            child.terminate()
+            child.wait()
+
+    def process_records(self, shard_id, records):
+        """
+        Run the Lambda's processing on one GetRecords batch and mark the
+        matching StreamData rows processed
+        """
+        close_old_connections()
+
+        data_list = []
+        sequence_numbers = []
+        partition_keys = []
+        for record in records:
+            try:
+                data = decode(record['data'])
+            except Exception as e:
+                # Retrying would block the shard forever
+                print(f"[CONSUMER] Skipping undecodable record {record['sequenceNumber']} on {shard_id}: {e}")
+                continue
+            if not isinstance(data, dict):
+                print(f"[CONSUMER] Skipping record {record['sequenceNumber']} on {shard_id}: not a JSON object")
+                continue
+            data_list.append(data)
+            sequence_numbers.append(record['sequenceNumber'])
+            partition_keys.append(record['partitionKey'])
+
+        try:
+            processed = process_stream_batch(data_list)
+        except Exception as e:
+            print(f"[CONSUMER] Batch processing failed on {shard_id}, retrying record by record: {e}")
+            processed, sequence_numbers, partition_keys = self.process_each(
+                shard_id, data_list, sequence_numbers, partition_keys
+            )
+        alerts = sum(1 for data in processed if data.get('alert'))
+
+        updated = StreamData.objects.filter(
+            stream_id__in=set(sequence_numbers), processed=False
+        ).update(processed=True)
+
+        # Only now: if anything above fails the batch is read again, and
+        # records already in the windows would be counted twice
+        for data, partition_key in zip(processed, partition_keys):
+            self.windows.add(data, partition_key)
+        self.merge_windows(self.windows.flush())
+
+        if alerts:
+            print(f"[CONSUMER] {shard_id}: {alerts} of {len(processed)} records raised alerts")
+        return updated
+
+    def process_each(self, shard_id, data_list, sequence_numbers, partition_keys):
+        """
+        Process records one at a time, skipping (and logging) any that fail
+        so the shard can be checkpointed past them
+        """
+        processed = []
+        kept_sequences = []
+        kept_keys = []
+        for data, sequence_number, partition_key in zip(data_list, sequence_numbers, partition_keys):
+            try:
+                processed.append(process_stream_data(data))
+            except Exception as e:
+                print(f"[CONSUMER] Skipping record {sequence_number} on {shard_id}: {e}")
+                continue
+            kept_sequences.append(sequence_number)
+            kept_keys.append(partition_key)
+        return processed, kept_sequences, kept_keys
+
+    def close_windows(self):
+        """
+        Caught up: let the watermark follow the clock so windows close
+        """
+        close_old_connections()
+        self.windows.advance()
+        self.merge_windows(self.windows.flush())
+
+    def merge_windows(self, rows):
+        """
+        Store closed windows. Rows that cannot be stored are kept and
+        merged with the next flush rather than failing the batch.
+        """
+        rows = self.unmerged_rows + rows
+        try:
+            merge_window_rows(rows)
+        except Exception as e:
+            print(f"[CONSUMER] Storing {len(rows)} window rows failed, retrying with the next flush: {e}")
+            self.unmerged_rows = rows
+            return
+        self.unmerged_rows = []
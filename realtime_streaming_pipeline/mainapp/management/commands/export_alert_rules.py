@@ -0,0 +1,37 @@
+# mainapp/management/commands/export_alert_rules.py
+import json
+from django.core.management.base import BaseCommand
+from datastream.models import AlertRule
+from datastream.rules import DEFAULT_RULES
+
+class Command(BaseCommand):
+    help = 'Write the enabled alert rules to a JSON file for the Lambda (ALERT_RULES_FILE)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='alert_rules.json', help='File to write')
+        parser.add_argument('--load-defaults', action='store_true',
+                            help='First add any built-in default rules missing from the database')
+    
+    def handle(self, *args, **options):
+        if options['load_defaults']:
+            for priority, spec in enumerate(DEFAULT_RULES):
+                _, created = AlertRule.objects.get_or_create(
+                    name=spec['name'],
+                    defaults={
+                        'data_type': spec['data_type'],
+                        'conditions': spec['conditions'],
+                        'alert': spec['alert'],
+                        'severity': spec['severity'],
+                        'priority': priority,
+                    }
+                )
+                if created:
+                    self.stdout.write(f"Added default rule {spec['name']}")
+        
+        # Compiling validates every rule before anything is written
+        rule_set = AlertRule.rule_set()
+        specs = [rule.to_spec() for rule in AlertRule.objects.filter(enabled=True)]
+        with open(options['output'], 'w') as f:
+            json.dump(specs, f, indent=2)
+        
+        self.stdout.write(self.style.SUCCESS(f"Exported {len(rule_set)} alert rules to {options['output']}"))
@@ -0,0 +1,51 @@
+# mainapp/management/commands/purge_stream_data.py
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from mainapp.models import StreamData
+from mainapp.retention import archive_and_purge
+
+class Command(BaseCommand):
+    help = 'Archive StreamData rows older than the retention period to Parquet, then delete them in chunks'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.STREAM_DATA_RETENTION_DAYS,
+                            help='Keep this many days of rows (default: STREAM_DATA_RETENTION_DAYS)')
+        parser.add_argument('--before', default=None,
+                            help='Explicit cutoff instead of --days (ISO date or datetime)')
+        parser.add_argument('--archive-dir', default=settings.STREAM_DATA_ARCHIVE_DIR)
+        parser.add_argument('--chunk-size', type=int, default=settings.STREAM_DATA_PURGE_CHUNK_SIZE,
+                            help='Rows archived and deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between chunks')
+        parser.add_argument('--max-chunks', type=int, default=None, help='Stop after this many chunks')
+        parser.add_argument('--no-archive', action='store_true', help='Delete without archiving')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would go')
+    
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                cutoff = datetime.fromisoformat(options['before'])
+            except ValueError:
+                raise CommandError(f"Invalid --before: {options['before']!r}")
+        else:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+        
+        if options['dry_run']:
+            # Uses the (timestamp, id) index
+            count = StreamData.objects.filter(timestamp__lt=cutoff).count()
+            self.stdout.write(f"{count} rows older than {cutoff} would be purged")
+            return
+        
+        stats = archive_and_purge(
+            cutoff,
+            options['archive_dir'],
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            archive=not options['no_archive'],
+            max_chunks=options['max_chunks'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {stats['deleted']} rows older than {cutoff} in {stats['chunks']} chunks; "
+            f"archived {stats['archived']} to {stats['files']} files in {options['archive_dir']}"
+        ))
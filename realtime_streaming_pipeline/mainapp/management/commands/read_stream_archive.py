@@ -0,0 +1,31 @@
+# mainapp/management/commands/read_stream_archive.py
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mainapp.retention import read_archive
+
+class Command(BaseCommand):
+    help = 'Query archived StreamData rows by time range'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--start', default=None, help='ISO date or datetime, inclusive')
+        parser.add_argument('--end', default=None, help='ISO date or datetime, exclusive')
+        parser.add_argument('--data-type', default=None)
+        parser.add_argument('--archive-dir', default=settings.STREAM_DATA_ARCHIVE_DIR)
+        parser.add_argument('--output', default=None, help='Write the rows to this CSV file')
+    
+    def handle(self, *args, **options):
+        try:
+            start = datetime.fromisoformat(options['start']) if options['start'] else None
+            end = datetime.fromisoformat(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(f"Invalid --start/--end: {e}")
+        filters = [('data_type', '=', options['data_type'])] if options['data_type'] else None
+        
+        frame = read_archive(options['archive_dir'], start, end, filters=filters)
+        if options['output']:
+            frame.to_csv(options['output'], index=False)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(frame)} rows to {options['output']}"))
+        else:
+            self.stdout.write(frame.to_string(max_rows=50))
+            self.stdout.write(self.style.SUCCESS(f"{len(frame)} archived rows"))
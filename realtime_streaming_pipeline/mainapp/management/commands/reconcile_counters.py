@@ -0,0 +1,21 @@
+# mainapp/management/commands/reconcile_counters.py
+from django.core.management.base import BaseCommand
+from mainapp.models import StatCounter, StreamData, LambdaInvocation
+
+class Command(BaseCommand):
+    help = 'Recount StreamData and LambdaInvocation and correct the dashboard counters (run periodically, e.g. from cron)'
+    
+    def handle(self, *args, **options):
+        drifted = 0
+        for model in (StreamData, LambdaInvocation):
+            for name, (stored, actual) in StatCounter.reconcile(model).items():
+                if stored != actual:
+                    drifted += 1
+                    self.stdout.write(self.style.WARNING(f"{name}: counter was {stored}, actual {actual}"))
+                else:
+                    self.stdout.write(f"{name}: {actual}")
+        
+        if drifted:
+            self.stdout.write(self.style.SUCCESS(f"Corrected {drifted} counters"))
+        else:
+            self.stdout.write(self.style.SUCCESS("All counters were correct"))
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WindowAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField()),
+                ('window_seconds', models.IntegerField()),
+                ('data_type', models.CharField(max_length=50)),
+                ('partition_key', models.CharField(max_length=100)),
+                ('metric_name', models.CharField(blank=True, default='', max_length=100)),
+                ('field', models.CharField(blank=True, default='', max_length=50)),
+                ('record_count', models.BigIntegerField(default=0)),
+                ('value_sum', models.FloatField(default=0)),
+                ('value_min', models.FloatField(blank=True, null=True)),
+                ('value_max', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('window_seconds', 'window_start', 'data_type', 'partition_key', 'metric_name', 'field')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0002_windowaggregate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lambdainvocation',
+            index=models.Index(fields=['timestamp'], name='lambdainv_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lambdainvocation',
+            index=models.Index(fields=['status', 'timestamp'], name='lambdainv_status_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(fields=['timestamp'], name='streamdata_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(fields=['processed', 'timestamp'], name='streamdata_processed_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(fields=['partition_key', 'timestamp'], name='streamdata_partition_ts_idx'),
+        ),
+    ]
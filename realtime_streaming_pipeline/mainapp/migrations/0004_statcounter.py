@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:58
+
+from django.db import migrations, models
+
+
+def count_existing_rows(apps, schema_editor):
+    # Start the counters from the rows already stored; later writes keep
+    # them up to date
+    StatCounter = apps.get_model('mainapp', 'StatCounter')
+    StreamData = apps.get_model('mainapp', 'StreamData')
+    LambdaInvocation = apps.get_model('mainapp', 'LambdaInvocation')
+    StatCounter.objects.bulk_create([
+        StatCounter(name='stream_data', value=StreamData.objects.count()),
+        StatCounter(name='stream_data_processed', value=StreamData.objects.filter(processed=True).count()),
+        StatCounter(name='lambda_invocations', value=LambdaInvocation.objects.count()),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0003_stream_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('slot', models.SmallIntegerField(default=0)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('name', 'slot')},
+            },
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0004_statcounter'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='streamdata',
+            name='streamdata_timestamp_idx',
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(fields=['timestamp', 'id'], name='streamdata_timestamp_id_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streamdata',
+            name='data_type',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='streamdata',
+            name='level',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='streamdata',
+            name='metric_name',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='streamdata',
+            name='sensor_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='streamdata',
+            name='severity',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='streamdata',
+            name='value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(fields=['data_type', 'timestamp'], name='streamdata_type_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(fields=['data_type', 'value'], name='streamdata_type_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(condition=models.Q(('sensor_id__isnull', False)), fields=['sensor_id', 'timestamp'], name='streamdata_sensor_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(condition=models.Q(('metric_name__isnull', False)), fields=['metric_name', 'timestamp'], name='streamdata_metric_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(condition=models.Q(('level__isnull', False)), fields=['level', 'timestamp'], name='streamdata_level_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streamdata',
+            index=models.Index(condition=models.Q(('severity__isnull', False)), fields=['severity', 'timestamp'], name='streamdata_severity_ts_idx'),
+        ),
+    ]
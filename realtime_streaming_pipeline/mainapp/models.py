@@ -1,17 +1,296 @@
-from django.db import models
+import random
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
 
-class StreamData(models.Model):
+class StatCounter(models.Model):
+    """
+    Materialized row counts for the dashboard, kept in step with writes to
+    the counted models in the same transaction (see CountedModel). A counter
+    is spread over STAT_COUNTER_SLOTS rows so concurrent writers rarely
+    wait on the same row; its value is their sum.
+    """
+    name = models.CharField(max_length=50)
+    slot = models.SmallIntegerField(default=0)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = [('name', 'slot')]
+    
+    def __str__(self):
+        return f"{self.name}[{self.slot}] = {self.value}"
+    
+    @classmethod
+    def add(cls, deltas):
+        """
+        Add ``{name: delta}`` to the counters; call inside the transaction
+        that made the change
+        """
+        slot = random.randrange(settings.STAT_COUNTER_SLOTS)
+        for name, delta in deltas.items():
+            if not delta:
+                continue
+            counter = cls.objects.filter(name=name, slot=slot)
+            if counter.update(value=F('value') + delta):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(name=name, slot=slot, value=delta)
+            except IntegrityError:
+                # Created by a concurrent writer in the meantime
+                counter.update(value=F('value') + delta)
+    
+    @classmethod
+    def totals(cls, names):
+        """
+        ``{name: value}`` for ``names``; counters never written read as 0
+        """
+        totals = dict.fromkeys(names, 0)
+        for row in cls.objects.filter(name__in=names).values('name').annotate(total=Sum('value')):
+            totals[row['name']] = row['total']
+        return totals
+    
+    @classmethod
+    def reconcile(cls, model):
+        """
+        Reset ``model``'s counters to a real count of its rows.
+    
+        Returns ``{name: (stored, actual)}``. The counter rows are locked
+        first, so writes that commit while the rows are being counted are
+        neither lost nor counted twice.
+        """
+        names = list(model.COUNTERS)
+        result = {}
+        with transaction.atomic():
+            rows = list(cls.objects.select_for_update().filter(name__in=names).order_by('name', 'slot'))
+            for name, flag in model.COUNTERS.items():
+                queryset = model._base_manager.all()
+                if flag:
+                    queryset = queryset.filter(**{flag: True})
+                actual = queryset.count()
+                slots = {row.slot: row for row in rows if row.name == name}
+                result[name] = (sum(row.value for row in slots.values()), actual)
+                for slot in range(settings.STAT_COUNTER_SLOTS):
+                    value = actual if slot == 0 else 0
+                    row = slots.pop(slot, None)
+                    if row is None:
+                        cls.objects.create(name=name, slot=slot, value=value)
+                    elif row.value != value:
+                        row.value = value
+                        row.save(update_fields=['value', 'updated_at'])
+                # Slots beyond a lowered STAT_COUNTER_SLOTS
+                cls.objects.filter(pk__in=[row.pk for row in slots.values()]).delete()
+        return result
+
+
+def _counts(model, objs, sign=1):
+    return {
+        name: sign * sum(1 for obj in objs if not flag or getattr(obj, flag))
+        for name, flag in model.COUNTERS.items()
+    }
+
+
+class CountedQuerySet(models.QuerySet):
+    """
+    Keeps the model's StatCounters right through bulk_create, update,
+    bulk_update and delete, which bypass Model.save()/delete()
+    """
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+                # Which rows were inserted is not known
+                StatCounter.reconcile(self.model)
+            else:
+                StatCounter.add(_counts(self.model, created))
+        return created
+    
+    def update(self, **kwargs):
+        flags = [(name, flag) for name, flag in self.model.COUNTERS.items() if flag and flag in kwargs]
+        if not flags:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            name, flag = flags[0]
+            value = kwargs[flag]
+            if len(flags) > 1 or not isinstance(value, bool):
+                # e.g. an F() expression: the effect is only known by recounting
+                rows = super().update(**kwargs)
+                StatCounter.reconcile(self.model)
+                return rows
+            # Rows that already have the value, then the ones that flip
+            rows = super(CountedQuerySet, self.filter(**{flag: value})).update(**kwargs)
+            flipped = super(CountedQuerySet, self.exclude(**{flag: value})).update(**kwargs)
+            StatCounter.add({name: flipped if value else -flipped})
+        return rows + flipped
+    
+    update.alters_data = True
+    
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not set(fields).intersection(self.model.COUNTERS.values()):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        with transaction.atomic(using=self.db):
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            StatCounter.reconcile(self.model)
+        return rows
+    
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            deltas = {
+                name: -self.filter(**{flag: True}).count()
+                for name, flag in self.model.COUNTERS.items() if flag
+            }
+            deleted, per_model = super().delete()
+            for name, flag in self.model.COUNTERS.items():
+                if not flag:
+                    deltas[name] = -per_model.get(self.model._meta.label, 0)
+            StatCounter.add(deltas)
+        return deleted, per_model
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class CountedModel(models.Model):
+    """
+    Base for models with dashboard counters. ``COUNTERS`` maps a counter
+    name to the boolean field a row needs to be counted, or None to count
+    every row.
+    """
+    COUNTERS = {}
+    
+    objects = CountedQuerySet.as_manager()
+    
+    class Meta:
+        abstract = True
+    
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                flags = [flag for flag in self.COUNTERS.values() if flag]
+                previous = type(self)._base_manager.filter(pk=self.pk).values(*flags).first()
+            super().save(*args, **kwargs)
+            if previous is None:
+                StatCounter.add(_counts(type(self), [self]))
+            else:
+                StatCounter.add({
+                    name: int(bool(getattr(self, flag))) - int(bool(previous[flag]))
+                    for name, flag in self.COUNTERS.items() if flag
+                })
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted, per_model = super().delete(*args, **kwargs)
+            if per_model.get(self._meta.label):
+                StatCounter.add(_counts(type(self), [self], sign=-1))
+        return deleted, per_model
+
+
+class StreamDataQuerySet(CountedQuerySet):
+    """
+    Fills the promoted columns on the paths that bypass StreamData.save()
+    """
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.promote_fields()
+        return super().bulk_create(objs, *args, **kwargs)
+    
+    def update(self, **kwargs):
+        if 'data_content' in kwargs and not hasattr(kwargs['data_content'], 'resolve_expression'):
+            kwargs = dict(self.model.promoted_values(kwargs['data_content']), **kwargs)
+        return super().update(**kwargs)
+    
+    update.alters_data = True
+
+
+class StreamData(CountedModel):
+    COUNTERS = {'stream_data': None, 'stream_data_processed': 'processed'}
+    
+    # Typed, indexed copies of data_content keys, set on every write:
+    # column -> key. To promote another key, add a nullable column here and
+    # in a migration, then run the backfill_promoted_fields command.
+    PROMOTED_FIELDS = {
+        'data_type': 'data_type',
+        'sensor_id': 'sensor_id',
+        'metric_name': 'metric_name',
+        'value': 'value',
+        'level': 'level',
+        'severity': 'severity',
+    }
+    
     stream_id = models.CharField(max_length=100, unique=True)
     partition_key = models.CharField(max_length=100)
     data_content = models.JSONField()
     timestamp = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
     lambda_invoked = models.BooleanField(default=False)
+    # Promoted from data_content; NULL when the key is absent
+    data_type = models.CharField(max_length=50, null=True, blank=True)
+    sensor_id = models.CharField(max_length=100, null=True, blank=True)
+    metric_name = models.CharField(max_length=100, null=True, blank=True)
+    value = models.FloatField(null=True, blank=True)
+    level = models.CharField(max_length=20, null=True, blank=True)
+    severity = models.CharField(max_length=20, null=True, blank=True)
+    
+    objects = StreamDataQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Keyset pages, newest first (mainapp/pagination.py)
+            models.Index(fields=['timestamp', 'id'], name='streamdata_timestamp_id_idx'),
+            models.Index(fields=['processed', 'timestamp'], name='streamdata_processed_ts_idx'),
+            models.Index(fields=['partition_key', 'timestamp'], name='streamdata_partition_ts_idx'),
+            # Promoted fields; the sparse ones only index rows that have them
+            models.Index(fields=['data_type', 'timestamp'], name='streamdata_type_ts_idx'),
+            models.Index(fields=['data_type', 'value'], name='streamdata_type_value_idx'),
+            models.Index(fields=['sensor_id', 'timestamp'], name='streamdata_sensor_ts_idx',
+                         condition=models.Q(sensor_id__isnull=False)),
+            models.Index(fields=['metric_name', 'timestamp'], name='streamdata_metric_ts_idx',
+                         condition=models.Q(metric_name__isnull=False)),
+            models.Index(fields=['level', 'timestamp'], name='streamdata_level_ts_idx',
+                         condition=models.Q(level__isnull=False)),
+            models.Index(fields=['severity', 'timestamp'], name='streamdata_severity_ts_idx',
+                         condition=models.Q(severity__isnull=False)),
+        ]
     
     def __str__(self):
         return f"Stream {self.stream_id}"
+    
+    @classmethod
+    def promoted_values(cls, data):
+        """
+        ``{column: value}`` of the PROMOTED_FIELDS in ``data``, converted to
+        the column's type (None when missing or of the wrong type)
+        """
+        values = {}
+        for column, key in cls.PROMOTED_FIELDS.items():
+            value = data.get(key) if isinstance(data, dict) else None
+            field = cls._meta.get_field(column)
+            if isinstance(field, models.FloatField):
+                value = float(value) if type(value) in (int, float) else None
+            elif value is not None:
+                value = str(value)[:field.max_length]
+            values[column] = value
+        return values
+    
+    def promote_fields(self):
+        for column, value in self.promoted_values(self.data_content).items():
+            setattr(self, column, value)
+    
+    def save(self, *args, **kwargs):
+        self.promote_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'data_content' in update_fields:
+            kwargs['update_fields'] = set(update_fields).union(self.PROMOTED_FIELDS)
+        super().save(*args, **kwargs)
 
-class LambdaInvocation(models.Model):
+class LambdaInvocation(CountedModel):
+    COUNTERS = {'lambda_invocations': None}
+    
     function_name = models.CharField(max_length=100)
     invocation_id = models.CharField(max_length=200)
     status = models.CharField(max_length=50)
@@ -19,5 +298,41 @@ class LambdaInvocation(models.Model):
     input_data = models.JSONField(null=True, blank=True)
     output_data = models.JSONField(null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='lambdainv_timestamp_idx'),
+            models.Index(fields=['status', 'timestamp'], name='lambdainv_status_ts_idx'),
+        ]
+    
     def __str__(self):
-        return f"{self.function_name} - {self.status}"
\ No newline at end of file
+        return f"{self.function_name} - {self.status}"
+
+
+class WindowAggregate(models.Model):
+    """
+    Count/sum/min/max of one field over one time window, maintained by the
+    stream consumer (see datastream/windows.py). field '' counts records.
+    """
+    window_start = models.DateTimeField()
+    window_seconds = models.IntegerField()
+    data_type = models.CharField(max_length=50)
+    partition_key = models.CharField(max_length=100)
+    metric_name = models.CharField(max_length=100, blank=True, default='')
+    field = models.CharField(max_length=50, blank=True, default='')
+    record_count = models.BigIntegerField(default=0)
+    value_sum = models.FloatField(default=0)
+    value_min = models.FloatField(null=True, blank=True)
+    value_max = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = [
+            ('window_seconds', 'window_start', 'data_type', 'partition_key', 'metric_name', 'field')
+        ]
+    
+    def __str__(self):
+        return f"{self.data_type}/{self.partition_key} {self.field or 'count'} @ {self.window_start} ({self.window_seconds}s)"
+    
+    @property
+    def value_mean(self):
+        return self.value_sum / self.record_count if self.field and self.record_count else None
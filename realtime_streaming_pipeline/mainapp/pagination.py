@@ -0,0 +1,90 @@
+# mainapp/pagination.py
+import base64
+import json
+from datetime import datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj, direction):
+    """
+    Opaque token for the rows after (``'next'``) or before (``'prev'``) ``obj``
+    """
+    raw = json.dumps([obj.timestamp.isoformat(), obj.pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    ``(timestamp, pk, direction)`` from a token made by ``encode_cursor``
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, pk, direction = json.loads(raw)
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return datetime.fromisoformat(timestamp), int(pk), direction
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(f'Invalid cursor: {token!r}') from e
+
+
+class KeysetPage:
+    """
+    One page of rows with the tokens of its neighbours (None at either end)
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def keyset_page(queryset, cursor=None, per_page=20):
+    """
+    Page of ``queryset``, newest first, keyed on (timestamp, id).
+
+    Each page is an index range scan from the cursor row, so it costs the
+    same however deep it is, and rows added meanwhile do not shift later
+    pages. Raises InvalidCursor for a token that does not decode.
+    """
+    queryset = queryset.order_by('-timestamp', '-pk')
+    direction = 'next'
+    if cursor:
+        timestamp, pk, direction = decode_cursor(cursor)
+        if direction == 'next':
+            queryset = queryset.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, pk__gte=pk)
+        else:
+            queryset = queryset.filter(timestamp__gte=timestamp).exclude(timestamp=timestamp, pk__lte=pk).reverse()
+
+    # One extra row tells whether there is a further page
+    rows = list(queryset[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, bool(cursor)
+
+    if not rows:
+        return KeysetPage(rows)
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], 'next') if has_next else None,
+        previous_cursor=encode_cursor(rows[0], 'prev') if has_previous else None,
+    )
@@ -0,0 +1,171 @@
+# mainapp/retention.py
+"""
+Retention for StreamData: archive old rows to Parquet, then purge them.
+
+Rows older than the cutoff are read in chunks of ``chunk_size`` along the
+(timestamp, id) index. Each chunk is written to the archive first and
+then deleted by primary key in its own short transaction, so no lock is
+held for longer than one chunk and live writes carry on in between.
+
+The archive is partitioned by UTC date::
+
+    <archive_dir>/date=2026-10-01/part-<first id>-<last id>.parquet
+
+File names come from the rows they hold. If a run stops after writing a
+chunk but before deleting it, the next run rewrites the same file rather
+than duplicating the rows. ``read_archive`` prunes partitions by date
+before it reads anything.
+
+pyarrow (and pandas, for ``read_archive``) is imported on first use.
+"""
+import json
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import StreamData
+
+PARTITION_PREFIX = 'date='
+
+COLUMNS = (
+    'id', 'stream_id', 'partition_key', 'timestamp', 'processed', 'lambda_invoked', 'data_content',
+) + tuple(StreamData.PROMOTED_FIELDS)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('The StreamData archive needs pyarrow: pip install pyarrow') from e
+    return pyarrow
+
+
+def _schema():
+    pa = _pyarrow()
+    types = {
+        'id': pa.int64(),
+        'timestamp': pa.timestamp('us', tz='UTC'),
+        'processed': pa.bool_(),
+        'lambda_invoked': pa.bool_(),
+        'value': pa.float64(),
+    }
+    return pa.schema([(name, types.get(name, pa.string())) for name in COLUMNS])
+
+
+def _utc(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value.astimezone(dt_timezone.utc)
+
+
+def _write_partition(archive_dir, day, rows):
+    pa = _pyarrow()
+    directory = os.path.join(archive_dir, f'{PARTITION_PREFIX}{day.isoformat()}')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{rows[0]['id']}-{rows[-1]['id']}.parquet")
+    table = pa.Table.from_pylist(rows, schema=_schema())
+    # Readers never see a half-written file
+    pa.parquet.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def archive_and_purge(cutoff, archive_dir, chunk_size=1000, pause=0.0, archive=True, max_chunks=None):
+    """
+    Move StreamData rows with ``timestamp < cutoff`` to ``archive_dir``.
+
+    ``pause`` seconds are slept between chunks to leave room for live
+    traffic. Returns ``{'archived', 'deleted', 'files', 'chunks'}``.
+    """
+    if settings.USE_TZ and timezone.is_naive(cutoff):
+        cutoff = timezone.make_aware(cutoff)
+    elif not settings.USE_TZ and timezone.is_aware(cutoff):
+        cutoff = timezone.make_naive(cutoff)
+    stats = {'archived': 0, 'deleted': 0, 'files': 0, 'chunks': 0}
+
+    while max_chunks is None or stats['chunks'] < max_chunks:
+        rows = list(
+            StreamData.objects.filter(timestamp__lt=cutoff)
+            .order_by('timestamp', 'id')
+            .values(*COLUMNS)[:chunk_size]
+        )
+        if not rows:
+            break
+
+        if archive:
+            days = {}
+            for row in rows:
+                row['timestamp'] = _utc(row['timestamp'])
+                row['data_content'] = json.dumps(row['data_content'], default=str)
+                days.setdefault(row['timestamp'].date(), []).append(row)
+            for day, day_rows in days.items():
+                _write_partition(archive_dir, day, day_rows)
+                stats['files'] += 1
+            stats['archived'] += len(rows)
+
+        # One short transaction per chunk, by primary key
+        with transaction.atomic():
+            deleted, _ = StreamData.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        stats['deleted'] += deleted
+        stats['chunks'] += 1
+        print(f"[RETENTION] Chunk {stats['chunks']}: {deleted} rows up to {rows[-1]['timestamp']}")
+
+        if len(rows) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return stats
+
+
+def archive_partitions(archive_dir, start=None, end=None):
+    """
+    Parquet files of the partitions that can hold rows in [start, end)
+    """
+    if not os.path.isdir(archive_dir):
+        return []
+    first = _utc(start).date() if start else None
+    last = _utc(end).date() if end else None
+    paths = []
+    for name in sorted(os.listdir(archive_dir)):
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        try:
+            day = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        if (first and day < first) or (last and day > last):
+            continue
+        directory = os.path.join(archive_dir, name)
+        paths.extend(
+            os.path.join(directory, file_name)
+            for file_name in sorted(os.listdir(directory)) if file_name.endswith('.parquet')
+        )
+    return paths
+
+
+def read_archive(archive_dir, start=None, end=None, columns=None, filters=None):
+    """
+    Archived rows with ``start <= timestamp < end`` as a pandas DataFrame,
+    oldest first. ``filters`` is a list of pyarrow filter tuples on other
+    columns, e.g. ``[('data_type', '=', 'sensor')]``; data_content is the
+    row's JSON text.
+    """
+    pa = _pyarrow()
+    import pandas as pd
+
+    paths = archive_partitions(archive_dir, start, end)
+    names = list(columns or COLUMNS)
+    if not paths:
+        return pd.DataFrame(columns=names)
+
+    filters = list(filters or [])
+    if start:
+        filters.append(('timestamp', '>=', _utc(start)))
+    if end:
+        filters.append(('timestamp', '<', _utc(end)))
+    table = pa.parquet.read_table(paths, schema=_schema(), filters=filters or None)
+    frame = table.to_pandas().sort_values(['timestamp', 'id'], kind='stable')
+    return frame[names].reset_index(drop=True)
@@ -1,3 +1,583 @@
-from django.test import TestCase
+import json
+import re
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from datastream.codec import default_codec
+from datastream.consumer import MemoryCheckpointStore, StreamConsumer
+from datastream.kinesis_producer import KinesisDataProducer
+from datastream.local_kinesis import LocalKinesis
+from datastream.partitioning import KeyPartitioner, ThroughputTracker
+from datastream.windows import WindowAggregator, parse_windows
+from .management.commands import consume_stream
+from .management.commands.consume_stream import Command as ConsumeStreamCommand
+from .aggregates import merge_window_rows
+from .models import StreamData, LambdaInvocation, StatCounter, WindowAggregate
+from .pagination import keyset_page
+from .retention import archive_and_purge, read_archive
+from .views import _iter_bulk_events
+from .write_behind import WriteBehindQueue
 
-# Create your tests here.
+# A plan line that reads a whole table instead of an index
+FULL_SCANS = {
+    'sqlite': re.compile(r'\bSCAN (TABLE )?(?P<table>\w+)$'),
+    'postgresql': re.compile(r'Seq Scan on (?P<table>\w+)'),
+}
+EXPLAIN = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+class QueryPlanTests(TestCase):
+    """
+    The dashboard and stream data pages must not scan StreamData or
+    LambdaInvocation in full (see the indexes on those models)
+    """
+    tables = {StreamData._meta.db_table, LambdaInvocation._meta.db_table}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner', password='planner')
+        StreamData.objects.bulk_create(
+            StreamData(
+                stream_id=f'plan-{i}',
+                partition_key=f'pk-{i % 10}',
+                data_content={'data_type': 'sensor', 'sensor_id': f'sensor-{i % 7}', 'value': i},
+                processed=i % 3 == 0,
+            )
+            for i in range(200)
+        )
+        for i in range(20):
+            LambdaInvocation.objects.create(
+                function_name='stream-processor',
+                invocation_id=f'plan-{i}',
+                status='success' if i % 4 else 'error',
+            )
+
+    def setUp(self):
+        if connection.vendor not in EXPLAIN:
+            self.skipTest(f'No query plan check for {connection.vendor}')
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are cheaper to scan; ask for the index plan
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+        self.client.force_login(self.user)
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(EXPLAIN[connection.vendor] + sql)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        pattern = FULL_SCANS[connection.vendor]
+        return [line for line in plan
+                if (match := pattern.search(line.strip())) and match.group('table') in self.tables]
+
+    def table_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and any(f'"{table}"' in query['sql'] for table in self.tables)
+        ]
+
+    def assertNoFullScans(self, url):
+        queries = self.table_queries(url)
+        self.assertGreater(len(queries), 0)
+        for sql in queries:
+            self.assertEqual(self.full_scans(self.plan(sql)), [], sql)
+
+    def test_dashboard(self):
+        # Totals come from StatCounter, not the tables
+        self.assertEqual(self.table_queries(reverse('dashboard')), [])
+
+    def test_stream_data_view(self):
+        self.assertNoFullScans(reverse('stream-data'))
+        page = keyset_page(StreamData.objects.all(), None, 100)
+        self.assertNoFullScans(reverse('stream-data') + f'?cursor={page.next_cursor}')
+        self.assertNoFullScans(reverse('stream-data') + f'?cursor={page.previous_cursor or page.next_cursor}')
+
+    def test_stream_data_api(self):
+        queries = self.table_queries(reverse('api-get-stream-data') + '?limit=50')
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql.upper()])
+        self.assertNoFullScans(reverse('api-get-stream-data') + '?limit=50')
+
+    def test_promoted_field_filters(self):
+        for queryset in (
+            StreamData.objects.filter(data_type='sensor', value__gt=50),
+            StreamData.objects.filter(sensor_id='sensor-3').order_by('-timestamp')[:20],
+            StreamData.objects.filter(level='ERROR').order_by('-timestamp')[:20],
+        ):
+            self.assertEqual(self.full_scans(queryset.explain().splitlines()), [], str(queryset.query))
+        self.assertNoFullScans(reverse('api-get-stream-data') + '?data_type=sensor&min_value=50')
+
+    def test_partition_key_lookup(self):
+        queryset = StreamData.objects.filter(partition_key='pk-3').order_by('-timestamp')[:20]
+        self.assertEqual(self.full_scans(queryset.explain().splitlines()), [])
+
+    def test_lambda_invocations_by_status(self):
+        queryset = LambdaInvocation.objects.filter(status='error').order_by('-timestamp')
+        self.assertEqual(self.full_scans(queryset.explain().splitlines()), [])
+
+
+class StatCounterTests(TestCase):
+    """
+    The dashboard counters follow every write path and can be reconciled
+    """
+
+    def assertCounts(self):
+        self.assertEqual(
+            StatCounter.totals(['stream_data', 'stream_data_processed', 'lambda_invocations']),
+            {
+                'stream_data': StreamData.objects.count(),
+                'stream_data_processed': StreamData.objects.filter(processed=True).count(),
+                'lambda_invocations': LambdaInvocation.objects.count(),
+            }
+        )
+
+    def test_write_paths(self):
+        StreamData.objects.create(stream_id='c-0', partition_key='pk', data_content={})
+        StreamData.objects.bulk_create(
+            StreamData(stream_id=f'c-{i}', partition_key='pk', data_content={}, processed=i % 2 == 0)
+            for i in range(1, 11)
+        )
+        LambdaInvocation.objects.create(function_name='f', invocation_id='i', status='SUCCESS')
+        self.assertCounts()
+
+        StreamData.objects.filter(stream_id__in=['c-1', 'c-2', 'c-3'], processed=False).update(processed=True)
+        self.assertCounts()
+        stream = StreamData.objects.get(stream_id='c-2')
+        stream.processed = False
+        stream.save()
+        self.assertCounts()
+        StreamData.objects.filter(stream_id__in=['c-0', 'c-1']).update(processed=False, lambda_invoked=True)
+        self.assertCounts()
+
+        stream.delete()
+        StreamData.objects.filter(processed=True).delete()
+        LambdaInvocation.objects.all().delete()
+        self.assertCounts()
+
+    def test_reconcile(self):
+        StreamData.objects.create(stream_id='r-0', partition_key='pk', data_content={}, processed=True)
+        StatCounter.objects.filter(name='stream_data').delete()
+        StatCounter.objects.create(name='stream_data', slot=3, value=42)
+
+        result = StatCounter.reconcile(StreamData)
+
+        self.assertEqual(result['stream_data'], (42, 1))
+        self.assertEqual(result['stream_data_processed'], (1, 1))
+        self.assertCounts()
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Cursor pages cover every row once, in order, including timestamp ties
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pager', password='pager')
+        StreamData.objects.bulk_create(
+            StreamData(stream_id=f'page-{i}', partition_key='pk', data_content={'i': i})
+            for i in range(45)
+        )
+        # Groups of identical timestamps, so the id has to break ties
+        base = timezone.now()
+        for stream in StreamData.objects.all():
+            StreamData.objects.filter(pk=stream.pk).update(timestamp=base - timedelta(seconds=stream.pk // 4))
+        cls.expected = list(StreamData.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+
+    def test_forward_and_back(self):
+        pages = [keyset_page(StreamData.objects.all(), None, 10)]
+        while pages[-1].has_next:
+            pages.append(keyset_page(StreamData.objects.all(), pages[-1].next_cursor, 10))
+        self.assertEqual([stream.id for page in pages for stream in page], self.expected)
+        self.assertFalse(pages[0].has_previous)
+
+        back = keyset_page(StreamData.objects.all(), pages[-1].previous_cursor, 10)
+        self.assertEqual([stream.id for stream in back], [stream.id for stream in pages[-2]])
+        self.assertEqual(back.next_cursor, pages[-2].next_cursor)
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        url = reverse('api-get-stream-data')
+        seen = []
+        cursor = ''
+        while True:
+            body = self.client.get(url, {'limit': 7, 'cursor': cursor}).json()
+            seen += [row['id'] for row in body['results']]
+            if not body['next']:
+                break
+            cursor = body['next']
+        self.assertEqual(seen, self.expected)
+
+    def test_api_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('api-get-stream-data'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PromotedFieldTests(TestCase):
+    """
+    Promoted columns follow data_content on every write path
+    """
+    content = {'data_type': 'metric', 'metric_name': 'cpu_usage', 'value': 91, 'level': None}
+    expected = {
+        'data_type': 'metric', 'sensor_id': None, 'metric_name': 'cpu_usage',
+        'value': 91.0, 'level': None, 'severity': None,
+    }
+
+    def promoted(self, stream_id):
+        return StreamData.objects.filter(stream_id=stream_id).values(*StreamData.PROMOTED_FIELDS).get()
+
+    def test_write_paths(self):
+        StreamData.objects.create(stream_id='p-0', partition_key='pk', data_content=self.content)
+        StreamData.objects.bulk_create([StreamData(stream_id='p-1', partition_key='pk', data_content=self.content)])
+        self.assertEqual(self.promoted('p-0'), self.expected)
+        self.assertEqual(self.promoted('p-1'), self.expected)
+
+        StreamData.objects.filter(stream_id='p-1').update(data_content={'data_type': 'log', 'level': 'ERROR'})
+        self.assertEqual(self.promoted('p-1')['level'], 'ERROR')
+        self.assertIsNone(self.promoted('p-1')['value'])
+
+        stream = StreamData.objects.get(stream_id='p-0')
+        stream.data_content = {'value': 'not a number', 'sensor_id': 17}
+        stream.save(update_fields=['data_content'])
+        self.assertEqual(self.promoted('p-0'), dict(dict.fromkeys(self.expected), sensor_id='17'))
+
+    def test_backfill(self):
+        StreamData.objects.create(stream_id='b-0', partition_key='pk', data_content=self.content)
+        # As written before the columns existed
+        StreamData.objects.filter(stream_id='b-0').update(**dict.fromkeys(StreamData.PROMOTED_FIELDS))
+
+        call_command('backfill_promoted_fields', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(self.promoted('b-0'), self.expected)
+
+
+class RetentionTests(TestCase):
+    """
+    Old rows move to the Parquet archive in chunks and can be read back
+    """
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        self.now = timezone.now()
+        StreamData.objects.bulk_create(
+            StreamData(
+                stream_id=f'old-{i}', partition_key='pk', processed=i % 2 == 0,
+                data_content={'data_type': 'sensor' if i % 3 else 'log', 'value': i},
+            )
+            for i in range(30)
+        )
+        # Spread over the last 15 days, two rows a day
+        for stream in StreamData.objects.all():
+            StreamData.objects.filter(pk=stream.pk).update(
+                timestamp=self.now - timedelta(days=int(stream.stream_id[4:]) // 2, hours=1)
+            )
+
+    def test_archive_and_purge(self):
+        cutoff = self.now - timedelta(days=7)
+        old = set(StreamData.objects.filter(timestamp__lt=cutoff).values_list('stream_id', flat=True))
+
+        stats = archive_and_purge(cutoff, self.archive_dir, chunk_size=4)
+
+        self.assertEqual(stats['deleted'], len(old))
+        self.assertEqual(stats['archived'], len(old))
+        self.assertFalse(StreamData.objects.filter(timestamp__lt=cutoff).exists())
+        self.assertEqual(
+            StatCounter.totals(['stream_data'])['stream_data'], StreamData.objects.count()
+        )
+
+        archived = read_archive(self.archive_dir)
+        self.assertEqual(set(archived['stream_id']), old)
+        self.assertTrue(archived['timestamp'].is_monotonic_increasing)
+
+        start, end = self.now - timedelta(days=12), self.now - timedelta(days=9)
+        window = read_archive(self.archive_dir, start, end, filters=[('data_type', '=', 'sensor')])
+        self.assertTrue(len(window))
+        self.assertTrue(((window['timestamp'] >= start) & (window['timestamp'] < end)).all())
+        self.assertEqual(set(window['data_type']), {'sensor'})
+
+    def test_rerun_does_not_duplicate(self):
+        cutoff = self.now - timedelta(days=7)
+        archive_and_purge(cutoff, self.archive_dir, chunk_size=4, max_chunks=1)
+        archive_and_purge(cutoff, self.archive_dir, chunk_size=4)
+        archived = read_archive(self.archive_dir)
+        self.assertEqual(len(archived), archived['stream_id'].nunique())
+
+
+class WriteBehindTests(TransactionTestCase):
+    """
+    The write-behind queue flushes on size, on its interval and at close
+    """
+
+    def queue(self, **kwargs):
+        kwargs.setdefault('batch_size', 100)
+        kwargs.setdefault('flush_interval', 60)
+        queue = WriteBehindQueue(StreamData, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def rows(self, *stream_ids):
+        return [StreamData(stream_id=stream_id, partition_key='pk', data_content={}) for stream_id in stream_ids]
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('Timed out waiting for the writer thread')
+            time.sleep(0.01)
+
+    def test_full_batch_is_flushed(self):
+        queue = self.queue(batch_size=3)
+        for row in self.rows('a', 'b', 'c'):
+            queue.add(row)
+        self.wait_for(lambda: queue.flushed == 3)
+        self.assertEqual(StreamData.objects.count(), 3)
+
+    def test_interval_flushes_partial_batch(self):
+        queue = self.queue(flush_interval=0.05)
+        queue.add(self.rows('a')[0])
+        self.wait_for(lambda: queue.flushed == 1)
+        self.assertEqual(queue.stats(), {'depth': 0, 'max_depth': 1, 'flushed': 1, 'failed': 0})
+
+    def test_idle_wakeups_keep_the_connection(self):
+        with mock.patch('mainapp.write_behind.connection') as connection:
+            queue = self.queue(flush_interval=0.01)
+            queue.add(self.rows('a')[0])
+            self.wait_for(lambda: connection.close.called)
+            time.sleep(0.1)
+        self.assertEqual(connection.close.call_count, 1)
+
+    def test_bulk_failure_saves_rows_one_by_one(self):
+        StreamData.objects.create(stream_id='taken', partition_key='pk', data_content={})
+        queue = self.queue()
+        for row in self.rows('a', 'taken', 'b'):
+            queue.add(row)
+        self.assertEqual(queue.flush(), 3)
+        self.assertEqual((queue.flushed, queue.failed), (2, 1))
+        self.assertEqual(set(StreamData.objects.values_list('stream_id', flat=True)), {'a', 'b', 'taken'})
+
+    def test_close_drains_queue(self):
+        queue = self.queue()
+        for row in self.rows('a', 'b'):
+            queue.add(row)
+        queue.close()
+        self.assertEqual(queue.depth, 0)
+        self.assertEqual(StreamData.objects.count(), 2)
+
+
+def parse_bulk(body):
+    return list(_iter_bulk_events(BytesIO(body)))
+
+
+class BulkIngestTests(TestCase):
+    """
+    The bulk endpoint's streaming parser and per-event results
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('bulk', password='bulk')
+        self.client.force_login(self.user)
+        self.kinesis = LocalKinesis(shard_count=1, enforce_limits=False)
+        producer = KinesisDataProducer(
+            client=self.kinesis, stream_name='test',
+            partitioner=KeyPartitioner(), tracker=ThroughputTracker()
+        )
+        patcher = mock.patch('mainapp.views.get_default_producer', return_value=producer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, body):
+        return self.client.post(reverse('api-send-stream-bulk'), body, content_type='application/x-ndjson')
+
+    def test_ndjson_with_bad_line(self):
+        events = parse_bulk(b'{"a": 1}\n\n{"a": \n{"a": 3}')
+        self.assertEqual([event for event, _ in events], [{'a': 1}, None, {'a': 3}])
+        self.assertIsNotNone(events[1][1])
+
+    def test_array_across_chunk_boundary(self):
+        items = [{'i': i, 'pad': 'x' * 100} for i in range(1000)]
+        body = json.dumps(items).encode()
+        self.assertGreater(len(body), 64 * 1024)
+        self.assertEqual(parse_bulk(body), [(item, None) for item in items])
+        # A number cut at the boundary must not parse short
+        numbers = b'[' + b' ' * (64 * 1024 - 4) + b'12345]'
+        self.assertEqual(parse_bulk(numbers), [(12345, None)])
+
+    def test_truncated_array(self):
+        self.assertEqual(parse_bulk(b'[{"a": 1}, {"a": 2}'), [
+            ({'a': 1}, None), ({'a': 2}, None), (None, 'Unterminated JSON array')
+        ])
+        self.assertEqual(parse_bulk(b'[]'), [])
+
+    def test_results_in_order(self):
+        response = self.post(b'{"value": 1}\n[1, 2]\nnot json\n{"value": 2, "partition_key": "p"}\n')
+        body = response.json()
+        self.assertFalse(body['success'])
+        self.assertEqual((body['count'], body['failed']), (4, 2))
+        self.assertEqual([r['success'] for r in body['results']], [True, False, False, True])
+        self.assertEqual(body['results'][1]['error'], 'Event must be a JSON object')
+        self.assertEqual(
+            sorted(StreamData.objects.values_list('stream_id', flat=True)),
+            sorted([body['results'][0]['sequence_number'], body['results'][3]['sequence_number']])
+        )
+        self.assertEqual(StreamData.objects.get(data_content__value=2).data_content['sender'], 'bulk')
+
+    def test_truncated_array_is_not_success(self):
+        body = self.post(b'[{"value": 1}').json()
+        self.assertFalse(body['success'])
+        self.assertEqual(body['results'][-1], {'index': 1, 'success': False, 'error': 'Unterminated JSON array'})
+
+    def test_too_many_events(self):
+        with mock.patch('mainapp.views.BULK_MAX_EVENTS', 3):
+            response = self.post(b'{"v": 1}\n' * 4)
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(self.post(b'{"v": 1}\n' * 3).json()['count'], 3)
+        self.assertEqual(StreamData.objects.count(), 3)
+
+
+def window_rows(*records, windows='60'):
+    aggregator = WindowAggregator(parse_windows(windows), clock=lambda: 0.0)
+    for record in records:
+        aggregator.add(dict(record, data_type='sensor'), 'key')
+    return aggregator.flush(force=True)
+
+
+class MergeWindowRowsTests(TestCase):
+    """
+    Flushed window rows are merged into what WindowAggregate already holds
+    """
+
+    def aggregate(self, field, window_start=0):
+        window_start = window_rows({'timestamp': window_start})[0]['window_start']
+        return WindowAggregate.objects.get(window_seconds=60, window_start=window_start, field=field)
+
+    def test_new_windows_are_created(self):
+        rows = window_rows({'timestamp': 10, 'value': 3}, {'timestamp': 20, 'value': 5}, {'timestamp': 70})
+        self.assertEqual(merge_window_rows(rows), 3)
+        self.assertEqual(merge_window_rows([]), 0)
+        self.assertEqual(WindowAggregate.objects.count(), 3)
+
+        value = self.aggregate('value')
+        self.assertEqual((value.record_count, value.value_sum, value.value_min, value.value_max), (2, 8, 3, 5))
+        self.assertEqual(value.value_mean, 4)
+        self.assertEqual(self.aggregate('').record_count, 2)
+        self.assertEqual(self.aggregate('', window_start=60).record_count, 1)
+
+    def test_existing_windows_are_extended(self):
+        merge_window_rows(window_rows({'timestamp': 10, 'value': 3}, {'timestamp': 20, 'value': 5}))
+        merge_window_rows(window_rows({'timestamp': 30, 'value': 1}, {'timestamp': 40}))
+        merge_window_rows(window_rows({'timestamp': 50, 'value': 9}, windows='60,120'))
+
+        value = self.aggregate('value')
+        self.assertEqual((value.record_count, value.value_sum, value.value_min, value.value_max), (4, 18, 1, 9))
+        self.assertEqual(self.aggregate('').record_count, 5)
+        self.assertEqual(WindowAggregate.objects.filter(window_seconds=120).count(), 2)
+
+
+class ConsumeStreamTests(TestCase):
+    """
+    consume_stream skips records it cannot process and checkpoints past them
+    """
+
+    def setUp(self):
+        self.client = LocalKinesis(shard_count=1, enforce_limits=False)
+        self.command = ConsumeStreamCommand()
+        self.command.windows = WindowAggregator()
+        self.checkpoints = MemoryCheckpointStore()
+        # Would close the test transaction's connection
+        patcher = mock.patch('mainapp.management.commands.consume_stream.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_skips_bad_records(self):
+        payloads = [default_codec.encode({'value': 1}), b'[1, 2, 3]', b'\x00garbage',
+                    default_codec.encode({'value': 2})]
+        response = self.client.put_records(StreamName='test', Records=[
+            {'Data': payload, 'PartitionKey': 'key'} for payload in payloads
+        ])
+        sequences = [r['SequenceNumber'] for r in response['Records']]
+        StreamData.objects.bulk_create(
+            StreamData(stream_id=sequence, partition_key='key', data_content={}) for sequence in sequences
+        )
+
+        consumer = StreamConsumer(self.client, 'test', self.checkpoints, self.command.process_records)
+        consumer.refresh()
+        consumer.poll_shard('shardId-000000000000')
+
+        self.assertEqual(self.checkpoints.load(), {'shardId-000000000000': (sequences[-1], False)})
+        self.assertEqual(
+            set(StreamData.objects.filter(processed=True).values_list('stream_id', flat=True)),
+            {sequences[0], sequences[-1]}
+        )
+
+    def window_count(self):
+        # Records counted by the 60 s tumbling window
+        rows = self.command.windows.flush(force=True)
+        return sum(row['count'] for row in rows if row['window_seconds'] == 60 and row['field'] == '')
+
+    def test_failed_batch_is_not_counted_twice(self):
+        response = self.client.put_records(StreamName='test', Records=[
+            {'Data': default_codec.encode({'value': i}), 'PartitionKey': 'key'} for i in range(3)
+        ])
+        update = StreamData.objects.filter
+        failures = [DatabaseError('database is locked')]
+
+        def filter(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return update(*args, **kwargs)
+
+        consumer = StreamConsumer(self.client, 'test', self.checkpoints, self.command.process_records)
+        consumer.refresh()
+        with mock.patch.object(StreamData.objects, 'filter', filter):
+            self.assertEqual(consumer.poll_shard('shardId-000000000000'), 0)
+            self.assertEqual(self.command.windows.open_windows, 0)
+            consumer.poll_shard('shardId-000000000000')
+
+        self.assertEqual(self.checkpoints.load()['shardId-000000000000'][0], response['Records'][-1]['SequenceNumber'])
+        self.assertEqual(self.window_count(), 3)
+
+    def test_failed_window_merge_is_retried(self):
+        with mock.patch.object(consume_stream, 'merge_window_rows', side_effect=DatabaseError('database is locked')):
+            self.command.merge_windows(window_rows({'timestamp': 10}, {'timestamp': 20}))
+        self.assertEqual(len(self.command.unmerged_rows), 1)
+        self.assertFalse(WindowAggregate.objects.exists())
+
+        self.command.merge_windows(window_rows({'timestamp': 30}))
+        self.assertEqual(self.command.unmerged_rows, [])
+        self.assertEqual(WindowAggregate.objects.get(field='').record_count, 3)
+
+    def test_supervise_restarts_exited_children(self):
+        crashed, running, restarted = mock.Mock(), mock.Mock(), mock.Mock()
+        crashed.poll.return_value = 1
+        running.poll.return_value = None
+        handlers = {}
+        # The restarted child is polled on the next round; stop there
+        restarted.poll.side_effect = lambda: handlers[consume_stream.signal.SIGTERM]()
+
+        with mock.patch.object(consume_stream.subprocess, 'Popen', side_effect=[crashed, running, restarted]) as popen, \
+                mock.patch.object(consume_stream.signal, 'signal', handlers.__setitem__), \
+                mock.patch.object(consume_stream, 'SUPERVISE_INTERVAL', 0):
+            self.command.supervise({'processes': 2, 'initial_position': 'LATEST', 'batch_size': 100,
+                                    'poll_interval': 1.0, 'stream': None})
+
+        self.assertEqual([call.args[0][-2:] for call in popen.call_args_list],
+                         [['--group', '0'], ['--group', '1'], ['--group', '0']])
+        for child in (running, restarted):
+            child.terminate.assert_called()
+            child.wait.assert_called()
@@ -2,13 +2,23 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
+from django.conf import settings
+from django.utils import timezone
 import json
-import boto3
+import codecs
 from aws_config import AWSConfig
-from .models import StreamData, LambdaInvocation
-from datetime import datetime  
+from datastream.clients import get_kinesis_client, get_lambda_client
+from datastream.kinesis_producer import get_default_producer
+from .models import StreamData, LambdaInvocation, StatCounter
+from .write_behind import save_stream_data, stream_data_writer
+from .aggregates import recent_activity
+from datastream.windows import parse_windows
+from datetime import datetime, timedelta  
 from utils.email_service import EmailService
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from .pagination import InvalidCursor, keyset_page
+
+# Largest page the JSON API returns
+API_MAX_PAGE_SIZE = 100
 
 def home(request):
     """
@@ -22,15 +32,23 @@ def home(request):
 
 @login_required
 def dashboard(request):
-    # Get statistics
-    total_streams = StreamData.objects.count()
-    processed_streams = StreamData.objects.filter(processed=True).count()
-    lambda_invocations = LambdaInvocation.objects.count()
+    # Get statistics (materialized counters, not COUNT(*) over the tables)
+    counts = StatCounter.totals(['stream_data', 'stream_data_processed', 'lambda_invocations'])
+    total_streams = counts['stream_data']
+    processed_streams = counts['stream_data_processed']
+    lambda_invocations = counts['lambda_invocations']
+    
+    # Last hour per data type, from the smallest configured window
+    window_seconds = min(size for size, _ in parse_windows(settings.STREAM_WINDOWS))
+    window_activity = recent_activity(window_seconds, timezone.now() - timedelta(hours=1))
     
     context = {
         'total_streams': total_streams,
         'processed_streams': processed_streams,
         'lambda_invocations': lambda_invocations,
+        'pending_writes': stream_data_writer.depth,
+        'window_activity': window_activity,
+        'window_seconds': window_seconds,
         'user': request.user,
         'development_mode': AWSConfig.DEVELOPMENT_MODE
     }
@@ -38,33 +56,28 @@ def dashboard(request):
 
 @login_required
 def stream_data_view(request):
-    """View all stream data with pagination"""
-    # Get all stream data ordered by timestamp
-    streams = StreamData.objects.all().order_by('-timestamp')
-    
+    """View all stream data with cursor pagination"""
     # Count statistics
-    total_count = streams.count()
-    processed_count = streams.filter(processed=True).count()
-    pending_count = streams.filter(processed=False).count()
+    counts = StatCounter.totals(['stream_data', 'stream_data_processed'])
+    total_count = counts['stream_data']
+    processed_count = counts['stream_data_processed']
+    pending_count = total_count - processed_count
     
     # If no data exists in development mode, seed some
     if total_count == 0 and AWSConfig.DEVELOPMENT_MODE:
         self.stdout.write(self.style.WARNING("No data found. Seeding sample data..."))
         from django.core.management import call_command
         call_command('seed_data', '--quiet')
-        streams = StreamData.objects.all().order_by('-timestamp')
-        total_count = streams.count()
-    
-    # Add pagination (show 20 per page)
-    page = request.GET.get('page', 1)
-    paginator = Paginator(streams, 20)
+        counts = StatCounter.totals(['stream_data', 'stream_data_processed'])
+        total_count = counts['stream_data']
+        processed_count = counts['stream_data_processed']
+        pending_count = total_count - processed_count
     
+    # Newest first, 20 per page; the cursor picks up after the last row shown
     try:
-        streams_page = paginator.page(page)
-    except PageNotAnInteger:
-        streams_page = paginator.page(1)
-    except EmptyPage:
-        streams_page = paginator.page(paginator.num_pages)
+        streams_page = keyset_page(StreamData.objects.all(), request.GET.get('cursor'), 20)
+    except InvalidCursor:
+        streams_page = keyset_page(StreamData.objects.all(), None, 20)
     
     return render(request, 'mainapp/stream_data.html', {
         'streams': streams_page,
@@ -73,7 +86,58 @@ def stream_data_view(request):
         'pending_count': pending_count,
         'development_mode': AWSConfig.DEVELOPMENT_MODE,
         'page_obj': streams_page,
-        'is_paginated': streams_page.has_other_pages()
+        'is_paginated': streams_page.has_next or streams_page.has_previous
+    })
+
+@login_required
+def api_stream_data(request):
+    """
+    JSON page of stream data, newest first. Pass ``next``/``previous`` back
+    as ``cursor`` to move; ``limit`` sets the page size. Nothing is counted,
+    so every page costs the same.
+    
+    Filters on the promoted columns: ``data_type``, ``sensor_id``,
+    ``metric_name``, ``level``, ``severity`` (exact) and ``min_value`` /
+    ``max_value``.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = 20
+    
+    streams = StreamData.objects.all()
+    for column in StreamData.PROMOTED_FIELDS:
+        if column != 'value' and request.GET.get(column):
+            streams = streams.filter(**{column: request.GET[column]})
+    try:
+        if request.GET.get('min_value'):
+            streams = streams.filter(value__gte=float(request.GET['min_value']))
+        if request.GET.get('max_value'):
+            streams = streams.filter(value__lte=float(request.GET['max_value']))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'min_value and max_value must be numbers'}, status=400)
+    
+    try:
+        page = keyset_page(streams, request.GET.get('cursor'), limit)
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'results': [
+            {
+                'id': stream.id,
+                'stream_id': stream.stream_id,
+                'partition_key': stream.partition_key,
+                'data_content': stream.data_content,
+                'timestamp': stream.timestamp.isoformat(),
+                'processed': stream.processed,
+                'lambda_invoked': stream.lambda_invoked,
+            }
+            for stream in page
+        ],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
     })
 
 @login_required
@@ -98,23 +162,20 @@ def send_to_kinesis(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         
-        kinesis_client = AWSConfig.get_kinesis_client()
-        
         # Add metadata
         data['sender'] = request.user.username
         data['timestamp'] = datetime.now().isoformat()
         
+        partition_key = data.get('partition_key', 'default')
+        
         try:
-            response = kinesis_client.put_record(
-                StreamName=AWSConfig.KINESIS_STREAM_NAME,
-                Data=json.dumps(data),
-                PartitionKey=data.get('partition_key', 'default')
-            )
+            response = get_default_producer().put_record(data)
+            partition_key = response['PartitionKey']
             
             # Save to database
-            StreamData.objects.create(
+            save_stream_data(
                 stream_id=response['SequenceNumber'],
-                partition_key=data.get('partition_key', 'default'),
+                partition_key=partition_key,
                 data_content=data,
                 processed=False
             )
@@ -129,9 +190,9 @@ def send_to_kinesis(request):
                 import random
                 mock_sequence = f"MOCK-{random.randint(1000000000000, 9999999999999)}"
                 
-                StreamData.objects.create(
+                save_stream_data(
                     stream_id=mock_sequence,
-                    partition_key=data.get('partition_key', 'default'),
+                    partition_key=partition_key,
                     data_content=data,
                     processed=False
                 )
@@ -149,17 +210,154 @@ def send_to_kinesis(request):
     
     return JsonResponse({'error': 'Invalid request method'}, status=400)
 
+# Upper bound on events accepted by one bulk request
+BULK_MAX_EVENTS = 10000
+
+def _iter_bulk_events(request):
+    """
+    Yield (event, error) pairs from an NDJSON or JSON-array request body,
+    reading the body incrementally instead of loading it with json.loads
+    """
+    decoder = json.JSONDecoder()
+    first = request.read(1)
+    while first and first.isspace():
+        first = request.read(1)
+    
+    if first != b'[':
+        # NDJSON: one object per line
+        pending = first
+        for line in request:
+            line = pending + line
+            pending = b''
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError as e:
+                yield None, str(e)
+        if pending.strip():
+            try:
+                yield json.loads(pending), None
+            except ValueError as e:
+                yield None, str(e)
+        return
+    
+    # JSON array: decode one element at a time from a rolling buffer
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    exhausted = False
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            event, end = decoder.raw_decode(buffer)
+        except ValueError as e:
+            if exhausted:
+                # Body ended before the closing bracket
+                yield None, str(e) if buffer else 'Unterminated JSON array'
+                return
+            chunk = request.read(64 * 1024)
+            if not chunk:
+                exhausted = True
+            buffer += utf8.decode(chunk, final=exhausted)
+            continue
+        # A number or literal cut off at the chunk boundary would parse short
+        if end == len(buffer) and not exhausted:
+            chunk = request.read(64 * 1024)
+            if chunk:
+                buffer += utf8.decode(chunk)
+                continue
+            exhausted = True
+        buffer = buffer[end:]
+        yield event, None
+
+@login_required
+def send_to_kinesis_bulk(request):
+    """
+    Bulk ingest: NDJSON or a JSON array of events in one request.
+
+    Events go to Kinesis in PutRecords batches and are persisted with one
+    bulk_create; the response has one result per event, in order.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=400)
+    
+    timestamp = datetime.now().isoformat()
+    results = []
+    events = []
+    for index, (data, error) in enumerate(_iter_bulk_events(request)):
+        if index >= BULK_MAX_EVENTS:
+            return JsonResponse({
+                'success': False,
+                'error': f'Too many events (max {BULK_MAX_EVENTS})'
+            }, status=413)
+        if error is None and not isinstance(data, dict):
+            error = 'Event must be a JSON object'
+        if error:
+            results.append({'index': index, 'success': False, 'error': error})
+            continue
+        
+        # Add metadata
+        data['sender'] = request.user.username
+        data['timestamp'] = timestamp
+        results.append({'index': index, 'success': True})
+        events.append((results[-1], data))
+    
+    records = None
+    try:
+        producer = get_default_producer()
+        records = [producer.build_record(data) for _, data in events]
+        outcomes = producer.send_records(records)['Records'] if records else []
+    except Exception as e:
+        outcomes = [{'ErrorCode': 'TransportError', 'ErrorMessage': str(e)}] * len(events)
+    if records is None:
+        # No producer to key the records; the rows keep the caller's key
+        records = [{'PartitionKey': str(data.get('partition_key') or 'default')} for _, data in events]
+    
+    rows = []
+    for (result, data), record, outcome in zip(events, records, outcomes):
+        if 'ErrorCode' in outcome:
+            # In development mode, create mock response
+            if AWSConfig.DEVELOPMENT_MODE:
+                import random
+                outcome = {'SequenceNumber': f"MOCK-{random.randint(1000000000000, 9999999999999)}"}
+                result['mock'] = True
+            else:
+                result.update(success=False, error=outcome['ErrorCode'])
+                continue
+        
+        result['sequence_number'] = outcome['SequenceNumber']
+        rows.append(StreamData(
+            stream_id=outcome['SequenceNumber'],
+            partition_key=record['PartitionKey'],
+            data_content=data,
+            processed=False
+        ))
+    
+    # Save to database in one statement per 500 rows
+    StreamData.objects.bulk_create(rows, batch_size=500)
+    
+    failed = sum(1 for result in results if not result['success'])
+    return JsonResponse({
+        'success': failed == 0,
+        'count': len(results),
+        'failed': failed,
+        'results': results
+    })
+
 @login_required
 def invoke_lambda(request):
     if request.method == 'POST':
         payload = {
             'action': 'process_stream',
             'timestamp': datetime.now().isoformat(),
-            'invoked_by': request.user.username
+            'invoked_by': request.user.username,
+            'response_mode': 'summary'
         }
         
         try:
-            lambda_client = AWSConfig.get_lambda_client()
+            lambda_client = get_lambda_client()
             
             response = lambda_client.invoke(
                 FunctionName=AWSConfig.LAMBDA_FUNCTION_NAME,
@@ -170,6 +368,12 @@ def invoke_lambda(request):
             # Process response
             if 'Payload' in response:
                 output = json.loads(response['Payload'].read())
+                # Store the body as JSON rather than as an escaped string
+                if isinstance(output, dict) and isinstance(output.get('body'), str):
+                    try:
+                        output['body'] = json.loads(output['body'])
+                    except ValueError:
+                        pass
             else:
                 output = {'message': 'No payload returned'}
             
@@ -241,7 +445,7 @@ def stream_status(request):
     error = None
     
     try:
-        kinesis_client = AWSConfig.get_kinesis_client()
+        kinesis_client = get_kinesis_client()
         
         # This will work in both development and production
         response = kinesis_client.describe_stream(
@@ -0,0 +1,128 @@
+# mainapp/write_behind.py
+import os
+import atexit
+import threading
+from django.conf import settings
+from django.db import connection
+from .models import StreamData
+
+
+class WriteBehindQueue:
+    """
+    Buffers unsaved model instances and writes them with bulk_create.
+
+    A background thread flushes every ``flush_interval`` seconds or as soon
+    as ``batch_size`` rows are waiting. Memory is bounded: once
+    ``max_pending`` rows are queued the caller flushes synchronously.
+    Pending rows are flushed at interpreter exit.
+    """
+
+    def __init__(self, model, batch_size=500, flush_interval=1.0, max_pending=10000):
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        self._stopped = False
+        self.flushed = 0
+        self.failed = 0
+        self.max_depth = 0
+        atexit.register(self.close)
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'flushed': self.flushed,
+            'failed': self.failed,
+        }
+
+    def add(self, obj):
+        with self._cond:
+            self._ensure_started()
+            self._pending.append(obj)
+            depth = len(self._pending)
+            self.max_depth = max(self.max_depth, depth)
+            if depth >= self.batch_size:
+                self._cond.notify()
+        if depth >= self.max_pending:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything queued so far and return how many rows that was
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if batch:
+                self._write(batch)
+            return len(batch)
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+
+    def _ensure_started(self):
+        # Lazily per process: a thread started before a fork does not survive it
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopped = False
+        threading.Thread(target=self._run, name='stream-data-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size and not self._stopped:
+                    self._cond.wait(self.flush_interval)
+                if self._stopped:
+                    return
+            if self.flush():
+                # This thread owns its own DB connection; idle wakeups leave it alone
+                connection.close()
+
+    def _write(self, batch):
+        try:
+            self.model.objects.bulk_create(batch, batch_size=self.batch_size)
+            self.flushed += len(batch)
+            return
+        except Exception as e:
+            print(f"[WRITE-BEHIND] Bulk insert of {len(batch)} rows failed, retrying one by one: {e}")
+
+        # Keep the good rows when one of them (e.g. a duplicate stream_id) is bad
+        for obj in batch:
+            try:
+                obj.save()
+                self.flushed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[WRITE-BEHIND] Dropped {self.model.__name__} row: {e}")
+
+
+stream_data_writer = WriteBehindQueue(
+    StreamData,
+    batch_size=settings.STREAM_DATA_WRITE_BATCH_SIZE,
+    flush_interval=settings.STREAM_DATA_FLUSH_INTERVAL,
+    max_pending=settings.STREAM_DATA_MAX_PENDING,
+)
+
+
+def save_stream_data(**fields):
+    """
+    Persist a StreamData row, through the write-behind queue when enabled
+    """
+    if not settings.STREAM_DATA_WRITE_BEHIND:
+        return StreamData.objects.create(**fields)
+    obj = StreamData(**fields)
+    stream_data_writer.add(obj)
+    return obj
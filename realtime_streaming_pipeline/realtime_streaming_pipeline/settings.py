@@ -103,6 +103,25 @@ KINESIS_STREAM_NAME = os.environ.get("KINESIS_STREAM_NAME")
 S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
 DEFAULT_FROM_EMAIL = os.environ.get("SES_SENDER_EMAIL")
 
+# Write-behind persistence of StreamData rows (mainapp/write_behind.py)
+STREAM_DATA_WRITE_BEHIND = os.environ.get("STREAM_DATA_WRITE_BEHIND", "True") == "True"
+STREAM_DATA_WRITE_BATCH_SIZE = int(os.environ.get("STREAM_DATA_WRITE_BATCH_SIZE", 500))
+STREAM_DATA_FLUSH_INTERVAL = float(os.environ.get("STREAM_DATA_FLUSH_INTERVAL", 1.0))
+STREAM_DATA_MAX_PENDING = int(os.environ.get("STREAM_DATA_MAX_PENDING", 10000))
+
+# Windowed aggregates kept by consume_stream: "<size>[/<slide>]" in seconds
+STREAM_WINDOWS = os.environ.get("STREAM_WINDOWS", "60,300/60")
+STREAM_WINDOW_LATENESS = float(os.environ.get("STREAM_WINDOW_LATENESS", 30))
+
+# Rows per dashboard counter (mainapp.models.StatCounter); more rows, less
+# contention between concurrent writers
+STAT_COUNTER_SLOTS = int(os.environ.get("STAT_COUNTER_SLOTS", 8))
+
+# StreamData retention (mainapp/retention.py, purge_stream_data command)
+STREAM_DATA_RETENTION_DAYS = int(os.environ.get("STREAM_DATA_RETENTION_DAYS", 30))
+STREAM_DATA_ARCHIVE_DIR = os.environ.get("STREAM_DATA_ARCHIVE_DIR", str(BASE_DIR / 'stream_archive'))
+STREAM_DATA_PURGE_CHUNK_SIZE = int(os.environ.get("STREAM_DATA_PURGE_CHUNK_SIZE", 1000))
+
 # Email Backend
 if not DEVELOPMENT_MODE:
     EMAIL_BACKEND = 'django_ses.SESBackend'
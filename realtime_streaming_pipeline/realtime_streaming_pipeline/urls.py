@@ -11,7 +11,8 @@ from userspp.views import (
 )
 from mainapp.views import (
     process_stream, get_stream_detail, home, dashboard, stream_data_view, send_to_kinesis,
-    invoke_lambda, stream_status, data_visualization, seed_sample_data
+    send_to_kinesis_bulk, invoke_lambda, stream_status, data_visualization, seed_sample_data,
+    api_stream_data
 )
 
 urlpatterns = [
@@ -49,7 +50,8 @@ urlpatterns = [
     
     # API Endpoints
     path('api/send-stream/', send_to_kinesis, name='api-send-stream'),
-    path('api/get-stream-data/', stream_data_view, name='api-get-stream-data'),
+    path('api/send-stream/bulk/', send_to_kinesis_bulk, name='api-send-stream-bulk'),
+    path('api/get-stream-data/', api_stream_data, name='api-get-stream-data'),
 ]
 
 # Serve media files in development
@@ -7,9 +7,11 @@ from .forms import UserUploadForm, UserProfileForm
 from .models import UserProfile, DataUpload
 from utils.email_service import EmailService  # Add this import
 import json
-import boto3
 from datetime import datetime  # IMPORT THIS AT THE TOP!
 from aws_config import AWSConfig
+from datastream.clients import get_s3_client
+from datastream.kinesis_producer import get_default_producer
+from mainapp.write_behind import save_stream_data
 
 # Authentication Views
 def register_view(request):
@@ -94,17 +96,11 @@ def user_submit_form(request):
         
         try:
             # Send to Kinesis (or mock in development)
-            kinesis_client = AWSConfig.get_kinesis_client()
-            
-            response = kinesis_client.put_record(
-                StreamName=AWSConfig.KINESIS_STREAM_NAME,
-                Data=json.dumps(stream_data),
-                PartitionKey=partition_key
-            )
+            response = get_default_producer().put_record(stream_data, partition_key)
+            partition_key = response['PartitionKey']
             
             # Save stream data with sequence number
-            from mainapp.models import StreamData
-            StreamData.objects.create(
+            save_stream_data(
                 stream_id=response['SequenceNumber'],
                 partition_key=partition_key,
                 data_content=stream_data,
@@ -132,8 +128,7 @@ def user_submit_form(request):
                 import random
                 mock_sequence = f"MOCK-{random.randint(1000000000000, 9999999999999)}"
                 
-                from mainapp.models import StreamData
-                StreamData.objects.create(
+                save_stream_data(
                     stream_id=mock_sequence,
                     partition_key=partition_key,
                     data_content=stream_data,
@@ -177,7 +172,7 @@ def user_upload(request):
                 # Handle file processing based on development mode
                 if not AWSConfig.DEVELOPMENT_MODE:
                     # Real AWS S3 upload
-                    s3_client = AWSConfig.get_s3_client()
+                    s3_client = get_s3_client()
                     file = request.FILES['file_path']
                     
                     try:
@@ -275,8 +270,6 @@ def user_upload(request):
 def send_upload_to_kinesis(request, upload):
     """Send upload metadata to Kinesis stream"""
     try:
-        kinesis_client = AWSConfig.get_kinesis_client()
-        
         stream_data = {
             'event_type': 'file_upload',
             'user_id': request.user.id,
@@ -294,11 +287,7 @@ def send_upload_to_kinesis(request, upload):
         if not AWSConfig.DEVELOPMENT_MODE:
             stream_data['s3_location'] = upload.kinesis_stream_id
         
-        response = kinesis_client.put_record(
-            StreamName=AWSConfig.KINESIS_STREAM_NAME,
-            Data=json.dumps(stream_data),
-            PartitionKey=str(request.user.id)
-        )
+        response = get_default_producer().put_record(stream_data, str(request.user.id))
         
         # Save stream ID
         upload.kinesis_stream_id = response['SequenceNumber']
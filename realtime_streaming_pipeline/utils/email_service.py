@@ -1,5 +1,4 @@
 # utils/email_service.py
-import boto3
 from django.conf import settings
 from aws_config import AWSConfig
 